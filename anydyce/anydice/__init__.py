@@ -17,24 +17,48 @@ r"""
 [AnyDice](https://anydice.com/)-compatible interpreter backed by [`dyce`](https://github.com/posita/dyce/) primitives.
 """
 
+import os
+import sys
+from functools import cache
+from hashlib import sha256
+from importlib.resources import files
 from pathlib import Path
 
+import lark
 from dyce.h import DEFAULT_PRECISION
 from dyce.lifecycle import experimental
 from lark import Lark
 
+from anydyce import __version__
+
 from .ast_ import Program
+from .budget import Budget, BudgetExceededError, BudgetUsage
+from .cancellation import CancellationToken, RunCancelledError
 from .interpreter import AnyDiceInterpreter, AnyDiceResultsT
+from .parse_cache import ParseCache
+from .profiler import Profiler, ProfileStats
+from .selection_cache import SelectionCache
 from .settings import Settings
 from .transformer import AnyDiceTransformer
 from .unparser import unparse
 
 __all__ = (
+    "DEFAULT_PARSE_CACHE",
     "DEFAULT_PRECISION",
+    "DEFAULT_SELECTION_CACHE",
     "AnyDiceInterpreter",
     "AnyDiceResultsT",
     "AnyDiceTransformer",
+    "Budget",
+    "BudgetExceededError",
+    "BudgetUsage",
+    "CancellationToken",
+    "ParseCache",
+    "ProfileStats",
+    "Profiler",
     "Program",
+    "RunCancelledError",
+    "SelectionCache",
     "Settings",
     "format_results",
     "parse",
@@ -42,8 +66,80 @@ __all__ = (
     "unparse",
 )
 
-_GRAMMAR: str = (Path(__file__).parent / "grammar.lark").read_text()
-_PARSER = Lark(_GRAMMAR, parser="lalr", transformer=AnyDiceTransformer())
+# Shared by `parse` and `run` unless told otherwise
+DEFAULT_PARSE_CACHE = ParseCache()
+# Shared by `run` unless told otherwise, for the life of the process (see `run`)
+DEFAULT_SELECTION_CACHE = SelectionCache()
+
+
+def _cache_dir() -> Path:
+    r"""
+    Return the platform's per-user cache directory for anydyce.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "anydyce"
+
+
+@cache
+def _parser() -> Lark:
+    r"""
+    Return the (lazily constructed) parser for AnyDice source text.
+
+    Generating LALR tables dominates the cost of constructing the parser, so Lark is asked to cache them in the user's cache directory, which makes construction by later processes roughly ten times faster.
+    The cache file is named for the grammar, the Lark version, and the Python version, so that different installations sharing the directory don't overwrite each other's cache.
+    (Lark also checks its own hash of the grammar and options before using a cache file, and regenerates any that don't match.)
+    If the cache directory can't be written, the parser is constructed without a cache.
+    """
+    grammar = _grammar()
+    transformer = AnyDiceTransformer()
+    cache_dir = _cache_dir()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return Lark(grammar, parser="lalr", transformer=transformer)
+    if not os.access(cache_dir, os.W_OK):
+        return Lark(grammar, parser="lalr", transformer=transformer)
+    grammar_digest = sha256(grammar.encode("utf-8")).hexdigest()[:16]
+    py_version = "{}{}".format(*sys.version_info[:2])
+    cache_path = (
+        cache_dir
+        / f"grammar-{grammar_digest}-lark{lark.__version__}-py{py_version}.tmp"
+    )
+    return Lark(grammar, parser="lalr", transformer=transformer, cache=str(cache_path))
+
+
+@cache
+def _grammar() -> str:
+    # Read as a package resource (rather than a file next to this one), so it's found
+    # wherever the package is installed (e.g., in a zip file)
+    return files(__name__).joinpath("grammar.lark").read_text(encoding="utf-8")
+
+
+@cache
+def _parse_version() -> str | None:
+    r"""
+    Return a digest of the package version and the grammar, or `None` if the grammar can't be read.
+
+    Parse cache keys include it, so programs cached on disk by a different version of the parser are never used.
+    If it's `None`, programs are neither looked up in nor added to parse caches.
+    """
+    try:
+        grammar = _grammar()
+    except OSError:
+        return None
+    return sha256(f"{__version__}\0{grammar}".encode()).hexdigest()
+
+
+def _parse_key(source: str) -> str | None:
+    parse_version = _parse_version()
+    if parse_version is None:
+        return None
+    return sha256(f"{parse_version}\0{source}".encode()).hexdigest()
 
 
 @experimental
@@ -110,13 +206,27 @@ def format_results(
 
 
 @experimental
-def parse(source: str) -> Program:
+def parse(
+    source: str, *, parse_cache: ParseCache | None = DEFAULT_PARSE_CACHE
+) -> Program:
     r"""
     Parses AnyDice source text into an AST [`Program`][anydyce.anydice.Program].
 
     Useful for (e.g.) passing to [`AnyDiceInterpreter.run`][anydyce.anydice.AnyDiceInterpreter.run].
+    Programs are looked up in and added to *parse_cache* (see [`ParseCache`][anydyce.anydice.ParseCache]), unless it is `None`.
     """
-    program = _PARSER.parse(source)
+    key = None if parse_cache is None else _parse_key(source)
+    if parse_cache is None or key is None:
+        return _parse(source)
+    program = parse_cache.lookup(key)
+    if program is None:
+        program = _parse(source)
+        parse_cache.store(key, program)
+    return program
+
+
+def _parse(source: str) -> Program:
+    program = _parser().parse(source)
     if isinstance(program, Program):  # expected return value of our transformer
         return program
     else:
@@ -126,12 +236,32 @@ def parse(source: str) -> Program:
 
 
 @experimental
-def run(source: str, *, settings: Settings | None = None) -> AnyDiceResultsT:
+def run(
+    source: str,
+    *,
+    settings: Settings | None = None,
+    budget: Budget | None = None,
+    cancel_token: CancellationToken | None = None,
+    profiler: Profiler | None = None,
+    parse_cache: ParseCache | None = DEFAULT_PARSE_CACHE,
+    selection_cache: SelectionCache | None = DEFAULT_SELECTION_CACHE,
+) -> AnyDiceResultsT:
     r"""
-    Shorthand for `AnyDiceInterpreter().run(parse(source), settings=settings)`, returning one `(name, distribution)` pair per `output` statement.
+    Shorthand for `AnyDiceInterpreter().run(parse(source, parse_cache=parse_cache), settings=settings, budget=budget, cancel_token=cancel_token, profiler=profiler, selection_cache=selection_cache)`, returning one `(name, distribution)` pair per `output` statement.
 
     If *settings* is provided, the interpreter mutates it during execution (e.g. when the program contains `set "anydyce: display precision" to ...`), so the caller can observe its final state (e.g. via [`format_results`][anydyce.anydice.format_results] reading `settings.display_precision`).
 
+    Selections from pools of dice (e.g., by `@` or `[highest N of D]`) are looked up in and added to *selection_cache* (see [`SelectionCache`][anydyce.anydice.SelectionCache]), unless it is `None`.
+    By default, that's `DEFAULT_SELECTION_CACHE`, which is shared by every call for the life of the process, so selections made by one run (up to a few megabytes' worth) are kept for later ones.
+    Pass `selection_cache=None` to keep nothing between runs, call `DEFAULT_SELECTION_CACHE.clear()` to release what's kept, or set `DEFAULT_SELECTION_CACHE.max_values` to bound (or, with `0`, disable) it for every call.
+
     See [`format_results`][anydyce.anydice.format_results], [`parse`][anydyce.anydice.parse], and [`AnyDiceInterpreter.run`][anydyce.anydice.AnyDiceInterpreter.run] for additional detail.
     """
-    return AnyDiceInterpreter().run(parse(source), settings=settings)
+    return AnyDiceInterpreter().run(
+        parse(source, parse_cache=parse_cache),
+        settings=settings,
+        budget=budget,
+        cancel_token=cancel_token,
+        profiler=profiler,
+        selection_cache=selection_cache,
+    )
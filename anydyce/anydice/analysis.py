@@ -0,0 +1,320 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+Static analyses over the AnyDice AST used by the interpreter to decide when work can be safely reused.
+"""
+
+from collections.abc import Iterable, Iterator, Mapping
+
+from .ast_ import (
+    BinOp,
+    Call,
+    DiceBinOp,
+    DiceUnary,
+    EmptySeq,
+    Expr,
+    FunctionDef,
+    HashOp,
+    IfStmt,
+    LoopStmt,
+    NegOp,
+    NotOp,
+    Number,
+    OutputStmt,
+    Param,
+    PosOp,
+    RangeElem,
+    RangeRepeatElem,
+    ResultStmt,
+    SeqExpr,
+    SetStmt,
+    Stmt,
+    StringExpr,
+    StrVar,
+    ValueElem,
+    ValueRepeatElem,
+    Var,
+    VarAssign,
+)
+
+__all__ = (
+    "assigned_names",
+    "called_shapes",
+    "child_exprs",
+    "expr_facts",
+    "has_calls",
+    "is_constant",
+    "read_names",
+    "reads_only_assigned",
+    "symmetric_uses",
+)
+
+ShapeT = tuple[str | None, ...]
+# (names read, whether any function is called) -- see `expr_facts`
+ExprFactsT = tuple[frozenset[str], bool]
+
+
+def child_exprs(node: Expr) -> Iterator[Expr]:  # ruff: ignore[complex-structure]
+    r"""Yield the direct sub-expressions of *node* (not recursively)."""
+    if isinstance(node, BinOp):
+        yield node.left
+        yield node.right
+    elif isinstance(node, DiceBinOp):
+        yield node.n
+        yield node.faces
+    elif isinstance(node, DiceUnary):
+        yield node.faces
+    elif isinstance(node, (HashOp, NegOp, NotOp, PosOp)):
+        yield node.expr
+    elif isinstance(node, SeqExpr):
+        for elem in node.elems:
+            if isinstance(elem, ValueElem):
+                yield elem.expr
+            elif isinstance(elem, ValueRepeatElem):
+                yield elem.expr
+                yield elem.repeat
+            elif isinstance(elem, RangeElem):
+                yield elem.start
+                yield elem.stop
+            elif isinstance(elem, RangeRepeatElem):
+                yield elem.start
+                yield elem.stop
+                yield elem.repeat
+    elif isinstance(node, Call):
+        for part in node.parts:
+            if not isinstance(part, str):
+                yield part
+    elif isinstance(node, (Number, Var, EmptySeq, StringExpr)):
+        pass
+    else:  # pragma: no cover
+        raise NotImplementedError(f"unhandled expression: {type(node).__name__}")
+
+
+def read_names(node: Expr) -> Iterator[str]:
+    r"""Yield every variable name *node* reads, including string interpolations."""
+    if isinstance(node, Var):
+        yield node.name
+    elif isinstance(node, StringExpr):
+        for part in node.parts:
+            if isinstance(part, StrVar):
+                yield part.name
+    else:
+        for child in child_exprs(node):
+            yield from read_names(child)
+
+
+def _expr_calls(node: Expr) -> Iterator[Call]:
+    if isinstance(node, Call):
+        yield node
+    for child in child_exprs(node):
+        yield from _expr_calls(child)
+
+
+def has_calls(node: Expr) -> bool:
+    r"""Return whether *node* calls any function."""
+    return next(_expr_calls(node), None) is not None
+
+
+def is_constant(node: Expr) -> bool:
+    r"""
+    Return whether *node* neither reads variables nor calls functions.
+
+    Its value is then determined by the program text and the settings in effect alone.
+    """
+    return next(read_names(node), None) is None and not has_calls(node)
+
+
+def expr_facts(node: Expr, memo: dict[int, tuple[Expr, ExprFactsT]]) -> ExprFactsT:
+    r"""
+    Return the names *node* reads (see `read_names`) and whether it calls any function (see `has_calls`).
+
+    Results for *node* and its sub-expressions are memoized in *memo*, keyed by identity, so analyzing every sub-expression of a tree takes time linear in its size (rather than quadratic, as calling `read_names` and `has_calls` on each would).
+    *memo* keeps every node it holds results for alive, so identities aren't reused while it's in use.
+    """
+    entry = memo.get(id(node))
+    if entry is not None:
+        return entry[1]
+    if isinstance(node, Var):
+        facts = (frozenset((node.name,)), False)
+    elif isinstance(node, StringExpr):
+        facts = (
+            frozenset(part.name for part in node.parts if isinstance(part, StrVar)),
+            False,
+        )
+    else:
+        names: set[str] = set()
+        calls = isinstance(node, Call)
+        for child in child_exprs(node):
+            child_names, child_calls = expr_facts(child, memo)
+            names.update(child_names)
+            calls = calls or child_calls
+        facts = (frozenset(names), calls)
+    memo[id(node)] = (node, facts)
+    return facts
+
+
+def _expr_symmetric_uses(
+    node: Expr, name: str, seq_positions: Mapping[ShapeT, int], uses: list[Call]
+) -> bool:
+    if isinstance(node, Var):
+        return node.name != name
+    elif isinstance(node, StringExpr):
+        return all(not isinstance(p, StrVar) or p.name != name for p in node.parts)
+    elif isinstance(node, HashOp) and node.expr == Var(name):
+        # Every roll of the same dice has the same length
+        return True
+    elif isinstance(node, Call):
+        shape = tuple(p if isinstance(p, str) else None for p in node.parts)
+        position = seq_positions.get(shape)
+        args = [p for p in node.parts if not isinstance(p, str)]
+        if position is not None and args[position] == Var(name):
+            others = args[:position] + args[position + 1 :]
+            if all(map(is_constant, others)):
+                uses.append(node)
+                return True
+    return all(
+        _expr_symmetric_uses(child, name, seq_positions, uses)
+        for child in child_exprs(node)
+    )
+
+
+def symmetric_uses(
+    stmts: Iterable[Stmt], name: str, seq_positions: Mapping[ShapeT, int]
+) -> tuple[Call, ...] | None:
+    r"""
+    Return the calls through which *stmts* read the sequence variable *name*, if it's only ever passed as a particular argument to particular functions, or `None` if not.
+
+    *seq_positions* maps the shapes of those functions to the (zero-based) positions of those arguments among each call's arguments.
+    A call only counts if its other arguments are constant (see `is_constant`).
+    The variable may also be read by `#`, and mustn't be assigned to.
+    Nested function definitions are not descended into.
+    """
+    stmts = tuple(stmts)
+    if name in assigned_names(stmts):
+        return None
+    uses: list[Call] = []
+    for stmt in stmts:
+        for expr in _stmt_exprs(stmt):
+            if not _expr_symmetric_uses(expr, name, seq_positions, uses):
+                return None
+    return tuple(uses)
+
+
+def _stmt_exprs(stmt: Stmt) -> Iterator[Expr]:  # ruff: ignore[complex-structure]
+    if isinstance(stmt, (VarAssign, ResultStmt)):
+        yield stmt.expr
+    elif isinstance(stmt, OutputStmt):
+        yield stmt.expr
+        if stmt.name is not None:
+            yield stmt.name
+    elif isinstance(stmt, SetStmt):
+        yield stmt.value
+    elif isinstance(stmt, LoopStmt):
+        yield stmt.over
+        for sub in stmt.body:
+            yield from _stmt_exprs(sub)
+    elif isinstance(stmt, IfStmt):
+        for branch in stmt.branches:
+            yield branch.condition
+            for sub in branch.body:
+                yield from _stmt_exprs(sub)
+        if stmt.else_branch is not None:
+            for sub in stmt.else_branch.body:
+                yield from _stmt_exprs(sub)
+    elif isinstance(stmt, FunctionDef):
+        pass  # a nested definition's body runs only when called
+
+
+def assigned_names(stmts: Iterable[Stmt]) -> frozenset[str]:
+    r"""
+    Return every variable name *stmts* write, including loop variables.
+
+    Nested function definitions are not descended into, since their bodies write only to their own calls' environments.
+    """
+    names: set[str] = set()
+    for stmt in stmts:
+        if isinstance(stmt, VarAssign):
+            names.add(stmt.name)
+        elif isinstance(stmt, LoopStmt):
+            names.add(stmt.var)
+            names.update(assigned_names(stmt.body))
+        elif isinstance(stmt, IfStmt):
+            for branch in stmt.branches:
+                names.update(assigned_names(branch.body))
+            if stmt.else_branch is not None:
+                names.update(assigned_names(stmt.else_branch.body))
+    return frozenset(names)
+
+
+def called_shapes(stmts: Iterable[Stmt]) -> frozenset[ShapeT]:
+    r"""Return the pattern shapes of every call made directly by *stmts*."""
+    return frozenset(
+        tuple(p if isinstance(p, str) else None for p in call.parts)
+        for stmt in stmts
+        for expr in _stmt_exprs(stmt)
+        for call in _expr_calls(expr)
+    )
+
+
+def reads_only_assigned(func: FunctionDef) -> bool:
+    r"""
+    Return whether every variable *func*'s body reads is definitely assigned first.
+
+    Parameters count as assigned on entry.
+    A body passing this check cannot observe the caller's environment (AnyDice scoping is dynamic) or values left behind by an earlier expansion iteration of the same call.
+    Its result therefore depends only on its parameter values and on whatever the functions it calls return.
+    The check is conservative: an assignment only counts after an `if` if every branch (including an `else`) makes it, and never counts after a `loop` (whose sequence may be empty).
+    """
+    assigned = {p.name for p in func.pattern if isinstance(p, Param)}
+    return _block_reads_only_assigned(func.body, assigned)
+
+
+def _block_reads_only_assigned(  # ruff: ignore[complex-structure]
+    stmts: Iterable[Stmt], assigned: set[str]
+) -> bool:
+    r"""Check *stmts* in order, adding definite assignments to *assigned* in place."""
+    for stmt in stmts:
+        if isinstance(stmt, (VarAssign, ResultStmt, OutputStmt, SetStmt)):
+            for expr in _stmt_exprs(stmt):
+                if not assigned.issuperset(read_names(expr)):
+                    return False
+            if isinstance(stmt, VarAssign):
+                assigned.add(stmt.name)
+        elif isinstance(stmt, IfStmt):
+            branch_assigned: list[set[str]] = []
+            for branch in stmt.branches:
+                if not assigned.issuperset(read_names(branch.condition)):
+                    return False
+                inner = set(assigned)
+                if not _block_reads_only_assigned(branch.body, inner):
+                    return False
+                branch_assigned.append(inner)
+            if stmt.else_branch is not None:
+                inner = set(assigned)
+                if not _block_reads_only_assigned(stmt.else_branch.body, inner):
+                    return False
+                branch_assigned.append(inner)
+                assigned.update(set.intersection(*branch_assigned))
+        elif isinstance(stmt, LoopStmt):
+            if not assigned.issuperset(read_names(stmt.over)):
+                return False
+            if not _block_reads_only_assigned(stmt.body, {*assigned, stmt.var}):
+                return False
+        elif isinstance(stmt, FunctionDef):
+            pass
+        else:  # pragma: no cover
+            raise NotImplementedError(f"unhandled statement: {type(stmt).__name__}")
+    return True
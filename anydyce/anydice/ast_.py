@@ -13,7 +13,7 @@
 # (This does not apply to code comments.) Thank you!
 # ======================================================================================
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 __all__ = (
     "BinOp",
@@ -51,17 +51,21 @@ __all__ = (
     "VarAssign",
 )
 
+# Nodes are immutable and hashable, and hold their children in tuples, so identical
+# subtrees can be shared (the transformer shares all of them within a program), and any
+# subtree can be used as a dict key.
+
 # ---- Expression nodes ------------------------------------------------------------------
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BinOp:
     op: str
     left: "Expr"
     right: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DiceBinOp:
     r"""n d m: roll n dice of m faces."""
 
@@ -69,69 +73,69 @@ class DiceBinOp:
     faces: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DiceUnary:
     r"""d m: roll one die of m faces."""
 
     faces: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class HashOp:
     r"""#expr: count / length."""
 
     expr: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NotOp:
     expr: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class NegOp:
     expr: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class PosOp:
     expr: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Number:
     value: int
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Var:
     name: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class EmptySeq:
     pass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RangeElem:
     start: "Expr"
     stop: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class RangeRepeatElem:
     start: "Expr"
     stop: "Expr"
     repeat: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ValueElem:
     expr: "Expr"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ValueRepeatElem:
     expr: "Expr"
     repeat: "Expr"
@@ -140,31 +144,31 @@ class ValueRepeatElem:
 SeqElem = RangeElem | RangeRepeatElem | ValueElem | ValueRepeatElem
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SeqExpr:
-    elems: list[SeqElem]
+    elems: tuple[SeqElem, ...]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StrLit:
     text: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StrVar:
     name: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StringExpr:
-    parts: list[StrLit | StrVar]
+    parts: tuple[StrLit | StrVar, ...]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Call:
     r"""Function call: alternating words (str) and argument expressions (Expr)."""
 
-    parts: "list[str | Expr]"
+    parts: "tuple[str | Expr, ...]"
 
 
 Expr = (
@@ -186,62 +190,62 @@ Expr = (
 # ---- Statement nodes -------------------------------------------------------------------
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class OutputStmt:
     expr: Expr
     name: "Expr | None" = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Param:
     name: str
     type: str | None  # 'n', 'd', 's', or None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class FunctionDef:
-    r"""Pattern is a list of words (str) and parameters (Param)."""
+    r"""Pattern is a sequence of words (str) and parameters (Param)."""
 
-    pattern: list[str | Param]
-    body: "list[Stmt]"
+    pattern: tuple[str | Param, ...]
+    body: "tuple[Stmt, ...]"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LoopStmt:
     var: str
     over: Expr
-    body: "list[Stmt]"
+    body: "tuple[Stmt, ...]"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class IfBranch:
     condition: Expr
-    body: "list[Stmt]"
+    body: "tuple[Stmt, ...]"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ElseBranch:
-    body: "list[Stmt]"
+    body: "tuple[Stmt, ...]"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class IfStmt:
-    branches: list[IfBranch]
+    branches: tuple[IfBranch, ...]
     else_branch: ElseBranch | None = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SetStmt:
     key: str
     value: Expr
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ResultStmt:
     expr: Expr
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class VarAssign:
     name: str
     expr: Expr
@@ -250,6 +254,6 @@ class VarAssign:
 Stmt = OutputStmt | FunctionDef | LoopStmt | IfStmt | SetStmt | ResultStmt | VarAssign
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Program:
-    stmts: "list[Stmt]" = field(default_factory=list)
+    stmts: "tuple[Stmt, ...]" = ()
@@ -0,0 +1,166 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+Limits on the resources a single run of a program may use.
+"""
+
+from dataclasses import dataclass, fields
+from time import perf_counter
+
+from dyce import H
+
+__all__ = ("Budget", "BudgetExceededError", "BudgetMeter", "BudgetUsage")
+
+# Rough per-outcome cost of a distribution in memory (a dict slot plus an int key and
+# an int count of modest size), not counting any bytes of count beyond a machine word
+_H_ENTRY_BYTES = 100
+
+
+@dataclass(frozen=True, slots=True)
+class Budget:
+    r"""
+    Limits on a single run of a program (see [`AnyDiceInterpreter.run`][anydyce.anydice.AnyDiceInterpreter.run]).
+
+    Each limit is optional (`None` means unlimited).
+    *max_seconds* limits the wall-clock time of the run.
+    *max_steps* limits the number of steps, where each statement executed, each function call made, and each combination of values over which a function call is expanded counts as one.
+    *max_outcomes*, *max_total_weight*, and *max_bytes* limit, respectively, the number of outcomes, the total of the counts, and the estimated size in memory of any distribution the run computes.
+
+    Limits are checked between steps, so a single costly operation (e.g., summing a great many dice) isn't interrupted, but the run stops as soon as it's done.
+
+        >>> from anydyce.anydice import Budget, BudgetExceededError, run
+        >>> try:
+        ...     run("loop N over {1..100} { output N }", budget=Budget(max_steps=10))
+        ... except BudgetExceededError as exc:
+        ...     print(exc)
+        ...     print(len(exc.outputs))
+        execution budget exceeded: 11 steps (max_steps=10)
+        9
+    """
+
+    max_seconds: float | None = None
+    max_steps: int | None = None
+    max_outcomes: int | None = None
+    max_total_weight: int | None = None
+    max_bytes: int | None = None
+
+    def __post_init__(self) -> None:
+        for limit in fields(self):
+            value = getattr(self, limit.name)
+            if value is not None and value < 0:
+                raise ValueError(f"{limit.name} must be non-negative (got {value!r})")
+
+
+@dataclass(slots=True)
+class BudgetUsage:
+    r"""
+    What a run had used of its [`Budget`][anydyce.anydice.Budget].
+
+    Distribution sizes are those of the largest distribution computed.
+    """
+
+    seconds: float = 0.0
+    steps: int = 0
+    outcomes: int = 0
+    total_weight: int = 0
+    bytes: int = 0
+
+
+class BudgetExceededError(RuntimeError):
+    r"""
+    Raised when a run exceeds its [`Budget`][anydyce.anydice.Budget].
+
+    *limit* names the limit exceeded (e.g., `"max_steps"`).
+    *usage* is what the run had used by then, and *outputs* holds the `(name, distribution)` pair of each `output` statement completed by then.
+    """
+
+    def __init__(
+        self,
+        limit: str,
+        budget: Budget,
+        usage: BudgetUsage,
+        outputs: list[tuple[str, H]],
+    ) -> None:
+        used = {
+            "max_seconds": f"{usage.seconds:.3f} seconds",
+            "max_steps": f"{usage.steps} steps",
+            "max_outcomes": f"{usage.outcomes} outcomes",
+            "max_total_weight": f"a total weight of {usage.total_weight}",
+            "max_bytes": f"an estimated {usage.bytes} bytes",
+        }[limit]
+        super().__init__(
+            f"execution budget exceeded: {used} ({limit}={getattr(budget, limit)!r})"
+        )
+        self.limit = limit
+        self.budget = budget
+        self.usage = usage
+        self.outputs = outputs
+
+
+class BudgetMeter:
+    r"""
+    Tracks a run's usage of *budget*, raising a [`BudgetExceededError`][anydyce.anydice.BudgetExceededError] once any limit is exceeded.
+
+    *outputs* is the run's (growing) list of outputs, reported with the error.
+    """
+
+    __slots__ = ("_deadline", "_start", "budget", "outputs", "usage")
+
+    def __init__(self, budget: Budget, outputs: list[tuple[str, H]]) -> None:
+        self.budget = budget
+        self.outputs = outputs
+        self.usage = BudgetUsage()
+        self._start = perf_counter()
+        self._deadline = (
+            None if budget.max_seconds is None else self._start + budget.max_seconds
+        )
+
+    def step(self) -> None:
+        r"""Count one step, checking the step and time limits."""
+        usage = self.usage
+        usage.steps += 1
+        max_steps = self.budget.max_steps
+        if max_steps is not None and usage.steps > max_steps:
+            self._exceeded("max_steps")
+        if self._deadline is not None and perf_counter() > self._deadline:
+            self._exceeded("max_seconds")
+
+    def check(self, value: object) -> None:
+        r"""Check the size of *value* against the distribution limits, if it's a distribution."""
+        if not isinstance(value, H):
+            return
+        usage = self.usage
+        budget = self.budget
+        outcomes = len(value)
+        total_weight = value.total
+        est_bytes = outcomes * (_H_ENTRY_BYTES + total_weight.bit_length() // 8)
+        usage.outcomes = max(usage.outcomes, outcomes)
+        usage.total_weight = max(usage.total_weight, total_weight)
+        usage.bytes = max(usage.bytes, est_bytes)
+        if budget.max_outcomes is not None and outcomes > budget.max_outcomes:
+            self._exceeded("max_outcomes")
+        if (
+            budget.max_total_weight is not None
+            and total_weight > budget.max_total_weight
+        ):
+            self._exceeded("max_total_weight")
+        if budget.max_bytes is not None and est_bytes > budget.max_bytes:
+            self._exceeded("max_bytes")
+
+    def _exceeded(self, limit: str) -> None:
+        usage = self.usage
+        usage.seconds = perf_counter() - self._start
+        raise BudgetExceededError(limit, self.budget, usage, list(self.outputs))
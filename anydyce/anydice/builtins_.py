@@ -19,12 +19,15 @@ Each function takes and returns AnyDice runtime values.
 Type coercion is handled by the interpreter before dispatch.
 """
 
-from collections.abc import Callable
+from collections.abc import Callable, Hashable, Iterable
+from math import gcd
 from typing import Any
 
 from dyce import H, P
 
-__all__ = ("BUILTINS",)
+from .kernels import kept_sum_counts
+
+__all__ = ("BUILTINS", "SELECTIONS", "SYMMETRIC")
 
 # ---- Helpers ---------------------------------------------------------------------------
 
@@ -77,14 +80,35 @@ def _lowest_of_and(a: int, b: int) -> int:
     return min(a, b)
 
 
+def _kept_sum(pool: P, lo: int, hi: int) -> H | None:
+    # Sum of positions lo through hi - 1 of pool's dice sorted lowest first, if the
+    # pool is homogeneous (e.g., "kdX", but not most pools built by the "and"
+    # variants), or None to fall back to enumerating rolls
+    if len(set(pool)) != 1:
+        return None
+    items = sorted(pool[0].items())
+    if any(count <= 0 for _, count in items):
+        return None
+    counts = kept_sum_counts(items, len(pool), lo, hi)
+    return None if counts is None else H(counts)
+
+
 def _highest_n_of(n: int, pool: P) -> H:
     # sum of n highest dice from pool
+    if 0 < n < len(pool):
+        h = _kept_sum(pool, len(pool) - n, len(pool))
+        if h is not None:
+            return h
     selectors = tuple(slice(-(i), -(i - 1) if i > 1 else None) for i in range(1, n + 1))
     return pool.h(*selectors) if selectors else H({0: 1})
 
 
 def _lowest_n_of(n: int, pool: P) -> H:
     # sum of n lowest dice from pool
+    if 0 < n < len(pool):
+        h = _kept_sum(pool, 0, n)
+        if h is not None:
+            return h
     selectors = tuple(slice(i, i + 1) for i in range(n))
     return pool.h(*selectors) if selectors else H({0: 1})
 
@@ -102,30 +126,68 @@ def _middle_n_of(n: int, pool: P) -> H:
     if n >= total:
         return pool.h() if total > 0 else H({0: 1})
     drop = (total - n + 1) // 2
+    h = _kept_sum(pool, drop, drop + n)
+    if h is not None:
+        return h
     selectors = tuple(slice(drop + i, drop + i + 1) for i in range(n))
     return pool.h(*selectors)
 
 
-def _explode(die: H | P, depth: int) -> H:
-    r"""Explode a die: when the max face is rolled, add that value and roll again, up to `depth` extra times."""
+def _add_sums(
+    into: dict[int, int],
+    prefixes: dict[int, int],
+    faces: Iterable[tuple[int, int]],
+    scale: int = 1,
+) -> None:
+    r"""Add to *into* the weight of each sum of an outcome in *prefixes* and one in *faces*, times *scale*."""
+    faces = tuple(faces)
+    for prefix, prefix_weight in prefixes.items():
+        scaled_weight = prefix_weight * scale
+        for outcome, weight in faces:
+            combined = prefix + outcome
+            into[combined] = into.get(combined, 0) + scaled_weight * weight
+
+
+def _explode(die: H | P, depth: int, faces: Iterable[int] | None = None) -> H:
+    r"""
+    Explode a die: when one of *faces* (by default, just the max face) is rolled, add that value and roll again, up to `depth` extra times.
+
+    The result is built level by level rather than recursively, so *depth* can be large.
+    Stopping after exactly *k* explosions has a chance of (the chance of any particular run of *k* exploding faces) times (the chance of a non-exploding face), except that after `depth` explosions, any face stops.
+    Every level is weighted over the common denominator of the last, so earlier levels' weights are scaled up by a power of the die's total (reduced by any factor it shares with the exploding faces' weights), and the result is reduced to lowest terms.
+    """
     if isinstance(die, P):
         die = _h_from_pool(die)
     if not die or depth <= 0:
         return die
-    max_val = max(die.outcomes())
-    inner = _explode(die, depth - 1)
-    inner_total = sum(inner.values())
+    counts = dict(die.items())
+    explode_on = {max(counts)} if faces is None else set(faces) & counts.keys()
+    divisor = gcd(*counts.values())
+    if not explode_on or divisor == 0:
+        return die
+    counts = {outcome: count // divisor for outcome, count in counts.items()}
+    non_exploding = [(o, c) for o, c in counts.items() if o not in explode_on]
+    # Reducing the chance of each explosion (its face's weight over the die's total)
+    # keeps the levels' scale factors as small as possible
+    total = sum(counts.values())
+    divisor = gcd(total, *(counts[outcome] for outcome in explode_on))
+    exploding = [(o, counts[o] // divisor) for o in explode_on]
+    reduced_total = total // divisor
+    scale = reduced_total**depth
+    # Weights of the sums of the exploding faces rolled, for each way of exploding
+    # exactly as many times as the current level
+    sums: dict[int, int] = {0: 1}
     expanded: dict[int, int] = {}
-    for outcome, weight in die.items():
-        if outcome == max_val:
-            for inner_outcome, inner_weight in inner.items():
-                combined = outcome + inner_outcome
-                expanded[combined] = expanded.get(combined, 0) + weight * inner_weight
-        else:
-            # Scale non-explosion outcomes to match the inner distribution's total weight
-            # so that all outcomes share a common denominator.
-            expanded[outcome] = expanded.get(outcome, 0) + weight * inner_total
-    return H(expanded)
+    for _ in range(depth):
+        _add_sums(expanded, sums, non_exploding, scale)
+        next_sums: dict[int, int] = {}
+        _add_sums(next_sums, sums, exploding)
+        sums = next_sums
+        scale //= reduced_total
+    # After the last explosion, every face stops
+    _add_sums(expanded, sums, counts.items())
+    divisor = gcd(*expanded.values())
+    return H({outcome: count // divisor for outcome, count in expanded.items()})
 
 
 # ---- Registry --------------------------------------------------------------------------
@@ -214,3 +276,33 @@ BUILTINS: list[tuple[list[str | None], list[str | None], Callable[..., Any]]] =
     ),
     (["explode", None], ["d"], lambda s, die: _explode(die, s.explode_depth)),
 ]
+
+# Shapes of the builtins whose results are selections from pools of their die
+# arguments, and depend on nothing else (besides the calculation precision), so the
+# interpreter can cache them (see `SelectionCache`)
+SELECTIONS: frozenset[tuple[str | None, ...]] = frozenset(
+    (
+        ("highest", None, "of", None),
+        ("lowest", None, "of", None),
+        ("highest", None, "of", None, "and", None),
+        ("lowest", None, "of", None, "and", None),
+        ("highest", None, "of", None, "and", None, "and", None),
+        ("lowest", None, "of", None, "and", None, "and", None),
+        ("middle", None, "of", None),
+    )
+)
+
+# Builtins whose results depend on one of their sequence arguments only through how
+# many of its elements fall in each of some classes of outcomes, so the interpreter
+# can expand that argument over the counts in each class rather than over every roll
+# (e.g., `[count VALUES in SEQ]` depends on SEQ only through how many of its elements
+# appear among VALUES once, twice, etc.). Each shape maps to the (zero-based) position
+# of that argument, and to a function taking the other (bound) arguments and
+# returning each outcome's class.
+SYMMETRIC: dict[
+    tuple[str | None, ...],
+    tuple[int, Callable[..., Callable[[int], Hashable]]],
+] = {
+    ("count", None, "in", None): (1, lambda values: values.count),
+    (None, "contains", None): (0, lambda val: lambda outcome: outcome == val),
+}
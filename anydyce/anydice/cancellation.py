@@ -0,0 +1,71 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+Cooperative cancellation of runs in progress.
+"""
+
+from threading import Event
+
+from dyce import H
+
+__all__ = ("CancellationToken", "RunCancelledError")
+
+
+class CancellationToken:
+    r"""
+    A flag that any thread can set to stop the runs it was given to (see [`AnyDiceInterpreter.run`][anydyce.anydice.AnyDiceInterpreter.run]).
+
+    Runs check the flag before each statement, function call, and combination of values over which a call is expanded, and raise a [`RunCancelledError`][anydyce.anydice.RunCancelledError] once it's set.
+    A single costly operation (e.g., summing a great many dice) isn't interrupted, but the run stops as soon as it's done.
+    Once cancelled, a token stays cancelled.
+
+        >>> from anydyce.anydice import CancellationToken, RunCancelledError, run
+        >>> cancel_token = CancellationToken()
+        >>> run("output 1d6", cancel_token=cancel_token)
+        [('output 1', H({1: 1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1}))]
+        >>> cancel_token.cancel()
+        >>> try:
+        ...     run("output 1d6", cancel_token=cancel_token)
+        ... except RunCancelledError as exc:
+        ...     print(exc)
+        run cancelled
+    """
+
+    __slots__ = ("_event",)
+
+    def __init__(self) -> None:
+        self._event = Event()
+
+    @property
+    def cancelled(self) -> bool:
+        r"""Whether `cancel` has been called."""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        r"""Cancel every run given this token, whether in progress or yet to start."""
+        self._event.set()
+
+
+class RunCancelledError(RuntimeError):
+    r"""
+    Raised when a run is cancelled via its [`CancellationToken`][anydyce.anydice.CancellationToken].
+
+    *outputs* holds the `(name, distribution)` pair of each `output` statement completed by then.
+    """
+
+    def __init__(self, outputs: list[tuple[str, H]]) -> None:
+        super().__init__("run cancelled")
+        self.outputs = outputs
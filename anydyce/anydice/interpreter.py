@@ -18,14 +18,25 @@ r"""AnyDice tree-walking interpreter backed by dyce primitives."""
 import operator
 import sys
 from collections import Counter
-from collections.abc import Callable, Iterator
-from contextlib import ExitStack
-from itertools import product
+from collections.abc import Callable, Generator, Hashable, Iterable, Iterator, Mapping
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from itertools import product, starmap
+from math import comb, factorial, lcm, prod
+from types import GeneratorType
 
 from dyce import H, P, RollT, quantize_hs
 from dyce.d import dempty, dzero
-from dyce.h import aggregate_weighted
 
+from .analysis import (
+    ExprFactsT,
+    assigned_names,
+    called_shapes,
+    expr_facts,
+    reads_only_assigned,
+    symmetric_uses,
+)
 from .ast_ import (
     BinOp,
     Call,
@@ -59,8 +70,14 @@ from .ast_ import (
     Var,
     VarAssign,
 )
-from .builtins_ import BUILTINS
+from .budget import Budget, BudgetMeter
+from .builtins_ import BUILTINS, SELECTIONS, SYMMETRIC
+from .cancellation import CancellationToken, RunCancelledError
+from .kernels import convolve_counts, h_binop_counts, nfold_sum_counts
+from .profiler import Profiler
+from .selection_cache import SelectionCache, pool_key
 from .settings import Settings
+from .unparser import unparse
 
 __all__ = ("AnyDiceInterpreter",)
 
@@ -84,8 +101,34 @@ AnyDiceResultsT = list[AnyDiceResultT]
 _Val = NumT | DieT | PoolT | SeqT | str
 _CountT = int
 _ParamIndexT = int
-_ExpansionT = list[tuple[_ParamIndexT, list[tuple[_Val, _CountT]]]]
+_ExpansionItemsT = "list[tuple[_Val, _CountT]] | _PoolRolls"
+_ExpansionT = list[tuple[_ParamIndexT, _ExpansionItemsT]]
 _BoundT = list[_Val]
+_ExprFnT = Callable[[], _Val]
+# A suspendable computation, run by `_run_task`. Instead of calling a user-defined
+# function directly (nesting Python frames for every level of AnyDice recursion), a
+# task yields the task computing the call and is resumed with its result. A task's
+# return value is its own result.
+_TaskT = Generator["_TaskT", _Val, _Val]
+# A statement's task returns the value of any `result:` statement it ran (which ends
+# the enclosing function body), or `None` if execution should carry on with whatever
+# follows it
+_StmtTaskT = Generator[_TaskT, _Val, _Val | None]
+_StmtFnT = Callable[[], _StmtTaskT]
+_ExprTaskFnT = Callable[[], _TaskT]
+# Evaluates a call's arguments and starts the call, returning either its result or a
+# task computing it -- see `_compile_task`
+_CallSiteT = Callable[[], "_Val | _TaskT"]
+_ShapeT = tuple[str | None, ...]
+# (result, reach, capped_depth) -- see `_memoized`
+_CallCacheEntryT = tuple[_Val, int, int | None]
+# Python's recursion limit for the duration of a run. User-defined function calls don't
+# nest Python frames (see `_TaskT`), but compiling and evaluating expressions recurse
+# (~3 Python frames per level of nesting, so `output d2 + d2 + ...` with a few thousand
+# terms), as does `dyce.p`'s pool selection (~4 Python frames per distinct outcome of
+# the pool's dice, so dice up to ~d2500). This stays well below the C-stack overflow
+# risk zone (a Python frame is a few hundred bytes, default Linux thread stack is 8MB).
+_RECURSION_LIMIT = 10_000
 
 # ---- Operator tables ---------------------------------------------------------------------
 
@@ -135,6 +178,67 @@ class _EmptyPoolOfOne(PoolT):
         assert self._total is None
 
 
+# The calculation precision in effect for the run in progress (see
+# `_calc_precision`), on which `_SumCachingPool` keys its cached sums
+_active_bit_width: ContextVar[int] = ContextVar("_active_bit_width", default=0)
+
+
+@contextmanager
+def _calc_precision(bit_width: int) -> Generator[None, None, None]:
+    r"""
+    Quantize dice to *bit_width* (or not at all if `0`) until exit, and make that the precision `_SumCachingPool` sums are cached for.
+    """
+    token = _active_bit_width.set(bit_width)
+    try:
+        if bit_width > 0:
+            with quantize_hs(bit_width=bit_width, preserve_zero_counts=True):
+                yield
+        else:
+            yield
+    finally:
+        _active_bit_width.reset(token)
+
+
+class _SumCachingPool(PoolT):
+    r"""
+    A pool that computes its sum at most once per calculation precision, and only when something asks for it.
+
+    Rolled dice (e.g., `ROLL: 5d10`) are kept as pools so that `@` and selection builtins can see each position, but most uses (arithmetic, comparisons, outputs, `:n` parameters) collapse them to their sums via `h()`.
+    A plain [`P`][dyce.P] recomputes that sum at every such use.
+    This caches it on the pool itself, so every binding sharing the pool shares the sum, and sums pools of identical dice by repeated squaring.
+    The sum is recomputed if the calculation precision has changed since (see `_calc_precision`), so it's always quantized like any other die computed at the same point.
+    Selections (`h` with arguments) are computed as usual.
+
+        >>> from dyce import H
+        >>> from anydyce.anydice.interpreter import _SumCachingPool
+        >>> pool = _SumCachingPool(H(6), H(6))
+        >>> pool.h() is pool.h()
+        True
+        >>> pool.h(0)
+        H({1: 11, 2: 9, 3: 7, 4: 5, 5: 3, 6: 1})
+    """
+
+    __slots__ = ("_sum", "_sum_bit_width")
+
+    def __init__(self, *init_vals: H[int] | PoolT) -> None:
+        super().__init__(*init_vals)
+        self._sum: H[int] | None = None
+        self._sum_bit_width = 0
+
+    def h(self, *which: int | slice) -> H[int]:
+        if which:
+            return super().h(*which)
+        bit_width = _active_bit_width.get()
+        if self._sum is None or self._sum_bit_width != bit_width:
+            self._sum_bit_width = bit_width
+            if len(self._h_groups) == 1:
+                ((die, n),) = self._h_groups.items()
+                self._sum = _sum_dice(n, die)
+            else:
+                self._sum = super().h()
+        return self._sum
+
+
 def _anydice_pow_strict(a: int, b: int) -> int:
     # AnyDice truncates fractional power results toward zero so `^` always
     # produces integer outcomes (e.g. `2^-1 = 0`, `(-2)^-1 = 0`, `(-1)^-1 =
@@ -202,6 +306,71 @@ _CMP_OPS = {"=", "!=", "<", ">", "<=", ">="}
 # +/- treat empty die as scalar 0; */^ propagate emptiness as H({})
 _EMPTY_DIE_SKIPS_ARITH = {"+", "-", "|"}
 
+# ---- Environments ------------------------------------------------------------------------
+
+# Longest chain of `_Env`s a variable lookup may walk before a call's environment is
+# backed by a flattened copy instead
+_MAX_ENV_CHAIN = 16
+
+
+# A dict subclass (rather than a `UserDict`), so that lookups of the call's own
+# variables stay as fast as any dict's
+class _Env(dict[str, _Val]):  # ruff: ignore[subclass-builtin]
+    r"""
+    A function call's variable environment, holding only the names assigned during the call.
+
+    Any other name is looked up in the caller's environment (AnyDice scoping is dynamic).
+    Assignments never reach the caller's environment, and the caller can't assign anything while the call is in progress, so the call sees the caller's variables as they were when it was made.
+    That's just what copying the caller's environment would give, but without copying every variable on every call.
+    To keep lookups cheap during deep recursion, every `_MAX_ENV_CHAIN`th nested environment is backed by a flattened copy of its caller's instead.
+
+        >>> from anydyce.anydice.interpreter import _Env
+        >>> outer = {"X": 1, "Y": 2}
+        >>> env = _Env(outer)
+        >>> env["Y"] = 3
+        >>> env["X"], env["Y"], outer["Y"]
+        (1, 3, 2)
+    """
+
+    __slots__ = ("_parent", "chain")
+
+    def __init__(self, parent: dict[str, _Val]) -> None:
+        super().__init__()
+        chain = 1
+        if isinstance(parent, _Env):
+            chain = parent.chain + 1
+            if chain > _MAX_ENV_CHAIN:
+                parent = parent.flattened()
+                chain = 1
+        self._parent = parent
+        self.chain = chain
+
+    def __missing__(self, key: str) -> _Val:
+        return self._parent[key]
+
+    def flattened(self) -> dict[str, _Val]:
+        r"""Return a plain dict with every variable visible in this environment."""
+        parent = self._parent
+        flat = parent.flattened() if isinstance(parent, _Env) else dict(parent)
+        flat.update(self)
+        return flat
+
+
+class _Loop:
+    r"""
+    A loop, as seen while compiling its body.
+
+    Expressions (and builtin calls) in the body that read none of the *written* names have the same value on every iteration, so are computed only once per execution of the loop (see `AnyDiceInterpreter._hoist`).
+    """
+
+    __slots__ = ("run", "written")
+
+    def __init__(self, written: frozenset[str]) -> None:
+        self.written = written
+        # Identifies the loop's execution in progress (see `_compile_loop`)
+        self.run = 0
+
+
 # ---- Function pattern shape --------------------------------------------------------------
 
 # A pattern shape is a tuple slotting words at fixed positions and `None` for each
@@ -209,25 +378,308 @@ _EMPTY_DIE_SKIPS_ARITH = {"+", "-", "|"}
 # with the same shape are the same callable, regardless of parameter types.
 
 
-def _call_shape(parts: list[str | Expr]) -> tuple[str | None, ...]:
+def _call_shape(parts: tuple[str | Expr, ...]) -> tuple[str | None, ...]:
     return tuple(p if isinstance(p, str) else None for p in parts)
 
 
-def _pattern_shape(pattern: list[str | Param]) -> tuple[str | None, ...]:
+def _pattern_shape(pattern: tuple[str | Param, ...]) -> tuple[str | None, ...]:
     return tuple(p if isinstance(p, str) else None for p in pattern)
 
 
-class _ResultReturn(Exception):  # ruff: ignore[error-suffix-on-exception-name]
-    r"""Internal control-flow signal: a `result:` statement fired in a function body.
+def _shape_label(shape: tuple[str | None, ...]) -> str:
+    r"""
+    Return a label for calls of *shape* in profiles (see `Profiler`).
 
-    Carries the result value so the function-call machinery can return it.
-    Using an exception lets `result:` fire from arbitrary nesting depth (inside
-    `if` / `loop` bodies) rather than only at the top of a function body.
+        >>> from anydyce.anydice.interpreter import _shape_label
+        >>> _shape_label(("highest", None, "of", None))
+        '[highest _ of _]'
     """
+    return "[" + " ".join("_" if p is None else p for p in shape) + "]"
 
-    def __init__(self, value: _Val) -> None:
-        super().__init__()
-        self.value = value
+
+def _stmt_label(stmt: Stmt) -> str:
+    r"""Return the first line of *stmt*'s source, without any opening brace."""
+    return unparse(Program((stmt,))).partition("\n")[0].removesuffix(" {")
+
+
+@dataclass(frozen=True)
+class _UserFunc:
+    r"""
+    A user-defined function, compiled once at program compile time.
+
+    Carries everything the call machinery needs so nothing is re-derived from the definition's pattern on each call.
+    """
+
+    definition: FunctionDef
+    shape: _ShapeT
+    params: tuple[Param, ...]
+    param_types: list[str | None]
+    # (name, index) for the first occurrence of each param name, in param order
+    slots: tuple[tuple[str, int], ...]
+    first_positions: frozenset[int]
+    body: _StmtFnT
+    # Whether the body reads only its params and locals it has already assigned (see
+    # `analysis.reads_only_assigned`)
+    reads_only_assigned: bool
+    # Shapes of the functions the body calls directly
+    callees: frozenset[_ShapeT]
+    # For each `:s` param read only by symmetric builtins (see `_symmetric_class`),
+    # keyed by position, the shape of each such call and its compiled arguments
+    # (`None` for the param itself)
+    symmetric_uses: dict[int, tuple[tuple[_ShapeT, tuple[_ExprFnT | None, ...]], ...]]
+
+    def err_label(self, i: int) -> str:
+        return f"function param {self.params[i].name}"
+
+
+def _compose1(apply: Callable[[_Val], _Val], operand_fn: _ExprFnT) -> _ExprFnT:
+    return lambda: apply(operand_fn())
+
+
+def _value_key(v: _Val) -> Hashable:
+    r"""Return a hashable key that is equal for two values only if they are interchangeable.
+
+    H equality compares reduced proportions (`H({1: 1}) == H({1: 2})`) and drops zero counts, but the interpreter's results depend on exact counts, so dice are keyed on their raw items.
+    """
+    if isinstance(v, (int, str, tuple)):
+        # Sequences contain only ints, so they can't collide with the tagged keys below
+        return v
+    elif isinstance(v, H):
+        return ("H", tuple(v.items()))
+    elif isinstance(v, P):
+        return (type(v), tuple(tuple(h.items()) for h in v))
+    else:  # pragma: no cover
+        raise TypeError(f"unexpected value: {type(v).__name__}")
+
+
+def _selection_key(v: _Val) -> Hashable:
+    r"""Like `_value_key`, but equal for pools of the same dice in any order, from which the same selections are made."""
+    return ("P", pool_key(v)) if isinstance(v, P) else _value_key(v)
+
+
+def _binop_counts(
+    op: str, left_items: list[tuple[int, int]], right_items: list[tuple[int, int]]
+) -> dict[int, int]:
+    r"""Return the outcome counts of *op* applied across every pair of *left_items* and *right_items*."""
+    counts = h_binop_counts(
+        op, left_items, right_items, pow_sentinel=_POW_NEG_INF_SENTINEL
+    )
+    if counts is not None:
+        return counts
+    result: dict[int, int] = {}
+    op_func = _OP_FUNCS_H_ITER[op]
+    for lo, lw in left_items:
+        for ro, rw in right_items:
+            outcome = op_func(lo, ro)
+            result[outcome] = result.get(outcome, 0) + lw * rw
+    return result
+
+
+def _add_counts(
+    left_items: list[tuple[int, int]], right_items: list[tuple[int, int]]
+) -> dict[int, int]:
+    counts = convolve_counts(left_items, right_items, subtract=False)
+    return _binop_counts("+", left_items, right_items) if counts is None else counts
+
+
+def _nfold_counts(items: list[tuple[int, int]], n: int) -> dict[int, int]:
+    r"""
+    Return the outcome counts of the sum of *n* (at least one) copies of a die.
+
+    *items* are the die's `(outcome, count)` pairs, sorted by outcome, with positive counts.
+    Counts are exact (i.e., never quantized), so they are safe to build on.
+    """
+    counts = nfold_sum_counts(items, n)
+    if counts is not None:
+        return counts
+    # Exponentiation by squaring, one cross-product loop per step
+    acc: list[tuple[int, int]] | None = None
+    base = items
+    while n:
+        if n & 1:
+            acc = base if acc is None else sorted(_add_counts(acc, base).items())
+        n >>= 1
+        if n:
+            base = sorted(_add_counts(base, base).items())
+    assert acc is not None
+    return dict(acc)
+
+
+def _iter_sum_dice_counts(
+    die: H[int], ns: Iterable[int]
+) -> Iterator[tuple[int, dict[int, int]]]:
+    r"""
+    Yield `(n, counts)` for each of *ns* (all positive) in ascending order, where *counts* are the outcome counts of the sum of *n* copies of *die*, whose counts must all be positive.
+
+    Each sum is built from the one before it (`(k+1)dX = kdX + dX`), so a run of consecutive counts costs one convolution per count.
+    """
+    items = list(die.items())
+    acc: list[tuple[int, int]] | None = None
+    prev = 0
+    for n in sorted(set(ns)):
+        step = (
+            items if n - prev == 1 else sorted(_nfold_counts(items, n - prev).items())
+        )
+        acc = step if acc is None else sorted(_add_counts(acc, step).items())
+        yield n, dict(acc)
+        prev = n
+
+
+def _sum_dice(n: int, die: H[int]) -> H[int]:
+    r"""Return the sum of *n* (at least one) copies of *die*, whose counts must all be positive."""
+    return H(_nfold_counts(list(die.items()), n))
+
+
+class _WeightedAggregate:
+    r"""
+    A streaming equivalent of `dyce.h.aggregate_weighted` for dice.
+
+    Each added die contributes in proportion to its weight, regardless of its total.
+    Counts are kept scaled to the least common multiple of the totals seen so far, and merged by outcome as they arrive.
+    Memory is therefore bounded by the number of distinct outcomes, not the number of dice added.
+    The result has exactly the counts `aggregate_weighted` would produce (including zero counts), and is only quantized when it is finally built (see `h`).
+
+        >>> from dyce import H
+        >>> from anydyce.anydice.interpreter import _WeightedAggregate
+        >>> agg = _WeightedAggregate()
+        >>> agg.add(H({1: 1}), 1)
+        >>> agg.add(H({1: 1, 2: 2}), 2)
+        >>> agg.h()
+        H({1: 5, 2: 4})
+    """
+
+    __slots__ = ("_counts", "_scalar")
+
+    def __init__(self) -> None:
+        self._counts: dict[int, int] = {}
+        self._scalar = 1
+
+    def add(self, counts: Mapping[int, int], weight: int) -> None:
+        r"""Merge the die with outcome *counts* into the aggregate with *weight* (the empty die is ignored)."""
+        total = sum(counts.values())
+        if not total:
+            return
+        scalar = lcm(self._scalar, total)
+        if scalar != self._scalar:
+            prior_factor = scalar // self._scalar
+            for outcome in self._counts:
+                self._counts[outcome] *= prior_factor
+            self._scalar = scalar
+        factor = weight * (scalar // total)
+        for outcome, count in counts.items():
+            self._counts[outcome] = self._counts.get(outcome, 0) + count * factor
+
+    def h(self) -> H[int]:
+        r"""Return the aggregate as a die (quantized under any active `quantize_hs` context)."""
+        return H.from_counts(self._counts.items(), preserve_zero_counts=True)
+
+
+def _sorted_rolls(
+    items: list[tuple[int, int]], n: int
+) -> Iterator[tuple[tuple[int, ...], int]]:
+    r"""
+    Yield each distinct roll of *n* dice with outcome counts *items*, along with its count.
+
+    Each roll lists its outcomes in the order of *items*, and rolls are yielded in lexicographic order by that same order.
+    Only the roll being yielded is kept, so memory is proportional to *n*, however many rolls there are.
+    """
+    outcomes = [outcome for outcome, _ in items]
+    counts = [count for _, count in items]
+    factorials = [factorial(i) for i in range(n + 1)]
+    last = len(items) - 1
+    # Indexes into items of each die's outcome, never decreasing
+    indexes = [0] * n
+    while True:
+        # The number of orderings of the roll, times the count of each
+        count = factorials[n]
+        start = 0
+        for i in range(1, n + 1):
+            if i == n or indexes[i] != indexes[start]:
+                count = (
+                    count
+                    // factorials[i - start]
+                    * counts[indexes[start]] ** (i - start)
+                )
+                start = i
+        yield tuple(outcomes[i] for i in indexes), count
+        j = n - 1
+        while j >= 0 and indexes[j] == last:
+            j -= 1
+        if j < 0:
+            return
+        indexes[j:] = [indexes[j] + 1] * (n - j)
+
+
+class _PoolRolls:
+    r"""
+    The distinct rolls of a pool of identical dice, with their counts, in the order `:s` parameters are expanded over them.
+
+    Rolls list outcomes highest first if *descending*, and lowest first otherwise, and are ordered lexicographically in the same direction (e.g., `(6, 6)`, `(6, 5)`, ... `(1, 1)` when *descending*).
+    They're generated anew each time they're iterated over, rather than stored.
+    """
+
+    __slots__ = ("_descending", "_items", "_n")
+
+    def __init__(self, die: Mapping[int, int], n: int, *, descending: bool) -> None:
+        items = sorted((o, c) for o, c in die.items() if c > 0)
+        self._items = items[::-1] if descending else items
+        self._n = n
+        self._descending = descending
+
+    def reduced(self, classify: Callable[[int], Hashable]) -> "_PoolRolls":
+        r"""
+        Return the rolls of as many dice with a single outcome for each class of this die's outcomes (as *classify* returns), with the total count of the class.
+
+        Where all that matters about a roll is how many of its dice fall in each class (see `builtins_.SYMMETRIC`), expanding over these instead gives the same results, but far fewer rolls.
+        """
+        representatives: dict[Hashable, int] = {}
+        counts: dict[int, int] = {}
+        for outcome, count in self._items:
+            representative = representatives.setdefault(classify(outcome), outcome)
+            counts[representative] = counts.get(representative, 0) + count
+        return _PoolRolls(counts, self._n, descending=self._descending)
+
+    def __len__(self) -> int:
+        return comb(len(self._items) + self._n - 1, self._n)
+
+    def __iter__(self) -> Iterator[tuple[tuple[int, ...], int]]:
+        return _sorted_rolls(self._items, self._n)
+
+
+def _nested_combos(
+    entries: list[_ExpansionItemsT],
+) -> Iterator[tuple[tuple[_Val, int], ...]]:
+    r"""Yield each combination of *entries*' items, with the last entry varying fastest, iterating over each entry anew for each combination of those before it."""
+    first, *rest = entries
+    for item in first:
+        if rest:
+            for tail in _nested_combos(rest):
+                yield (item, *tail)
+        else:
+            yield (item,)
+
+
+def _iter_combos(
+    expansion: _ExpansionT,
+) -> Iterator[tuple[tuple[tuple[_Val, int], ...], int]]:
+    r"""
+    Yield each combination of *expansion*'s items, along with its weight (the product of its items' weights).
+
+    Combinations are enumerated with the first expansion entry varying fastest (AnyDice's little-endian rule).
+    That's required for any user-defined function body that may observe iteration order via non-param accumulators.
+    Entries that generate their items (see `_PoolRolls`) are never stored whole, unlike those `product` would store.
+    """
+    entries = [items for _, items in reversed(expansion)]
+    if all(isinstance(items, list) for items in entries):
+        reversed_combos = product(*entries)
+    else:
+        reversed_combos = _nested_combos(entries)
+    for reversed_combo in reversed_combos:
+        combo = reversed_combo[::-1]
+        weight = 1
+        for _, w in combo:
+            weight *= w
+        yield combo, weight
 
 
 # ---- Interpreter -------------------------------------------------------------------------
@@ -253,22 +705,79 @@ class AnyDiceInterpreter:
         # `function: add X:n to Y:d` and `function: add X:s to Y:n` are the same
         # callable. The latter REPLACES the former on registration). Param type
         # annotations are body-evaluation hints, not dispatch keys.
-        self._funcs: dict[tuple[str | None, ...], FunctionDef] = {}
+        self._funcs: dict[tuple[str | None, ...], _UserFunc] = {}
         # Built-in dispatch table mirrors _funcs but maps to (param_types, impl). User
         # functions take precedence: _call consults _funcs first and falls back here.
         self._builtins: dict[
             tuple[str | None, ...], tuple[list[str | None], Callable[..., _Val]]
         ] = {}
+        # The entries of `builtins_.SYMMETRIC` for the impls of those builtins
+        self._symmetric_impls: dict[
+            Callable[..., _Val], tuple[int, Callable[..., Callable[[int], Hashable]]]
+        ] = {}
         for pattern, param_types, impl in BUILTINS:
             shape = tuple(p if isinstance(p, str) else None for p in pattern)
+            if shape in SELECTIONS:
+                impl = self._cached_selection(shape, impl)  # ruff: ignore[redefined-loop-name]
             self._builtins[shape] = (list(param_types), impl)
+            if shape in SYMMETRIC:
+                self._symmetric_impls[impl] = SYMMETRIC[shape]
         self._depth = 0
+        # Per-run cache of user-defined function call results, keyed by shape and
+        # argument values. Only calls to pure functions (see `_find_impure`) are
+        # cached. Settings and the function table can only change at the top level,
+        # so both `set` and function definitions simply clear the cache.
+        self._call_cache: dict[tuple, _CallCacheEntryT] = {}
+        # Same, but for single executions of a pure function's body, keyed by shape
+        # and the values bound to its params. Lets expansions share body results
+        # across calls (e.g., `[f d6 X]` followed by `[f d8 X]`).
+        self._body_cache: dict[tuple, _CallCacheEntryT] = {}
+        # Shapes of user-defined functions whose results may depend on more than
+        # their arguments. `None` means stale (recomputed on the next check).
+        self._impure: set[_ShapeT] | None = None
+        # Deepest call depth attempted, and whether any attempt hit the recursion cap,
+        # since the innermost in-progress memoized computation began (see `_memoized`)
+        self._reach = 0
+        self._capped = False
+        # Call sites registered while compiling the current evaluation point (see
+        # `_compile_task`), and the results of the calls of the one being evaluated
+        self._call_sites: list[_CallSiteT] | None = None
+        self._temps: list[_Val] = []
+        # Incremented by every `set`, which can change the value of any expression
+        # (see `_fold`)
+        self._settings_epoch = 0
+        # Loops enclosing the statement being compiled, outermost first (see
+        # `_compile_loop`), and the number of loop executions so far
+        self._loops: list[_Loop] = []
+        self._loop_runs = 0
+        # Memo for `analysis.expr_facts` while compiling, so deciding whether each
+        # expression can be cached doesn't walk its whole subtree
+        self._expr_facts: dict[int, tuple[Expr, ExprFactsT]] = {}
+        # Tracks usage of the run's budget, if it has one
+        self._meter: BudgetMeter | None = None
+        # Called before each statement, call, and expansion combo, if the run has a
+        # budget or can be cancelled (see `_step_fn`)
+        self._step: Callable[[], None] | None = None
+        # Records the run's profile, if it's being profiled, and the prefix of the
+        # labels of the statements being compiled (see `_compile_block`)
+        self._profiler: Profiler | None = None
+        self._profile_path = ""
+        # Called with each value computed by a statement's expression, if the run has
+        # a budget or is being profiled (see `_observe_fn`)
+        self._observe: Callable[[_Val], None] | None = None
+        # Caches selections from pools (by `@` and selection builtins) within and
+        # across runs, if the run was given one
+        self._selection_cache: SelectionCache | None = None
 
     def run(
         self,
         program: Program,
         *,
         settings: Settings | None = None,
+        budget: Budget | None = None,
+        cancel_token: CancellationToken | None = None,
+        profiler: Profiler | None = None,
+        selection_cache: SelectionCache | None = None,
     ) -> AnyDiceResultsT:
         r"""Execute a parsed program and return `(name, distribution)` pairs.
 
@@ -278,115 +787,485 @@ class AnyDiceInterpreter:
         observes -- formatting consumers read e.g. `settings.display_precision`
         from it). If omitted, a fresh `Settings()` is used internally and the
         caller cannot observe `set`-directive effects.
+
+        If `budget` is provided, the run raises a `BudgetExceededError` as
+        soon as it exceeds any of the budget's limits (see `Budget`). If
+        `cancel_token` is provided, the run raises a `RunCancelledError` as
+        soon as it notices the token has been cancelled (see
+        `CancellationToken`). If `profiler` is provided, it records where
+        the run spends its time (see `Profiler`). If `selection_cache` is
+        provided, selections from pools of dice (by `@` and builtins like
+        `[highest N of D]`) are looked up in and added to it (see
+        `SelectionCache`).
         """
         self._env = {}
         self._outputs = []
+        self._meter = None if budget is None else BudgetMeter(budget, self._outputs)
+        self._profiler = profiler
+        self._selection_cache = selection_cache
+        self._step = self._step_fn(cancel_token)
+        self._observe = self._observe_fn()
         self._funcs = {}
         self._depth = 0
+        self._call_cache = {}
+        self._body_cache = {}
+        self._impure = None
+        self._reach = 0
+        self._capped = False
         self._settings = settings if settings is not None else Settings()
-        # Bump Python's recursion limit for the duration of this run. Both
-        # `dyce.p`'s pool-selection (recurses ~4 Python frames per distinct
-        # outcome of the underlying H, via `lowest_terms` / `__hash__` in
-        # the inner loop) and our own interpreter call chain (~7 Python
-        # frames per AnyDice call) can hit the default ~1000 limit on
-        # otherwise reasonable programs. Empirically 5000 covers
-        # pool-selection on dies up to ~d1250 and user-function recursion
-        # up to ~`set "maximum function depth" to 700`, while staying well
-        # below the C-stack overflow risk zone (a Python frame is a few
-        # hundred bytes, default Linux thread stack is 8MB).
+        # Bump Python's recursion limit for the duration of this run (see
+        # `_RECURSION_LIMIT`)
         prev_limit = sys.getrecursionlimit()
-        if prev_limit < 5000:
-            sys.setrecursionlimit(5000)
+        if prev_limit < _RECURSION_LIMIT:
+            sys.setrecursionlimit(_RECURSION_LIMIT)
         try:
             with ExitStack() as stack:
                 self._quantize_stack = stack
                 self._apply_calc_precision(self._settings.calc_bit_width)
-                for stmt in program.stmts:
-                    self._exec(stmt)
+                self._run_task(self._compile_block(program.stmts)())
             return list(self._outputs)
         finally:
-            if prev_limit < 5000:
+            if prev_limit < _RECURSION_LIMIT:
                 sys.setrecursionlimit(prev_limit)
+            self._expr_facts.clear()
             self._settings = None
             self._quantize_stack = None
+            self._meter = None
+            self._step = None
+            self._profiler = None
+            self._observe = None
+            self._selection_cache = None
+
+    def _step_fn(
+        self, cancel_token: CancellationToken | None
+    ) -> Callable[[], None] | None:
+        r"""
+        Return the function to be called before each step of the run, or `None` if there's nothing to do.
+
+        Steps are counted against the run's budget (if any), and each checks *cancel_token* (if any).
+        """
+        meter_step = None if self._meter is None else self._meter.step
+        if cancel_token is None:
+            return meter_step
+        outputs = self._outputs
+
+        def _cancellable_step() -> None:
+            if cancel_token.cancelled:
+                raise RunCancelledError(list(outputs))
+            if meter_step is not None:
+                meter_step()
+
+        return _cancellable_step
+
+    def _observe_fn(self) -> Callable[[_Val], None] | None:
+        r"""
+        Return the function to be called with each value computed by a statement's expression, or `None` if there's nothing to do.
+
+        Values are checked against the run's budget (if any), and recorded by its profiler (if any).
+        """
+        check = None if self._meter is None else self._meter.check
+        observe = None if self._profiler is None else self._profiler.observe
+        if check is None or observe is None:
+            return check or observe
+
+        def _check_and_observe(value: _Val) -> None:
+            check(value)
+            observe(value)
+
+        return _check_and_observe
+
+    def _run_task(self, task: Generator[_TaskT, _Val, _Val | None]) -> _Val | None:
+        r"""
+        Run *task* to completion and return its result.
+
+        Tasks awaiting the results of calls are kept on an explicit stack rather than Python's, so the depth of AnyDice recursion is bounded only by memory (and `maximum function depth`).
+        Whenever the task on top of the stack yields a task, that task is pushed and run, and its result (or exception) is sent back to the one that yielded it.
+        """
+        stack = [task]
+        value: _Val | None = None
+        error: BaseException | None = None
+        while True:
+            top = stack[-1]
+            try:
+                if error is None:
+                    sub = top.send(value)
+                else:
+                    thrown, error = error, None
+                    sub = top.throw(thrown)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                value = stop.value
+                continue
+            except BaseException as exc:
+                stack.pop()
+                if not stack:
+                    raise
+                error = exc
+                continue
+            stack.append(sub)
+            value = None
 
     def _apply_calc_precision(self, bit_width: int) -> None:
-        r"""Unwind any active `quantize_hs` context and enter a new one for
-        `bit_width`. `bit_width == 0` means "exact" -- no quantization, no
-        active context. Called from `run()` at entry and from the SetStmt
+        r"""Unwind any active `_calc_precision` context and enter a new one for
+        `bit_width`. `bit_width == 0` means "exact" -- no quantization. Called from `run()` at entry and from the SetStmt
         handler when `"anydyce: calculation precision"` changes."""
         assert self._quantize_stack is not None, "called outside run()"
         # close() unwinds all registered exits. ExitStack stays reusable, so
         # subsequent enter_context() registers the replacement (or no
         # replacement, for bit_width=0).
         self._quantize_stack.close()
-        if bit_width > 0:
-            self._quantize_stack.enter_context(
-                quantize_hs(bit_width=bit_width, preserve_zero_counts=True)
-            )
+        self._quantize_stack.enter_context(_calc_precision(bit_width))
+
+    # ---- Compilation ---------------------------------------------------------------------
+
+    # Rather than re-dispatching on node type every time a node is evaluated, each
+    # statement and expression is compiled exactly once per run into a closure with
+    # its children (and any interpreter methods it needs) pre-bound. Function bodies
+    # are compiled along with the rest of the program, so re-executing a body once per
+    # expansion combo costs only the closure calls themselves.
+    #
+    # Statements compile to generator functions, so that calls to user-defined
+    # functions can be run as tasks (see `_run_task`). Expressions compile to plain
+    # closures, with any calls they contain hoisted out ahead of them (see
+    # `_compile_task`).
+
+    def _compile_block(self, stmts: tuple[Stmt, ...]) -> _StmtFnT:
+        if self._profiler is None:
+            fns = tuple(self._compile_stmt(stmt) for stmt in stmts)
+        else:
+            fns = tuple(starmap(self._compile_profiled_stmt, enumerate(stmts, 1)))
+        if self._step is not None:
+            fns = tuple(map(self._stepped_stmt, fns))
+        if len(fns) == 1:
+            return fns[0]
+
+        def _block() -> _StmtTaskT:
+            for fn in fns:
+                result = yield from fn()
+                if result is not None:
+                    return result
+            return None
 
-    # ---- Statement execution -------------------------------------------------------------
+        return _block
 
-    def _exec(self, stmt: Stmt) -> None:  # ruff: ignore[complex-structure]
+    def _compile_profiled_stmt(self, i: int, stmt: Stmt) -> _StmtFnT:
+        r"""
+        Compile *stmt*, the *i*th of its block, to have each of its executions recorded by the run's profiler.
+
+        Its label is its position (e.g., `2.1` for the first statement in the body of the second), followed by the first line of its source.
+        """
+        profiler = self._profiler
+        assert profiler is not None, "_compile_profiled_stmt called without a profiler"
+        prefix = self._profile_path
+        path = f"{prefix}{i}"
+        self._profile_path = f"{path}."
+        try:
+            stmt_fn = self._compile_stmt(stmt)
+        finally:
+            self._profile_path = prefix
+        label = f"{path}: {_stmt_label(stmt)}"
+        enter = profiler.enter
+        exit_ = profiler.exit
+
+        def _profiled_stmt() -> _StmtTaskT:
+            enter("statement", label)
+            try:
+                return (yield from stmt_fn())
+            finally:
+                exit_()
+
+        return _profiled_stmt
+
+    def _stepped_stmt(self, stmt_fn: _StmtFnT) -> _StmtFnT:
+        r"""Wrap *stmt_fn* to take a step (see `_step_fn`) before each of its executions."""
+        step = self._step
+        assert step is not None, "_stepped_stmt called without a step function"
+
+        def _stmt() -> _StmtTaskT:
+            step()
+            return (yield from stmt_fn())
+
+        return _stmt
+
+    def _compile_stmt(self, stmt: Stmt) -> _StmtFnT:  # ruff: ignore[complex-structure]
         if isinstance(stmt, OutputStmt):
-            value = self._eval(stmt.expr)
-            h = self._coerce_to_h(value)
-            label = self._eval_name(stmt.name)
-            if label is None:
-                label = f"output {len(self._outputs) + 1}"
-            self._outputs.append((label, h))
+            return self._compile_output(stmt)
         elif isinstance(stmt, SetStmt):
-            assert self._settings is not None, "SetStmt outside run()"
-            v = self._eval(stmt.value)
-            if isinstance(v, (str, int)):
-                self._settings.set(stmt.key, v)
-                # Adjusts the active `quantize_hs` context for the rest of the run
-                if stmt.key == "anydyce: calculation precision":
-                    self._apply_calc_precision(self._settings.calc_bit_width)
-            else:  # pragma: no cover
-                raise TypeError(
-                    f"set value must resolve to string or number, got {type(v).__name__}"
-                )
+            return self._compile_set(stmt)
         elif isinstance(stmt, FunctionDef):
             # Redefinition with the same shape replaces. Param types do not affect
             # identity.
-            self._funcs[_pattern_shape(stmt.pattern)] = stmt
+            shape = _pattern_shape(stmt.pattern)
+            user_func = self._compile_function(stmt)
+
+            def _function_def() -> _StmtTaskT:
+                self._funcs[shape] = user_func
+                self._invalidate_call_cache()
+                yield from ()
+
+            return _function_def
         elif isinstance(stmt, VarAssign):
-            self._env[stmt.name] = self._eval(stmt.expr)
+            name = stmt.name
+            expr_task = self._compile_task(stmt.expr)
+
+            def _var_assign() -> _StmtTaskT:
+                value = yield from expr_task()
+                self._env[name] = value
+
+            return _var_assign
         elif isinstance(stmt, IfStmt):
-            self._exec_if(stmt)
+            return self._compile_if(stmt)
         elif isinstance(stmt, LoopStmt):
-            self._exec_loop(stmt)
+            return self._compile_loop(stmt)
         elif isinstance(stmt, ResultStmt):
             # `result:` is grammatically restricted to function bodies, but the body can
-            # nest the statement inside `if` / `loop` blocks. Raising an exception
-            # unwinds through any nesting back to the function-call machinery, which
-            # catches it.
-            raise _ResultReturn(self._eval(stmt.expr))
+            # nest the statement inside `if` / `loop` blocks. Its value is returned up
+            # through any nesting (each enclosing block stops at the first non-`None`
+            # statement result) back to the function-call machinery.
+            result_task = self._compile_task(stmt.expr)
+
+            def _result() -> _StmtTaskT:
+                return (yield from result_task())
+
+            return _result
         else:  # pragma: no cover
             raise NotImplementedError(f"unhandled statement: {type(stmt).__name__}")
 
-    def _exec_if(self, stmt: IfStmt) -> None:
-        for branch in stmt.branches:
-            if self._is_truthy(self._eval(branch.condition)):
-                for body_stmt in branch.body:
-                    self._exec(body_stmt)
-                return
-        if stmt.else_branch is not None:
-            for body_stmt in stmt.else_branch.body:
-                self._exec(body_stmt)
-
-    def _exec_loop(self, stmt: LoopStmt) -> None:
-        over = self._eval(stmt.over)
-        if not isinstance(over, tuple):
-            raise TypeError(f"loop over must be a sequence, got {type(over).__name__}")
-        # AnyDice does not introduce a child scope for loop bodies. The loop variable is
-        # bound in the enclosing environment and any assignments in the body persist
-        # after the loop.
-        for value in over:
-            self._env[stmt.var] = value
-            for body_stmt in stmt.body:
-                self._exec(body_stmt)
+    def _compile_task(self, node: Expr, *, sum_only: bool = False) -> _ExprTaskFnT:
+        r"""
+        Compile *node* into a task that evaluates it.
+
+        Calls to user-defined functions can't be made from within a plain closure without nesting Python frames, so every call within *node* is hoisted out of it.
+        The task first makes each call in evaluation order (innermost first), yielding a task for every call to a user-defined function.
+        The rest of *node* is then evaluated as a plain closure, in which each call simply reads its result.
+        If *sum_only* is `True`, *node* is compiled as by `_compile_sum`.
+        """
+        outer_sites, self._call_sites = self._call_sites, []
+        try:
+            expr_fn = self._compile_sum(node) if sum_only else self._compile_expr(node)
+            sites = tuple(self._call_sites)
+        finally:
+            self._call_sites = outer_sites
+        observe = self._observe
+        if observe is not None:
+            # Only values computed by statements are checked against the budget's
+            # limits on distributions and profiled (along with those returned by
+            # calls), since observing every intermediate value would slow every run
+            unobserved_fn = expr_fn
+
+            def _observed() -> _Val:
+                value = unobserved_fn()
+                observe(value)
+                return value
+
+            expr_fn = _observed
+        if not sites:
+
+            def _eval() -> _TaskT:
+                return expr_fn()
+                yield  # pragma: no cover
+
+            return _eval
+
+        capped_temps = [H({})] * len(sites)
+
+        def _eval_with_calls() -> _TaskT:
+            assert self._settings is not None, "task run outside run()"
+            # Recursion-depth guard: Each call exceeding the configured maximum
+            # returns H({}) without evaluating its arguments (including any calls
+            # nested in them) or executing the body. All of the calls here are made
+            # at the same depth, so either all or none of them are capped. The
+            # unwinding result is then governed by how each operator treats H({})
+            # (e.g. + treats it as 0; / propagates).
+            depth = self._depth
+            if depth > self._reach:
+                self._reach = depth
+            if depth >= self._settings.max_depth:
+                self._capped = True
+                self._temps = capped_temps
+                return expr_fn()
+            # Results are kept per evaluation, since the same point may be evaluated
+            # again (recursively) by any of the calls
+            temps: list[_Val] = []
+            for site in sites:
+                self._temps = temps
+                result = site()
+                if isinstance(result, GeneratorType):
+                    result = yield result
+                temps.append(result)
+            self._temps = temps
+            return expr_fn()
+
+        return _eval_with_calls
+
+    def _compile_output(self, stmt: OutputStmt) -> _StmtFnT:
+        expr_task = self._compile_task(stmt.expr, sum_only=True)
+        name_fn = self._compile_name(stmt.name)
+        coerce_to_h = self._coerce_to_h
+
+        def _output() -> _StmtTaskT:
+            h = coerce_to_h((yield from expr_task()))
+            label = name_fn()
+            if label is None:
+                label = f"output {len(self._outputs) + 1}"
+            self._outputs.append((label, h))
+
+        return _output
+
+    def _compile_set(self, stmt: SetStmt) -> _StmtFnT:
+        key = stmt.key
+        value_task = self._compile_task(stmt.value)
+
+        def _set() -> _StmtTaskT:
+            assert self._settings is not None, "SetStmt outside run()"
+            v = yield from value_task()
+            if isinstance(v, (str, int)):
+                self._settings.set(key, v)
+                self._settings_epoch += 1
+                self._invalidate_call_cache()
+                # Adjusts the active `quantize_hs` context for the rest of the run
+                if key == "anydyce: calculation precision":
+                    self._apply_calc_precision(self._settings.calc_bit_width)
+            else:  # pragma: no cover
+                raise TypeError(
+                    f"set value must resolve to string or number, got {type(v).__name__}"
+                )
+
+        return _set
+
+    def _compile_function(self, stmt: FunctionDef) -> "_UserFunc":
+        params = tuple(p for p in stmt.pattern if isinstance(p, Param))
+        # Duplicate-named params: AnyDice's rule is FIRST-OCCURRENCE WINS (see
+        # `_invoke_user`). Only the first position bearing each name is ever bound.
+        first_idx_for_name: dict[str, int] = {}
+        for i, param in enumerate(params):
+            first_idx_for_name.setdefault(param.name, i)
+        # The body runs in each call's own environment, so nothing in it is invariant
+        # in any loop enclosing the definition
+        outer_loops, self._loops = self._loops, []
+        outer_path, self._profile_path = self._profile_path, f"{_stmt_label(stmt)} > "
+        try:
+            body_fn = self._compile_block(stmt.body)
+        finally:
+            self._loops = outer_loops
+            self._profile_path = outer_path
+        return _UserFunc(
+            definition=stmt,
+            shape=_pattern_shape(stmt.pattern),
+            params=params,
+            param_types=[p.type for p in params],
+            slots=tuple(first_idx_for_name.items()),
+            first_positions=frozenset(first_idx_for_name.values()),
+            body=body_fn,
+            reads_only_assigned=reads_only_assigned(stmt),
+            callees=called_shapes(stmt.body),
+            symmetric_uses=self._compile_symmetric_uses(
+                stmt, params, first_idx_for_name
+            ),
+        )
+
+    def _compile_symmetric_uses(
+        self,
+        stmt: FunctionDef,
+        params: tuple[Param, ...],
+        first_idx_for_name: dict[str, int],
+    ) -> dict[int, tuple[tuple[_ShapeT, tuple[_ExprFnT | None, ...]], ...]]:
+        r"""Return the `symmetric_uses` of the function defined by *stmt* (see `_UserFunc`)."""
+        seq_positions = {shape: i for shape, (i, _) in SYMMETRIC.items()}
+        uses_by_position = {}
+        for name, i in first_idx_for_name.items():
+            if params[i].type != "s":
+                continue
+            calls = symmetric_uses(stmt.body, name, seq_positions)
+            if calls is None:
+                continue
+            uses = []
+            for call in calls:
+                shape = _call_shape(call.parts)
+                args = [part for part in call.parts if not isinstance(part, str)]
+                seq_position = seq_positions[shape]
+                # The other arguments are constant (so are folded)
+                arg_fns = tuple(
+                    None if j == seq_position else self._compile_expr(arg)
+                    for j, arg in enumerate(args)
+                )
+                uses.append((shape, arg_fns))
+            uses_by_position[i] = tuple(uses)
+        return uses_by_position
+
+    def _compile_if(self, stmt: IfStmt) -> _StmtFnT:
+        # In profiles, each branch's statements are numbered within the branch (e.g.,
+        # `2.3.1` for the first statement of the third branch of statement 2)
+        prefix = self._profile_path
+        try:
+            branches = []
+            for b, branch in enumerate(stmt.branches, 1):
+                self._profile_path = f"{prefix}{b}."
+                branches.append(
+                    (
+                        self._compile_task(branch.condition),
+                        self._compile_block(branch.body),
+                    )
+                )
+            self._profile_path = f"{prefix}{len(branches) + 1}."
+            else_fn = (
+                self._compile_block(stmt.else_branch.body)
+                if stmt.else_branch is not None
+                else None
+            )
+        finally:
+            self._profile_path = prefix
+        is_truthy = self._is_truthy
+
+        def _if() -> _StmtTaskT:
+            for cond_task, body_fn in branches:
+                if is_truthy((yield from cond_task())):
+                    return (yield from body_fn())
+            if else_fn is not None:
+                return (yield from else_fn())
+            return None
+
+        return _if
+
+    def _compile_loop(self, stmt: LoopStmt) -> _StmtFnT:
+        var = stmt.var
+        over_task = self._compile_task(stmt.over)
+        loop = _Loop(frozenset((var,)) | assigned_names(stmt.body))
+        self._loops.append(loop)
+        try:
+            body_fn = self._compile_block(stmt.body)
+        finally:
+            self._loops.pop()
+
+        def _loop() -> _StmtTaskT:
+            over = yield from over_task()
+            if not isinstance(over, tuple):
+                raise TypeError(
+                    f"loop over must be a sequence, got {type(over).__name__}"
+                )
+            # Each execution gets a fresh run number, invalidating whatever its body
+            # cached during the last one. A recursive call can execute this same loop
+            # while this execution is suspended, so the outer execution's number is
+            # restored once the inner one finishes.
+            outer_run = loop.run
+            self._loop_runs += 1
+            loop.run = self._loop_runs
+            try:
+                # AnyDice does not introduce a child scope for loop bodies. The loop
+                # variable is bound in the enclosing environment and any assignments
+                # in the body persist after the loop.
+                for value in over:
+                    self._env[var] = value
+                    result = yield from body_fn()
+                    if result is not None:
+                        return result
+            finally:
+                loop.run = outer_run
+            return None
+
+        return _loop
 
     def _is_truthy(self, v: _Val) -> bool:
         # AnyDice's `if` accepts ONLY numbers. Sequences are NOT sum-coerced in
@@ -398,73 +1277,213 @@ class AnyDiceInterpreter:
         else:
             raise TypeError(f"cannot use {type(v).__name__} as boolean condition")
 
-    # ---- Expression evaluation -----------------------------------------------------------
+    def _compile_expr(self, node: Expr) -> _ExprFnT:
+        if isinstance(node, (EmptySeq, Number)):
+            return self._compile_node(node)
+        return self._cache_invariant(node, self._compile_node(node))
+
+    def _cache_invariant(self, node: Expr, expr_fn: _ExprFnT) -> _ExprFnT:
+        r"""
+        Wrap *expr_fn*, compiled from *node*, to cache its value for as long as it can't change, if any.
+
+        Constant expressions are wrapped by `_fold`.
+        Expressions that are invariant in an enclosing loop are wrapped by `_hoist`.
+        """
+        if expr_facts(node, self._expr_facts) == (frozenset(), False):
+            return self._fold(expr_fn)  # see `analysis.is_constant`
+        if isinstance(node, (Var, StringExpr)):
+            return expr_fn  # cheaper to evaluate than to cache
+        loop = self._invariant_loop((node,))
+        return expr_fn if loop is None else self._hoist(loop, expr_fn)
+
+    def _invariant_loop(self, nodes: Iterable[Expr]) -> _Loop | None:
+        r"""
+        Return the outermost enclosing loop in which the values of *nodes* can't change from one iteration to the next, or `None` if there isn't one.
+
+        That's so if *nodes* call no functions and read no variable the loop's body writes.
+        (Assignments made by called functions never reach the caller's environment.)
+        Outer loops write every name inner ones do, so *nodes* are invariant in every loop inside the one returned.
+        """
+        if not self._loops:
+            return None
+        names: set[str] = set()
+        for node in nodes:
+            node_names, node_calls = expr_facts(node, self._expr_facts)
+            if node_calls:
+                return None
+            names.update(node_names)
+        return next(
+            (loop for loop in self._loops if names.isdisjoint(loop.written)), None
+        )
+
+    def _hoist(self, loop: _Loop, expr_fn: _ExprFnT) -> _ExprFnT:
+        r"""
+        Wrap *expr_fn*, compiled from an expression invariant in *loop* (see `_invariant_loop`), so its value is computed at most once per execution of the loop (and settings change).
 
-    def _eval(self, node: Expr) -> _Val:  # ruff: ignore[complex-structure]
+        This is like hoisting the expression out of the loop, but it's still evaluated only where (and if) the body first reaches it, so any error it raises does too.
+        An evaluation that raises isn't cached, so raises again when next reached.
+        """
+        cached_run = 0
+        cached_epoch = -1
+        cached_value: _Val = ()
+
+        def _hoisted() -> _Val:
+            nonlocal cached_run, cached_epoch, cached_value
+            if cached_run != loop.run or cached_epoch != self._settings_epoch:
+                cached_value = expr_fn()
+                cached_run = loop.run
+                cached_epoch = self._settings_epoch
+            return cached_value
+
+        return _hoisted
+
+    def _fold(self, expr_fn: _ExprFnT) -> _ExprFnT:
+        r"""
+        Wrap *expr_fn*, compiled from a constant expression (see `analysis.is_constant`), so its value is computed at most once per settings change.
+
+        Constant expressions in loop and function bodies (e.g., `3d6` or `{1..20}`) are then only evaluated the first time they're reached.
+        Any `set` may change what such an expression evaluates to (e.g., `position order` for `@`, or calculation precision for dice), so values are recomputed afterward.
+        An evaluation that raises isn't cached, so raises again when next reached.
+        """
+        cached_epoch = -1
+        cached_value: _Val = ()
+
+        def _folded() -> _Val:
+            nonlocal cached_epoch, cached_value
+            if cached_epoch != self._settings_epoch:
+                cached_value = expr_fn()
+                cached_epoch = self._settings_epoch
+            return cached_value
+
+        return _folded
+
+    def _compile_node(self, node: Expr) -> _ExprFnT:  # ruff: ignore[complex-structure]
         if isinstance(node, EmptySeq):
-            return ()
+            return lambda: ()
         elif isinstance(node, Number):
-            return node.value
+            value = node.value
+            return lambda: value
         elif isinstance(node, SeqExpr):
-            return self._eval_seq(node.elems)
+            return self._compile_seq(node.elems)
         elif isinstance(node, DiceUnary):
-            faces = self._eval(node.faces)
-            # Unary `d` on an already-die-like value (H or P) is identity.
-            # Critical for preserving pool positional info through `dDIE` when
-            # DIE = NdX is a pool: collapsing via `_make_die` (which would
-            # call `P.h()`) loses the N-die structure that downstream
-            # `[highest K of dDIE]`-style builtins need to operate over.
-            # Verified necessary by program 178 (`[highest H of dDIE]` where
-            # DIE = 4d100; AnyDice's `d` on a pool is a no-op).
-            return faces if isinstance(faces, (H, P)) else self._make_die(faces)
+            return self._compile_dice_unary(node)
         elif isinstance(node, DiceBinOp):
-            n = self._eval(node.n)
+            return self._compile_dice_binop(node)
+        elif isinstance(node, StringExpr):
+            return self._compile_string(node.parts)
+        elif isinstance(node, Var):
+            name = node.name
+
+            def _var() -> _Val:
+                try:
+                    return self._env[name]
+                except KeyError:
+                    raise NameError(f"undefined variable: {name!r}") from None
+
+            return _var
+        elif isinstance(node, BinOp):
+            return self._compile_binop(node)
+        elif isinstance(node, HashOp):
+            return _compose1(self._apply_hash, self._compile_expr(node.expr))
+        elif isinstance(node, NegOp):
+            return _compose1(self._apply_neg, self._compile_expr(node.expr))
+        elif isinstance(node, NotOp):
+            return _compose1(self._apply_not, self._compile_expr(node.expr))
+        elif isinstance(node, PosOp):
+            return self._compile_expr(node.expr)
+        elif isinstance(node, Call):
+            return self._compile_call(node)
+        else:  # pragma: no cover
+            raise NotImplementedError(f"unhandled expression: {type(node).__name__}")
+
+    def _compile_sum(self, node: Expr) -> _ExprFnT:
+        r"""
+        Compile *node* for a context that only ever observes its sum (e.g., an output or a comparison operand).
+
+        Dice rolled in such a context are summed directly rather than kept as pools for positional selection.
+        """
+        if isinstance(node, DiceBinOp):
+            expr_fn = self._compile_dice_binop(node, sum_only=True)
+        elif isinstance(node, BinOp) and node.op in _ARITH_OPS - _EMPTY_DIE_SKIPS_ARITH:
+            expr_fn = self._compile_binop(node, sum_only=True)
+        elif isinstance(node, PosOp):
+            return self._compile_sum(node.expr)
+        else:
+            return self._compile_expr(node)
+        return self._cache_invariant(node, expr_fn)
+
+    def _compile_binop(self, node: BinOp, *, sum_only: bool = False) -> _ExprFnT:
+        op = node.op
+        # Comparisons always collapse pools to their sums. Arithmetic does too, but a
+        # pool can survive it (`d{} + <pool>` is the pool itself, not its sum), so
+        # its operands are only sums if its result is.
+        if op in _CMP_OPS or (sum_only and op in _ARITH_OPS):
+            left_fn = self._compile_sum(node.left)
+            right_fn = self._compile_sum(node.right)
+        else:
+            left_fn = self._compile_expr(node.left)
+            right_fn = self._compile_expr(node.right)
+        if op == "@":
+            apply_at = self._apply_at
+            return lambda: apply_at(left_fn(), right_fn())
+        elif op in _ARITH_OPS:
+            apply_arith = self._apply_arith
+            return lambda: apply_arith(op, left_fn(), right_fn())
+        elif op in _CMP_OPS:
+            apply_cmp = self._apply_cmp
+            return lambda: apply_cmp(op, left_fn(), right_fn())
+        else:  # pragma: no cover
+            apply_binop = self._apply_binop
+            return lambda: apply_binop(op, left_fn(), right_fn())
+
+    def _compile_dice_unary(self, node: DiceUnary) -> _ExprFnT:
+        faces_fn = self._compile_expr(node.faces)
+        make_die = self._make_die
+
+        def _dice_unary() -> _Val:
+            faces = faces_fn()
+            # Unary `d` on an already-die-like value (H or P) is identity. Critical for
+            # preserving pool positional info through `dDIE` when DIE = NdX is a pool:
+            # collapsing via `_make_die` (which would call `P.h()`) loses the N-die
+            # structure that downstream `[highest K of dDIE]`-style builtins need to
+            # operate over. Verified necessary by program 178 (`[highest H of dDIE]`
+            # where DIE = 4d100; AnyDice's `d` on a pool is a no-op).
+            return faces if isinstance(faces, (H, P)) else make_die(faces)
+
+        return _dice_unary
+
+    def _compile_dice_binop(
+        self, node: DiceBinOp, *, sum_only: bool = False
+    ) -> _ExprFnT:
+        n_fn = self._compile_sum(node.n)
+        faces_fn = self._compile_expr(node.faces)
+        make_die = self._make_die
+        roll_n = self._roll_n
+        expand_dice_count = self._expand_dice_count
+
+        def _dice_binop() -> _Val:
+            n = n_fn()
             if isinstance(n, tuple):
                 n = sum(n)
             elif isinstance(n, P):
                 n = n.h()
             if isinstance(n, int):
-                faces = self._eval(node.faces)
+                faces = faces_fn()
                 if n == 1 and isinstance(faces, P):
                     # 1d(<pool>) is treated as a no-op
                     return faces
-                return self._roll_n(n, self._make_die(faces))
+                return roll_n(n, make_die(faces), sum_only=sum_only)
             elif isinstance(n, H):
-                # AnyDice expands a die-as-count over its outcomes: for each
-                # outcome k, evaluate `k d <faces>` and combine the per-outcome
-                # distributions weighted by k's probability. Inner distributions
-                # have different totals (1d6 vs 2d6 vs ...) so we must LCM-
-                # normalize before merging or the relative weighting will be
-                # wrong.
-                return self._expand_dice_count(
-                    n, self._make_die(self._eval(node.faces))
-                )
+                # AnyDice expands a die-as-count over its outcomes: for each outcome k,
+                # evaluate `k d <faces>` and combine the per-outcome distributions
+                # weighted by k's probability. Inner distributions have different
+                # totals (1d6 vs 2d6 vs ...) so we must LCM-normalize before merging
+                # or the relative weighting will be wrong.
+                return expand_dice_count(n, make_die(faces_fn()))
             else:
                 raise TypeError(f"dice count must be a number, got {type(n).__name__}")
-        elif isinstance(node, StringExpr):
-            return self._eval_string(node.parts)
-        elif isinstance(node, Var):
-            if node.name not in self._env:
-                raise NameError(f"undefined variable: {node.name!r}")
-            return self._env[node.name]
-        elif isinstance(node, BinOp):
-            left = self._eval(node.left)
-            right = self._eval(node.right)
-            if node.op == "@":
-                return self._apply_at(left, right)
-            return self._apply_binop(node.op, left, right)
-        elif isinstance(node, HashOp):
-            return self._apply_hash(self._eval(node.expr))
-        elif isinstance(node, NegOp):
-            return self._apply_neg(self._eval(node.expr))
-        elif isinstance(node, NotOp):
-            return self._apply_not(self._eval(node.expr))
-        elif isinstance(node, PosOp):
-            return self._eval(node.expr)
-        elif isinstance(node, Call):
-            return self._call(node)
-        else:  # pragma: no cover
-            raise NotImplementedError(f"unhandled expression: {type(node).__name__}")
+
+        return _dice_binop
 
     # ---- Unary operators -----------------------------------------------------------------
 
@@ -474,7 +1493,7 @@ class AnyDiceInterpreter:
         elif isinstance(v, (int, H)):
             return -v
         elif isinstance(v, P):
-            return P(*(-h for h in v))
+            return _SumCachingPool(*(-h for h in v))
         else:  # pragma: no cover
             raise TypeError(f"cannot negate {type(v).__name__}")
 
@@ -542,7 +1561,21 @@ class AnyDiceInterpreter:
         left = left.h() if isinstance(left, P) else left
         right = right.h() if isinstance(right, P) else right
 
-        return dempty if l_empty or r_empty else self._h_binop(op, left, right)
+        return dempty if l_empty or r_empty else self._h_arith(op, left, right)
+
+    def _h_arith(self, op: str, left: _Val, right: _Val) -> int | H[int]:
+        if op in ("+", "-") and isinstance(left, H) and isinstance(right, H):
+            # Adding or subtracting dice is a convolution of their counts
+            assert self._settings is not None, "_h_arith called outside run()"
+            counts = convolve_counts(
+                list(left.items()),
+                list(right.items()),
+                subtract=op == "-",
+                fft=self._settings.fft_convolution(),
+            )
+            if counts is not None:
+                return H(counts)
+        return self._h_binop(op, left, right)
 
     def _apply_cmp(self, op: str, left: _Val, right: _Val) -> int | H[int]:  # ruff: ignore[complex-structure]
         if isinstance(left, P):
@@ -585,16 +1618,37 @@ class AnyDiceInterpreter:
             raise TypeError(f"expected a number or die, got {type(right).__name__}")
         left_h = left if isinstance(left, H) else H({left: 1})
         right_h = right if isinstance(right, H) else H({right: 1})
-        result: dict[int, int] = {}
-        op_func = _OP_FUNCS_H_ITER[op]
-        for lo, lw in left_h.items():
-            for ro, rw in right_h.items():
-                outcome = op_func(lo, ro)
-                result[outcome] = result.get(outcome, 0) + lw * rw
-        return H(result)
+        return H(_binop_counts(op, list(left_h.items()), list(right_h.items())))
 
     # ---- @ operator ----------------------------------------------------------------------
 
+    def _select(self, pool: PoolT, which: tuple[int, ...]) -> H[int]:
+        r"""Return `pool.h(*which)`, via the run's selection cache (if any)."""
+        cache = self._selection_cache
+        if cache is None:
+            return pool.h(*which)
+        assert self._settings is not None, "_select called outside run()"
+        key = ("@", self._settings.calc_bit_width, pool_key(pool), which)
+        return cache.select(key, lambda: pool.h(*which))
+
+    def _cached_selection(
+        self, shape: _ShapeT, impl: Callable[..., H]
+    ) -> Callable[..., H]:
+        r"""
+        Wrap *impl*, the implementation of the selection builtin with *shape*, to look up and add its results in the run's selection cache (if any).
+
+        Results depend only on the arguments and the calculation precision (other settings don't affect selections).
+        """
+
+        def _impl(settings: Settings, *args: _Val) -> H:
+            cache = self._selection_cache
+            if cache is None:
+                return impl(settings, *args)
+            key = (shape, settings.calc_bit_width, *map(_selection_key, args))
+            return cache.select(key, lambda: impl(settings, *args))
+
+        return _impl
+
     def _apply_at(self, left: _Val, right: _Val) -> int | H[int]:
         if isinstance(left, (H, P)):
             raise TypeError("@ left operand must be a number or sequence, got die")
@@ -627,9 +1681,9 @@ class AnyDiceInterpreter:
             # 1-based position. highest-first: pos 1 = highest = pool.h(-1).
             # lowest-first:  pos 1 = lowest  = pool.h(0).
             elif self._settings.highest_first():
-                return pool.h(-left)
+                return self._select(pool, (-left,))
             else:
-                return pool.h(left - 1)
+                return self._select(pool, (left - 1,))
         elif isinstance(left, tuple):
             # Multi-position semantic: each element of the seq is a separate
             # position. The positions come from the SAME pool roll, so they're
@@ -645,7 +1699,7 @@ class AnyDiceInterpreter:
                     selectors.append(-p_int if highest_first else p_int - 1)
             if not selectors:
                 return dzero
-            return pool.h(*selectors)
+            return self._select(pool, tuple(selectors))
         else:
             raise TypeError(
                 f"@ left operand must be a number or sequence, got {type(left).__name__}"
@@ -705,7 +1759,7 @@ class AnyDiceInterpreter:
         else:
             raise TypeError(f"cannot use {type(faces).__name__} as die faces")
 
-    def _roll_n(self, n: int, die: H[int]) -> H[int] | PoolT:
+    def _roll_n(self, n: int, die: H[int], *, sum_only: bool = False) -> H[int] | PoolT:
         # Strip zero-count entries before constructing a pool. Most of the time, we
         # preserve them as keys (so `#{H}` reads the right support), but pool selection
         # arithmetic in dyce.p assumes positive counts and divides by gcd(0, 0) when fed
@@ -719,19 +1773,20 @@ class AnyDiceInterpreter:
         elif n < 0:
             # AnyDice convention: `(-N)dX = -(NdX)` -- roll |N| dice and negate the
             # sum. Verified via 6585 (`1d6 - (-1d6)` yields 2d6's distribution).
-            # Returns an H since negation collapses the pool's positional info,
-            # which the negative-count case can't preserve anyway.
-            return (-n) @ P(-die)
+            return _sum_dice(-n, -die) if sum_only else _SumCachingPool((-n) @ P(-die))
+        elif sum_only:
+            # Nothing downstream can select positions, so skip the pool
+            return _sum_dice(n, die)
         else:
             # Use a Pool so that @ can select positions. Arithmetic/output sums via .h().
-            return n @ P(die)
+            return _SumCachingPool(n @ P(die))
 
     def _expand_dice_count(
         self, n_die: H[int], face_die: H[int]
     ) -> H[int] | _EmptyPoolOfOne:
         # For each outcome k of n_die with weight w_k, compute kd<face_die> and combine.
         # Inner distributions can have different totals (e.g. 1d6 has total 6 vs 2d6's
-        # 36). aggregate_weighted LCM-normalizes them before merging to preserve the
+        # 36). _WeightedAggregate LCM-normalizes them before merging to preserve the
         # relative probabilities of each outer-outcome branch.
         #
         # Erm, that is, *except* when either n_die or face_die is the empty die. How big
@@ -744,12 +1799,22 @@ class AnyDiceInterpreter:
         if not n_die or not face_die:
             return _EmptyPoolOfOne()
 
-        def _gen() -> Iterator[tuple[H[int], int]]:
-            for k, w_k in n_die.items():
-                sub = self._roll_n(k, face_die)
-                yield (sub.h() if isinstance(sub, P) else sub), w_k
-
-        return aggregate_weighted(_gen())  # ty: ignore[invalid-return-type]
+        # Sums are aggregated in order of their counts, which leaves the (linear)
+        # aggregate unchanged
+        agg = _WeightedAggregate()
+        weights = dict(n_die.items())
+        # See `_roll_n`
+        die = H({o: c for o, c in face_die.items() if c > 0})
+        if die:
+            for n, counts in _iter_sum_dice_counts(die, (abs(k) for k in weights if k)):
+                if n in weights:
+                    agg.add(H(counts), weights[n])
+                if -n in weights:
+                    agg.add(H({-o: c for o, c in counts.items()}), weights[-n])
+        for k, w_k in weights.items():
+            if not k or not die:
+                agg.add(self._roll_n(k, face_die, sum_only=True), w_k)  # ty: ignore[invalid-argument-type]
+        return agg.h()
 
     # ---- Coercion ------------------------------------------------------------------------
 
@@ -765,27 +1830,44 @@ class AnyDiceInterpreter:
         else:
             raise TypeError(f"cannot coerce {type(value).__name__} to die")
 
-    def _eval_name(self, name: Expr | None) -> str | None:
+    def _compile_name(self, name: Expr | None) -> Callable[[], str | None]:
         if name is None:
-            return None
-        v = self._eval(name)
-        if isinstance(v, str):
-            return v
-        else:
-            raise TypeError(
-                f"output name must resolve to string, got {type(v).__name__}"
-            )
+            return lambda: None
+        name_fn = self._compile_expr(name)
+
+        def _name() -> str | None:
+            v = name_fn()
+            if isinstance(v, str):
+                return v
+            else:
+                raise TypeError(
+                    f"output name must resolve to string, got {type(v).__name__}"
+                )
 
-    def _eval_string(self, parts: list[StrLit | StrVar]) -> str:
-        fragments: list[str] = []
-        for part in parts:
-            if isinstance(part, StrLit):
-                fragments.append(part.text)
-            elif isinstance(part, StrVar):
-                if part.name not in self._env:
-                    raise NameError(f"undefined variable: {part.name!r}")
-                fragments.append(self._stringify(self._env[part.name]))
-        return "".join(fragments)
+        return _name
+
+    def _compile_string(self, parts: tuple[StrLit | StrVar, ...]) -> _ExprFnT:
+        # Literal fragments stay as text. Interpolated variables become names to look
+        # up at evaluation time.
+        fragments = tuple(
+            (False, part.text) if isinstance(part, StrLit) else (True, part.name)
+            for part in parts
+        )
+        stringify = self._stringify
+
+        def _string() -> str:
+            env = self._env
+            pieces: list[str] = []
+            for is_var, text in fragments:
+                if is_var:
+                    if text not in env:
+                        raise NameError(f"undefined variable: {text!r}")
+                    pieces.append(stringify(env[text]))
+                else:
+                    pieces.append(text)
+            return "".join(pieces)
+
+        return _string
 
     def _stringify(self, v: _Val) -> str:
         # Used for string interpolation. We don't try to reverse-engineer AnyDice's
@@ -811,39 +1893,69 @@ class AnyDiceInterpreter:
 
     # ---- Sequence evaluation -------------------------------------------------------------
 
-    def _eval_seq(self, elems: list[SeqElem]) -> SeqT:
-        values: list[int] = []
-        for elem in elems:
-            if isinstance(elem, ValueElem):
-                self._extend_seq_value(values, self._eval(elem.expr), repeat=1)
-            elif isinstance(elem, ValueRepeatElem):
-                repeat = self._eval(elem.repeat)
+    def _compile_seq(self, elems: tuple[SeqElem, ...]) -> _ExprFnT:
+        elem_fns = tuple(self._compile_seq_elem(elem) for elem in elems)
+
+        def _seq() -> SeqT:
+            values: list[int] = []
+            for elem_fn in elem_fns:
+                elem_fn(values)
+            # Sequences preserve write order. The "position order" setting affects
+            # digit selection on numbers and position selection on pools, not sequence
+            # indexing.
+            return tuple(values)
+
+        return _seq
+
+    def _compile_seq_elem(self, elem: SeqElem) -> Callable[[list[int]], None]:  # ruff: ignore[complex-structure]
+        extend_seq_value = self._extend_seq_value
+        if isinstance(elem, ValueElem):
+            expr_fn = self._compile_expr(elem.expr)
+            return lambda values: extend_seq_value(values, expr_fn(), repeat=1)
+        elif isinstance(elem, ValueRepeatElem):
+            expr_fn = self._compile_expr(elem.expr)
+            repeat_fn = self._compile_expr(elem.repeat)
+
+            def _value_repeat(values: list[int]) -> None:
+                repeat = repeat_fn()
                 if isinstance(repeat, tuple):
                     repeat = sum(repeat)
                 if not isinstance(repeat, int):
                     raise TypeError("sequence repeat count must be a number")
-                self._extend_seq_value(values, self._eval(elem.expr), repeat=repeat)
-            elif isinstance(elem, RangeElem):
-                start = self._eval_int(elem.start, "range bounds")
-                stop = self._eval_int(elem.stop, "range bounds")
+                extend_seq_value(values, expr_fn(), repeat=repeat)
+
+            return _value_repeat
+        elif isinstance(elem, RangeElem):
+            start_fn = self._compile_int(elem.start, "range bounds")
+            stop_fn = self._compile_int(elem.stop, "range bounds")
+
+            def _range(values: list[int]) -> None:
+                start = start_fn()
+                stop = stop_fn()
                 # AnyDice: Only ascending ranges yield values. Descending yields empty.
                 if start <= stop:
                     values.extend(range(start, stop + 1))
-            elif isinstance(elem, RangeRepeatElem):
-                start = self._eval_int(elem.start, "range bounds")
-                stop = self._eval_int(elem.stop, "range bounds")
-                repeat = self._eval_int(elem.repeat, "range repeat count")
+
+            return _range
+        elif isinstance(elem, RangeRepeatElem):
+            start_fn = self._compile_int(elem.start, "range bounds")
+            stop_fn = self._compile_int(elem.stop, "range bounds")
+            repeat_fn = self._compile_int(elem.repeat, "range repeat count")
+
+            def _range_repeat(values: list[int]) -> None:
+                start = start_fn()
+                stop = stop_fn()
+                repeat = repeat_fn()
                 if start <= stop:
-                    # `{a..b:N}` concatenates the whole [a..b] range N times, *not* each
-                    # element repeated N times
+                    # `{a..b:N}` concatenates the whole [a..b] range N times, *not*
+                    # each element repeated N times
                     values.extend(list(range(start, stop + 1)) * repeat)
-            else:
-                raise NotImplementedError(
-                    f"unhandled sequence element: {type(elem).__name__}"
-                )
-        # Sequences preserve write order. The "position order" setting affects digit
-        # selection on numbers and position selection on pools, not sequence indexing.
-        return tuple(values)
+
+            return _range_repeat
+        else:  # pragma: no cover
+            raise NotImplementedError(
+                f"unhandled sequence element: {type(elem).__name__}"
+            )
 
     def _extend_seq_value(self, values: list[int], v: _Val, *, repeat: int) -> None:
         if isinstance(v, int):
@@ -870,34 +1982,121 @@ class AnyDiceInterpreter:
             f"sequence element must be a number, sequence, or die, got {type(v).__name__}"
         )
 
-    def _eval_int(self, expr: Expr, what: str) -> int:
-        v = self._eval(expr)
-        if isinstance(v, tuple):
-            v = sum(v)
-        if isinstance(v, int):
-            return v
-        raise TypeError(f"{what} must be a number")
+    def _compile_int(self, expr: Expr, what: str) -> Callable[[], int]:
+        expr_fn = self._compile_expr(expr)
+
+        def _int() -> int:
+            v = expr_fn()
+            if isinstance(v, tuple):
+                v = sum(v)
+            if isinstance(v, int):
+                return v
+            raise TypeError(f"{what} must be a number")
+
+        return _int
 
     # ---- Function calls ------------------------------------------------------------------
 
-    def _call(self, call: Call) -> _Val:
-        assert self._settings is not None, "_call called outside run()"
-        # Recursion-depth guard: Each call exceeding the configured maximum returns
-        # H({}) without executing the body. The unwinding result is then governed by
-        # how each operator treats H({}) (e.g. + treats it as 0; / propagates).
-        if self._depth >= self._settings.max_depth:
-            return H({})
+    def _compile_call(self, call: Call) -> _ExprFnT:
         shape = _call_shape(call.parts)
-        args: list[_Val] = [
-            self._eval(part) for part in call.parts if not isinstance(part, str)
-        ]
-        # User-defined functions shadow builtins by lookup order.
-        entry: FunctionDef | tuple[list[str | None], Callable[..., _Val]] | None = (
-            self._funcs.get(shape) or self._builtins.get(shape)
+        parts = call.parts
+        # Arguments are compiled first, so any calls they contain precede this one
+        arg_fns = tuple(
+            self._compile_expr(part) for part in parts if not isinstance(part, str)
         )
-        if entry is None:
-            raise NameError(f"undefined function for call: {call.parts!r}")
-        return self._invoke(entry, args)
+        invoke = (
+            self._invoke
+            if self._profiler is None
+            else self._profiled_invoke(_shape_label(shape))
+        )
+        # A builtin's result depends only on its arguments (and the settings), so if
+        # those can't change from one iteration of an enclosing loop to the next,
+        # neither can the result. Calls to user-defined functions aren't cached here,
+        # since dynamic scoping lets their bodies read the loop's variables (pure ones
+        # are memoized by `_invoke` anyway).
+        loop = self._invariant_loop(part for part in parts if not isinstance(part, str))
+        step = self._step
+        cached_run = 0
+        cached_epoch = -1
+        cached_entry: object = None
+        cached_value: _Val = ()
+
+        def _call_site() -> _Val | _TaskT:
+            nonlocal cached_run, cached_epoch, cached_entry, cached_value
+            assert self._settings is not None, "_call called outside run()"
+            # Only called below the configured maximum depth (see `_compile_task`)
+            if step is not None:
+                step()
+            args: list[_Val] = [arg_fn() for arg_fn in arg_fns]
+            # User-defined functions shadow builtins by lookup order. Lookup happens
+            # per call because functions can be (re)defined after this call site is
+            # compiled.
+            entry: _UserFunc | tuple[list[str | None], Callable[..., _Val]] | None = (
+                self._funcs.get(shape) or self._builtins.get(shape)
+            )
+            if entry is None:
+                raise NameError(f"undefined function for call: {parts!r}")
+            if loop is None or isinstance(entry, _UserFunc):
+                return invoke(entry, args)
+            if (
+                cached_run != loop.run
+                or cached_epoch != self._settings_epoch
+                or cached_entry is not entry
+            ):
+                cached_value = invoke(entry, args)
+                assert not isinstance(cached_value, GeneratorType)
+                cached_run = loop.run
+                cached_epoch = self._settings_epoch
+                cached_entry = entry
+            return cached_value
+
+        # See `_compile_task`
+        assert self._call_sites is not None, "call compiled outside _compile_task"
+        i = len(self._call_sites)
+        self._call_sites.append(_call_site)
+        return lambda: self._temps[i]
+
+    def _profiled_invoke(
+        self, builtin_label: str
+    ) -> Callable[
+        [_UserFunc | tuple[list[str | None], Callable[..., _Val]], list[_Val]],
+        _Val | _TaskT,
+    ]:
+        r"""
+        Return a replacement for `_invoke` that has each call recorded by the run's profiler.
+
+        Calls to user-defined functions are labeled by the first line of their definitions, and calls to builtins by *builtin_label*.
+        """
+        profiler = self._profiler
+        assert profiler is not None, "_profiled_invoke called without a profiler"
+        invoke = self._invoke
+
+        def _profiled_task(label: str, task: _TaskT) -> _TaskT:
+            profiler.enter("function", label)
+            result: _Val | None = None
+            try:
+                result = yield from task
+                return result
+            finally:
+                profiler.exit(result)
+
+        def _invoke_profiled(
+            entry: _UserFunc | tuple[list[str | None], Callable[..., _Val]],
+            args: list[_Val],
+        ) -> _Val | _TaskT:
+            if isinstance(entry, _UserFunc):
+                task = invoke(entry, args)
+                assert isinstance(task, GeneratorType)
+                return _profiled_task(_stmt_label(entry.definition), task)
+            profiler.enter("builtin", builtin_label)
+            value: _Val | None = None
+            try:
+                value = invoke(entry, args)
+                return value
+            finally:
+                profiler.exit(value)
+
+        return _invoke_profiled
 
     def _bind_and_expand(  # ruff: ignore[complex-structure]
         self,
@@ -1000,6 +2199,13 @@ class AnyDiceInterpreter:
                         return None
                     if len(arg) == 1:
                         expansion.append((i, [((o,), w) for o, w in arg.h().items()]))
+                    elif len(set(arg)) == 1:
+                        # Identical dice (e.g., `8d10`), whose rolls can be generated in
+                        # order as they're needed
+                        descending = self._settings.highest_first()
+                        expansion.append(
+                            (i, _PoolRolls(arg[0], len(arg), descending=descending))
+                        )
                     elif self._settings.highest_first():
                         rolls = sorted(
                             arg.rolls_with_counts(),
@@ -1026,24 +2232,25 @@ class AnyDiceInterpreter:
 
     def _invoke(
         self,
-        entry: FunctionDef | tuple[list[str | None], Callable[..., _Val]],
+        entry: _UserFunc | tuple[list[str | None], Callable[..., _Val]],
         args: list[_Val],
-    ) -> _Val:
-        # Polymorphic on entry type. User-defined functions (`FunctionDef`)
-        # tree-walk an AST body inside a managed local env with first-
-        # occurrence-wins duplicate-name handling. Builtins
-        # (`(param_types, impl)`) call a Python callable per expansion combo
-        # with the bound args. Both paths share the per-param coercion via
-        # `_bind_and_expand` and the LCM-aggregate via `_aggregate_iters`.
-        if isinstance(entry, FunctionDef):
-            params = [p for p in entry.pattern if isinstance(p, Param)]
-            param_types = [p.type for p in params]
-            err_label = lambda i: f"function param {params[i].name}"  # ruff: ignore[lambda-assignment]
-            bind = self._bind_and_expand(param_types, args, err_label=err_label)
-            if bind is None:
-                return H({})
-            bound, expansion = bind
-            return self._invoke_user(entry, params, bound, expansion)
+    ) -> _Val | _TaskT:
+        # Polymorphic on entry type. User-defined functions (`_UserFunc`)
+        # run a compiled body inside a managed local env with first-
+        # occurrence-wins duplicate-name handling, and return a task for
+        # `_run_task` to run. Builtins (`(param_types, impl)`) call a Python
+        # callable per expansion combo with the bound args, and return the
+        # result directly. Both paths share the per-param coercion via
+        # `_bind_and_expand` and the combo iteration and LCM-aggregate via
+        # `_iter_combos` and `_aggregate_result`.
+        if isinstance(entry, _UserFunc):
+            if self._is_pure(entry):
+                return self._memoized(
+                    self._call_cache,
+                    (entry.shape, *map(_value_key, args)),
+                    lambda: self._bind_and_invoke_user(entry, args),
+                )
+            return self._bind_and_invoke_user(entry, args)
         else:
             param_types, impl = entry
             err_label = lambda i: f"builtin param {i}"  # ruff: ignore[lambda-assignment]
@@ -1053,13 +2260,97 @@ class AnyDiceInterpreter:
             bound, expansion = bind
             return self._invoke_builtin(impl, bound, expansion)
 
+    # ---- Call memoization ----------------------------------------------------------------
+
+    def _invalidate_call_cache(self) -> None:
+        self._call_cache.clear()
+        self._body_cache.clear()
+        self._impure = None
+
+    def _is_pure(self, func: _UserFunc) -> bool:
+        if self._impure is None:
+            self._impure = self._find_impure()
+        return func.shape not in self._impure
+
+    def _find_impure(self) -> set[_ShapeT]:
+        r"""Return the shapes of user-defined functions whose results are not determined solely by their argument values.
+
+        A function is pure if its body reads only its params and locals it has already assigned (AnyDice is dynamically scoped, so anything else is read from the caller), and every function it calls is a builtin or itself pure.
+        Calls have no other effects to worry about: a body cannot `set`, `output`, or define functions, and its local env is discarded on return.
+        """
+        funcs = self._funcs
+        builtins = self._builtins
+        impure = {
+            shape
+            for shape, func in funcs.items()
+            if not func.reads_only_assigned
+            or any(c not in funcs and c not in builtins for c in func.callees)
+        }
+        # Propagate impurity to callers until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for shape, func in funcs.items():
+                if shape not in impure and not func.callees.isdisjoint(impure):
+                    impure.add(shape)
+                    changed = True
+        return impure
+
+    def _memoized(
+        self,
+        cache: dict[tuple, _CallCacheEntryT],
+        key: tuple,
+        compute: Callable[[], _TaskT],
+    ) -> _TaskT:
+        r"""Run the task `compute()`, reusing a result cached in *cache* under *key* where one applies.
+
+        *compute*'s result must be determined by *key* except for the recursion cap, which is the only other thing that can influence a pure function's result.
+        While computing a result, we track its *reach* (the deepest call attempted beneath it relative to the current depth) and whether any attempt was capped.
+        An uncapped result is valid at any depth from which its reach still falls below the cap.
+        A capped result is only reused at the exact depth it was computed at.
+        """
+        assert self._settings is not None, "_memoized called outside run()"
+        depth = self._depth
+        cached = cache.get(key)
+        if cached is not None:
+            result, reach, capped_depth = cached
+            if (
+                depth + reach < self._settings.max_depth
+                if capped_depth is None
+                else depth == capped_depth
+            ):
+                if depth + reach > self._reach:
+                    self._reach = depth + reach
+                if capped_depth is not None:
+                    self._capped = True
+                return result
+        outer_reach, outer_capped = self._reach, self._capped
+        self._reach, self._capped = depth, False
+        try:
+            result = yield from compute()
+            cache[key] = (
+                result,
+                self._reach - depth,
+                depth if self._capped else None,
+            )
+        finally:
+            self._reach = max(self._reach, outer_reach)
+            self._capped = self._capped or outer_capped
+        return result
+
+    def _bind_and_invoke_user(self, func: _UserFunc, args: list[_Val]) -> _TaskT:
+        bind = self._bind_and_expand(func.param_types, args, err_label=func.err_label)
+        if bind is None:
+            return H({})
+        bound, expansion = bind
+        return (yield from self._invoke_user(func, bound, expansion))
+
     def _invoke_user(
         self,
-        func: FunctionDef,
-        params: list[Param],
+        func: _UserFunc,
         bound: _BoundT,
         expansion: _ExpansionT,
-    ) -> _Val:
+    ) -> _TaskT:
         # No-expansion fast path: invoke the body once with `bound` installed in
         # the env. Any returned H is kept bounded by the ambient `quantize_hs`
         # context (see _apply_calc_precision), not truncated here. That matters
@@ -1068,7 +2359,8 @@ class AnyDiceInterpreter:
         # bypass expansion), whose bigint-growing operations would otherwise
         # propagate untruncated.
         if not expansion:
-            return self._invoke_with_bound(func, params, bound)
+            return (yield from self._invoke_with_bound(func, bound))
+        expansion = self._reduce_symmetric(func, expansion)
 
         # Cartesian product over expanded iterations. Per-iteration return
         # values may have differing internal totals (a body branch returning
@@ -1100,40 +2392,120 @@ class AnyDiceInterpreter:
         #   function: dup A:n and A:d { if A=7 {result: 1dA} result: 999 }
         #     output [dup 7 and 1d6] -> H({1:1,...,7:1}) i.e. 1dA = 1d7.
         # Surfaced by corpus program 26018 (signature has `D:n` and `D:d`).
-        first_idx_for_name: dict[str, int] = {}
-        for i, param in enumerate(params):
-            first_idx_for_name.setdefault(param.name, i)
-
-        saved_env = self._env
-        self._env = dict(saved_env)
-        self._depth += 1
+        # `func.slots` and `func.first_positions` are precomputed accordingly.
+        slots = func.slots
+        # (name, expansion index) for each expanding first-occurrence param
+        overrides = tuple(
+            (func.params[idx].name, j)
+            for j, (idx, _) in enumerate(expansion)
+            if idx in func.first_positions
+        )
+        body = func.body
 
-        def _per_iter(combo: tuple[tuple[_Val, int], ...]) -> _Val:
+        def _run_iter(combo: tuple[tuple[_Val, int], ...]) -> _TaskT:
             # Reset ALL params to their entry-bound values per iter.
             # Non-param env vars persist their mutations from the
             # previous iter. Skip duplicate-named param positions so
             # only the first-occurrence binding takes effect.
-            for i, param in enumerate(params):
-                if first_idx_for_name[param.name] == i:
-                    self._env[param.name] = bound[i]
+            env = self._env
+            for name, i in slots:
+                env[name] = bound[i]
             # Override expanding params with this iteration's combo,
             # again only at the first-occurrence position so a
             # duplicate that happens to expand doesn't clobber the
             # earlier binding.
-            for j, (idx, _) in enumerate(expansion):
-                value, _w = combo[j]
-                if first_idx_for_name[params[idx].name] == idx:
-                    self._env[params[idx].name] = value
-            return self._execute_body(func)
+            for name, j in overrides:
+                env[name] = combo[j][0]
+            return (yield from self._execute_body(body))
+
+        per_iter = _run_iter
+        if self._is_pure(func) and not any(
+            isinstance(items, _PoolRolls) for _, items in expansion
+        ):
+            # A pure body's result is determined by its param bindings (the body
+            # can't observe the non-param vars carried over from earlier iters), so
+            # bodies can be memoized on them. Non-expanding params' keys are the
+            # same for every iter. Not when expanding over generated rolls, though,
+            # which would store a body result for every roll.
+            shape = func.shape
+            slot_keys = [_value_key(bound[i]) for _, i in slots]
+            slot_for_name = {name: k for k, (name, _) in enumerate(slots)}
+            override_slots = tuple((slot_for_name[name], j) for name, j in overrides)
+            body_cache = self._body_cache
+
+            def _memoized_iter(combo: tuple[tuple[_Val, int], ...]) -> _TaskT:
+                keys = slot_keys.copy()
+                for k, j in override_slots:
+                    keys[k] = _value_key(combo[j][0])
+                return self._memoized(
+                    body_cache, (shape, *keys), lambda: _run_iter(combo)
+                )
+
+            per_iter = _memoized_iter
 
+        saved_env = self._env
+        self._env = _Env(saved_env)
+        self._depth += 1
         try:
-            return self._aggregate_iters(
-                expansion, reverse_combos=True, per_iter=_per_iter
-            )
+            # Results are merged into the aggregate as they arrive, so memory stays
+            # bounded by the outcomes of the result, however large the product is
+            agg = _WeightedAggregate()
+            step = self._step
+            self._profile_combos(expansion)
+            for combo, weight in _iter_combos(expansion):
+                if step is not None:
+                    step()
+                self._aggregate_result(agg, (yield from per_iter(combo)), weight)
+            return self._checked(agg.h())
         finally:
             self._depth -= 1
             self._env = saved_env
 
+    def _reduce_symmetric(self, func: _UserFunc, expansion: _ExpansionT) -> _ExpansionT:
+        r"""
+        Return *expansion*, but expanding each `:s` param of *func* that's read only by symmetric builtins over the counts of each class of outcomes its dice show, rather than over every roll (see `_PoolRolls.reduced`).
+
+        Only a pure function's results are independent of the order of expansion, so others' expansions are returned unchanged.
+        """
+        if not func.symmetric_uses or not self._is_pure(func):
+            return expansion
+        reduced: _ExpansionT = []
+        for i, items in expansion:
+            uses = func.symmetric_uses.get(i)
+            if uses is not None and isinstance(items, _PoolRolls):
+                classify = self._symmetric_class(uses)
+                if classify is not None:
+                    reduced.append((i, items.reduced(classify)))
+                    continue
+            reduced.append((i, items))
+        return reduced
+
+    def _symmetric_class(
+        self, uses: tuple[tuple[_ShapeT, tuple[_ExprFnT | None, ...]], ...]
+    ) -> Callable[[int], Hashable] | None:
+        r"""
+        Return a function giving the class of each outcome of a `:s` param read only by the symmetric builtin calls *uses* (see `_UserFunc.symmetric_uses`), or `None` if it can't be reduced.
+
+        Two rolls whose dice show the same number of outcomes of each class give the same results for every one of the calls.
+        """
+        classifiers: list[Callable[[int], Hashable]] = []
+        for shape, arg_fns in uses:
+            if shape in self._funcs:
+                return None  # shadowed by a user-defined function
+            param_types, _ = self._builtins[shape]
+            seq_position, classifier = SYMMETRIC[shape]
+            args = [() if fn is None else fn() for fn in arg_fns]
+            bind = self._bind_and_expand(
+                param_types, args, err_label=lambda i: f"builtin param {i}"
+            )
+            if bind is None or bind[1]:
+                return None  # the other arguments aren't single values
+            bound, _ = bind
+            classifiers.append(
+                classifier(*(v for j, v in enumerate(bound) if j != seq_position))
+            )
+        return lambda outcome: tuple(classify(outcome) for classify in classifiers)
+
     def _invoke_builtin(
         self,
         impl: Callable[..., _Val],
@@ -1144,107 +2516,83 @@ class AnyDiceInterpreter:
         # No-expansion fast path: just call the impl with the bound args.
         if not expansion:
             return impl(self._settings, *bound)
+        symmetric = self._symmetric_impls.get(impl)
+        if symmetric is not None and len(expansion) == 1:
+            # E.g., `[count {5, 6} in 12d6]` only needs to know how many of the dice
+            # show 5 or 6
+            seq_position, classifier = symmetric
+            ((i, items),) = expansion
+            if i == seq_position and isinstance(items, _PoolRolls):
+                others = [v for j, v in enumerate(bound) if j != i]
+                expansion = [(i, items.reduced(classifier(*others)))]
 
         # Expansion path: aggregate impl results across the Cartesian product.
-        # `reverse_combos=True` mirrors the user-defined enumeration order.
-        # Stateless builtin impls produce aggregates that are independent of
-        # iteration order, so True is observably equivalent to False here.
-        # The `_depth` bracket is structurally a no-op for builtins (impls
+        # Combos are enumerated in the same order as for user-defined functions,
+        # although stateless builtin impls produce aggregates that are independent
+        # of iteration order. The `_depth` bracket is structurally a no-op for builtins (impls
         # don't recursively re-enter `_call`), but kept for symmetry with the
         # user-defined path so future stateful builtins, if any, would behave
         # consistently.
         self._depth += 1
         try:
-
-            def _per_iter(combo: tuple[tuple[_Val, int], ...]) -> _Val:
+            agg = _WeightedAggregate()
+            step = self._step
+            self._profile_combos(expansion)
+            for combo, weight in _iter_combos(expansion):
+                if step is not None:
+                    step()
                 for j, (idx, _) in enumerate(expansion):
                     value, _w = combo[j]
                     bound[idx] = value
-                return impl(self._settings, *bound)
-
-            return self._aggregate_iters(
-                expansion, reverse_combos=True, per_iter=_per_iter
-            )
+                self._aggregate_result(agg, impl(self._settings, *bound), weight)
+            return self._checked(agg.h())
         finally:
             self._depth -= 1
 
-    def _aggregate_iters(
-        self,
-        expansion: _ExpansionT,
-        *,
-        reverse_combos: bool,
-        per_iter: Callable[[tuple[tuple[_Val, int], ...]], _Val],
-    ) -> H[int]:
-        r"""LCM-aggregate per-iteration results across the expansion's
-        Cartesian product, returning a truncated H.
-
-        Each combination of expansion items is passed to *per_iter*, which
-        mutates whatever ambient state it needs (env, bound list, etc.) and
-        returns the body result for that combination. The per-combination
-        weight (product of the expansion's item weights) is computed here.
-
-        *reverse_combos* controls iteration order:
-            * `True`: iterate with the *reversed* expansion order so the first
-              expansion entry varies fastest (AnyDice's little-endian rule;
-              required for any user-defined function body that may observe
-              iteration order via non-param accumulators).
-            * `False`: iterate the natural Cartesian-product order. Observably
-              equivalent to True for any *per_iter* whose return depends only
-              on the combination's values (e.g. stateless builtin impls), but
-              distinct for user-defined bodies that read mutated non-param
-              env vars.
-        """
-        if reverse_combos:
-            items_list = [items for _, items in reversed(expansion)]
+    def _profile_combos(self, expansion: _ExpansionT) -> None:
+        r"""Record the number of combinations of *expansion* with the run's profiler (if any)."""
+        if self._profiler is not None:
+            self._profiler.add_combos(prod(len(items) for _, items in expansion))
+
+    def _checked(self, h: H) -> H:
+        r"""Check *h* against the run's budget (if any), and return it."""
+        if self._meter is not None:
+            self._meter.check(h)
+        return h
+
+    def _aggregate_result(self, agg: _WeightedAggregate, r: _Val, weight: int) -> None:
+        r"""Merge one expansion iteration's result *r* into *agg* with *weight*."""
+        # When a body iteration returns a sequence, AnyDice sum-coerces
+        # it to a single number rather than distributing seq elements
+        # as separate outcomes. (Verified against AnyDice via 405c6's
+        # `[roll 1d6 1d6]` which produces an H over A+B+C, not over
+        # {A+B, C} elements.)
+        if isinstance(r, tuple):
+            r = sum(r)
+        if isinstance(r, int):
+            agg.add({r: 1}, weight)
         else:
-            items_list = [items for _, items in expansion]
-
-        def _gen() -> Iterator[tuple[H[int], int]]:
-            for combo in product(*items_list):
-                if reverse_combos:
-                    combo = combo[::-1]  # ruff: ignore[redefined-loop-name]
-                weight = 1
-                for _, w in combo:
-                    weight *= w
-                r = per_iter(combo)
-                # When a body iteration returns a sequence, AnyDice sum-coerces
-                # it to a single number rather than distributing seq elements
-                # as separate outcomes. (Verified against AnyDice via 405c6's
-                # `[roll 1d6 1d6]` which produces an H over A+B+C, not over
-                # {A+B, C} elements.)
-                if isinstance(r, tuple):
-                    r = sum(r)
-                yield self._coerce_to_h(r), weight
-
-        return aggregate_weighted(_gen())  # ty: ignore[invalid-return-type]
-
-    def _execute_body(self, func: FunctionDef) -> _Val:
-        r"""Run `func`'s body in the current env, returning the `result:` value
-        or `H({})` if the body falls through. Caller is responsible for env
-        save/restore and depth tracking. Used directly by `_invoke`'s
-        expansion path so iterations share the function's local env."""
-        try:
-            for stmt in func.body:
-                self._exec(stmt)
-        except _ResultReturn as r:
-            return r.value
-        return H({})
-
-    def _invoke_with_bound(
-        self, func: FunctionDef, params: list[Param], bound: _BoundT
-    ) -> _Val:
+            agg.add(self._coerce_to_h(r), weight)
+
+    def _execute_body(self, body: _StmtFnT) -> _TaskT:
+        r"""Run a compiled function `body` in the current env, returning the
+        `result:` value or `H({})` if the body falls through. Caller is
+        responsible for env save/restore and depth tracking. Used directly by
+        `_invoke`'s expansion path so iterations share the function's local
+        env."""
+        result = yield from body()
+        return H({}) if result is None else result
+
+    def _invoke_with_bound(self, func: _UserFunc, bound: _BoundT) -> _TaskT:
         saved_env = self._env
-        self._env = dict(saved_env)
+        self._env = env = _Env(saved_env)
         # First-occurrence wins for duplicate-named params (see `_invoke`'s
         # expansion path for the full rationale + AnyDice verification).
-        seen: set[str] = set()
-        for param, val in zip(params, bound, strict=True):
-            if param.name not in seen:
-                self._env[param.name] = val
-                seen.add(param.name)
+        for name, i in func.slots:
+            env[name] = bound[i]
         self._depth += 1
         try:
-            return self._execute_body(func)
+            return (yield from self._execute_body(func.body))
         finally:
             self._depth -= 1
             self._env = saved_env
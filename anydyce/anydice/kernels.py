@@ -0,0 +1,384 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+Fast paths for the interpreter's hot loops.
+
+Each kernel either returns exactly what the interpreter's pure-Python implementation would, or declines (returns `None`) so the interpreter can fall back to it.
+The only exception is the opt-in FFT convolution (see [`convolve_counts`][anydyce.anydice.kernels.convolve_counts]), which trades exactness for speed when asked to.
+
+[NumPy](https://numpy.org/) is not a dependency of `anydyce`.
+Kernels that need it decline if it is not installed.
+NumPy kernels also decline whenever an intermediate value might not fit in an `int64`.
+"""
+
+from collections.abc import Iterable
+from math import comb, log2
+
+__all__ = (
+    "convolve_counts",
+    "h_binop_counts",
+    "kept_sum_counts",
+    "nfold_sum_counts",
+)
+
+# Below this many outcome pairs, array setup costs more than the Python loop it replaces
+_MIN_GRID_SIZE = 256
+# Largest magnitude any computed outcome or count may have
+_INT64_LIMIT = 2**63 - 1
+# Largest magnitude for which `int(a / b)` (a float division) always truncates exactly
+_EXACT_FLOAT_LIMIT = 2**53
+# Minimum fraction of the outcome range a die must fill to be worth convolving densely
+_MIN_CONV_DENSITY = 0.5
+# Largest ratio between a convolution's biggest and smallest non-zero counts for which
+# an FFT (whose error is relative to the biggest) still gets the smallest about right
+_FFT_MAX_RANGE = 2**26
+
+try:
+    import numpy as np
+    from numpy.typing import NDArray
+
+    _ArrayT = NDArray[np.int64]
+    _HAS_NUMPY = True
+except ImportError:  # pragma: no cover
+    _HAS_NUMPY = False
+
+
+def _apply_grid_op(  # ruff: ignore[complex-structure]
+    op: str, a: "_ArrayT", b: "_ArrayT", pow_sentinel: int
+) -> "_ArrayT":
+    if op == "+":
+        return a + b
+    elif op == "-":
+        return a - b
+    elif op == "*":
+        return a * b
+    elif op == "/":
+        # AnyDice truncates toward zero and substitutes 0 for division by zero
+        safe_b = np.where(b == 0, 1, b)
+        q = a // safe_b
+        q += (a % safe_b != 0) & ((a < 0) != (safe_b < 0))
+        return np.where(b == 0, 0, q)
+    elif op == "^":
+        nonneg = b >= 0
+        pos = np.power(a, np.where(nonneg, b, 0))
+        # Negative exponents truncate to zero except for bases of 1 and -1, and
+        # 0^negative yields the sentinel
+        neg = np.where(
+            a == 1,
+            1,
+            np.where(
+                a == -1,
+                np.where(b % 2 == 0, 1, -1),
+                np.where(a == 0, pow_sentinel, 0),
+            ),
+        )
+        return np.where(nonneg, pos, neg)
+    elif op == "=":
+        return (a == b).astype(np.int64)
+    elif op == "!=":
+        return (a != b).astype(np.int64)
+    elif op == "<":
+        return (a < b).astype(np.int64)
+    elif op == ">":
+        return (a > b).astype(np.int64)
+    elif op == "<=":
+        return (a <= b).astype(np.int64)
+    elif op == ">=":
+        return (a >= b).astype(np.int64)
+    elif op == "&":
+        return ((a != 0) & (b != 0)).astype(np.int64)
+    elif op == "|":
+        return ((a != 0) | (b != 0)).astype(np.int64)
+    else:  # pragma: no cover
+        raise NotImplementedError(f"unhandled operator: {op!r}")
+
+
+def _reduce_counts(outcomes: "_ArrayT", counts: "_ArrayT") -> dict[int, int]:
+    # Sort-and-segment rather than `np.bincount`, whose weights are float64 and
+    # would lose precision above 2**53
+    order = np.argsort(outcomes, kind="stable")
+    sorted_outcomes = outcomes[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], sorted_outcomes[1:] != sorted_outcomes[:-1]))
+    )
+    summed = np.add.reduceat(counts[order], starts)
+    return dict(zip(sorted_outcomes[starts].tolist(), summed.tolist(), strict=True))
+
+
+def _max_abs(values: Iterable[int]) -> int:
+    return max((abs(v) for v in values), default=0)
+
+
+def _fits_int64(op: str, left_outcomes: list[int], right_outcomes: list[int]) -> bool:
+    r"""Return whether applying *op* across the outcome grid cannot overflow."""
+    a_max = _max_abs(left_outcomes)
+    b_max = _max_abs(right_outcomes)
+    if a_max > _INT64_LIMIT or b_max > _INT64_LIMIT:
+        return False
+    if op in ("+", "-"):
+        return a_max + b_max <= _INT64_LIMIT
+    elif op == "*":
+        return a_max * b_max <= _INT64_LIMIT
+    elif op == "/":
+        return a_max < _EXACT_FLOAT_LIMIT
+    elif op == "^":
+        exp_max = max(right_outcomes, default=0)
+        return a_max <= 1 or exp_max <= 0 or exp_max * log2(a_max) < 62
+    else:
+        return True
+
+
+def h_binop_counts(
+    op: str,
+    left_items: list[tuple[int, int]],
+    right_items: list[tuple[int, int]],
+    *,
+    pow_sentinel: int,
+) -> dict[int, int] | None:
+    r"""
+    Return the outcome counts of *op* applied across every pair of *left_items* and *right_items*, or `None` to decline.
+
+    Each of *left_items* and *right_items* is a list of `(outcome, count)` pairs.
+    *op* is any of the interpreter's arithmetic, comparison, or boolean operators, with the interpreter's per-outcome semantics (`/` truncates toward zero with `x/0 = 0`, and `0^negative` yields *pow_sentinel*).
+    Outcomes with zero counts are retained.
+    """
+    if (
+        not _HAS_NUMPY
+        or len(left_items) * len(right_items) < _MIN_GRID_SIZE
+        or not left_items
+        or not right_items
+    ):
+        return None
+    left_outcomes, left_counts = zip(*left_items, strict=True)
+    right_outcomes, right_counts = zip(*right_items, strict=True)
+    # Every partial sum of counts is bounded by the product of totals
+    if sum(left_counts) * sum(right_counts) > _INT64_LIMIT:
+        return None
+    if not _fits_int64(op, list(left_outcomes), list(right_outcomes)):
+        return None
+    a = np.array(left_outcomes, dtype=np.int64)[:, np.newaxis]
+    b = np.array(right_outcomes, dtype=np.int64)[np.newaxis, :]
+    outcomes = _apply_grid_op(op, a, b, pow_sentinel)
+    counts = np.outer(
+        np.array(left_counts, dtype=np.int64), np.array(right_counts, dtype=np.int64)
+    )
+    return _reduce_counts(
+        np.broadcast_to(outcomes, counts.shape).ravel(), counts.ravel()
+    )
+
+
+# ---- Convolution -------------------------------------------------------------------------
+
+
+def _dense(items: list[tuple[int, int]]) -> tuple[list[int], list[int]]:
+    r"""Return `(counts, present)` arrays spanning the outcomes of sorted *items*."""
+    lo = items[0][0]
+    span = items[-1][0] - lo + 1
+    counts = [0] * span
+    present = [0] * span
+    for outcome, count in items:
+        counts[outcome - lo] = count
+        present[outcome - lo] = 1
+    return counts, present
+
+
+def _kronecker_convolve(a: list[int], b: list[int]) -> list[int]:
+    r"""
+    Convolve non-negative integer sequences *a* and *b* exactly via Kronecker substitution.
+
+    Each sequence is packed into one big integer with a fixed-width slot per element, wide enough that no coefficient of the product can carry into its neighbor.
+    A single multiplication of the packed integers then yields every coefficient of the convolution, and Python's big integer multiplication is much faster than the equivalent quadratic loop.
+    """
+    n = len(a) + len(b) - 1
+    bound = max(a) * max(b) * min(len(a), len(b))
+    if bound == 0:
+        return [0] * n
+    width = (bound.bit_length() + 7) // 8
+
+    def _pack(xs: list[int]) -> int:
+        return int.from_bytes(
+            b"".join(x.to_bytes(width, "little") for x in xs), "little"
+        )
+
+    raw = (_pack(a) * _pack(b)).to_bytes(n * width, "little")
+    return [
+        int.from_bytes(raw[i : i + width], "little") for i in range(0, n * width, width)
+    ]
+
+
+def _exact_convolve(a: list[int], b: list[int]) -> list[int]:
+    if _HAS_NUMPY and max(a) * max(b) * min(len(a), len(b)) <= _INT64_LIMIT:
+        return np.convolve(
+            np.array(a, dtype=np.int64), np.array(b, dtype=np.int64)
+        ).tolist()
+    return _kronecker_convolve(a, b)
+
+
+def _fft_range(a: list[int], b: list[int]) -> int:
+    r"""Bound the ratio between the biggest and smallest non-zero counts of the convolution of *a* and *b*."""
+    a_min = min(x for x in a if x)
+    b_min = min(x for x in b if x)
+    return -(-max(a) * max(b) * min(len(a), len(b)) // (a_min * b_min))
+
+
+def _fft_convolve(a: list[int], b: list[int]) -> list[int]:
+    r"""Approximate the convolution of *a* and *b*, scaled so the biggest count is `2**52`."""
+    n = len(a) + len(b) - 1
+    # Shift huge counts down so they survive conversion to float64
+    a_shift = max(0, max(a).bit_length() - 60)
+    b_shift = max(0, max(b).bit_length() - 60)
+    a_f = np.array([x >> a_shift for x in a], dtype=np.float64)
+    b_f = np.array([x >> b_shift for x in b], dtype=np.float64)
+    a_f /= a_f.sum()
+    b_f /= b_f.sum()
+    size = 1 << (n - 1).bit_length()
+    c = np.fft.irfft(np.fft.rfft(a_f, size) * np.fft.rfft(b_f, size), size)[:n]
+    return np.rint(np.clip(c, 0.0, None) / c.max() * 2.0**52).astype(np.int64).tolist()
+
+
+def convolve_counts(
+    left_items: list[tuple[int, int]],
+    right_items: list[tuple[int, int]],
+    *,
+    subtract: bool,
+    fft: bool = False,
+) -> dict[int, int] | None:
+    r"""
+    Return the outcome counts of adding (or, if *subtract* is `True`, subtracting) two dice by convolution, or `None` to decline.
+
+    Each of *left_items* and *right_items* is a list of `(outcome, count)` pairs sorted by outcome.
+    The result has exactly the outcomes (including zero-count ones) and counts of the interpreter's cross-product loop.
+    Declines when the product is small, or when either die's outcomes are too sparse for a dense convolution to pay off.
+
+    If *fft* is `True` and NumPy is available, counts are instead approximated (and scaled) with a floating point FFT.
+    An FFT's error is relative to the biggest count, so it is only used where no non-zero count can be more than `2**26` times smaller than the biggest one, which keeps every count to within about one part in a million.
+    Otherwise, counts are exact.
+    Outcomes reachable only with zero counts keep counts of zero.
+    """
+    if len(left_items) * len(right_items) < _MIN_GRID_SIZE:
+        return None
+    for items in (left_items, right_items):
+        if len(items) < _MIN_CONV_DENSITY * (items[-1][0] - items[0][0] + 1):
+            return None
+    if subtract:
+        # Subtracting a die is adding its negation
+        right_items = [(-outcome, count) for outcome, count in reversed(right_items)]
+    left_counts, left_present = _dense(left_items)
+    right_counts, right_present = _dense(right_items)
+    base = left_items[0][0] + right_items[0][0]
+    n = len(left_counts) + len(right_counts) - 1
+    # The cross-product loop only produces outcomes that are sums of two present
+    # outcomes (including zero-count ones)
+    if len(left_items) == len(left_counts) and len(right_items) == len(right_counts):
+        keys = range(n)
+    else:
+        reachable = _exact_convolve(left_present, right_present)
+        keys = [i for i in range(n) if reachable[i]]
+    if (
+        fft
+        and _HAS_NUMPY
+        and any(left_counts)
+        and any(right_counts)
+        and _fft_range(left_counts, right_counts) <= _FFT_MAX_RANGE
+    ):
+        counts = _fft_convolve(left_counts, right_counts)
+        positive = _exact_convolve(
+            [int(c > 0) for c in left_counts], [int(c > 0) for c in right_counts]
+        )
+        counts = [c if p else 0 for c, p in zip(counts, positive, strict=True)]
+    else:
+        counts = _exact_convolve(left_counts, right_counts)
+    return {base + i: counts[i] for i in keys}
+
+
+def nfold_sum_counts(items: list[tuple[int, int]], n: int) -> dict[int, int] | None:
+    r"""
+    Return the outcome counts of the sum of *n* copies of a die, or `None` to decline.
+
+    *items* is a list of `(outcome, count)` pairs sorted by outcome, all with positive counts.
+    The *n*-fold convolution is computed by repeated squaring, so it takes `#!math O \left( \log n \right)` dense convolutions rather than *n* cross-product loops.
+    The result has exactly the outcomes and counts of summing the dice one at a time.
+    Declines when *n* or the die is too small for dense convolution to pay off, or when the die's outcomes are too sparse.
+    """
+    if n < 2 or not items or (n * len(items)) ** 2 < _MIN_GRID_SIZE:
+        return None
+    if len(items) < _MIN_CONV_DENSITY * (items[-1][0] - items[0][0] + 1):
+        return None
+    lo = items[0][0] * n
+    base, _ = _dense(items)
+    acc: list[int] | None = None
+    while n:
+        if n & 1:
+            acc = base if acc is None else _exact_convolve(acc, base)
+        n >>= 1
+        if n:
+            base = _exact_convolve(base, base)
+    assert acc is not None
+    # Every count is positive, so the outcomes reachable as a sum of n present
+    # outcomes are exactly those with a non-zero count
+    return {lo + i: count for i, count in enumerate(acc) if count}
+
+
+def kept_sum_counts(
+    items: list[tuple[int, int]], k: int, lo: int, hi: int
+) -> dict[int, int] | None:
+    r"""
+    Return the outcome counts of the sum of positions *lo* through *hi* - 1 of *k* dice sorted lowest first, or `None` to decline.
+
+    *items* is a list of `(outcome, count)` pairs of the one die all *k* are rolled from, sorted by outcome, all with positive counts.
+    Rather than enumerating every multiset of *k* rolls, this walks the die's outcomes in order, tracking only how many dice have been placed so far and the sum of those kept, so it takes time polynomial in *k*, the number of outcomes, and the number kept.
+    Once every kept position is placed, the remaining dice can only show outcomes yet to be walked, which are counted all at once.
+    The result has exactly the outcomes and counts of selecting from the enumerated rolls.
+    Declines unless `#!python 0 <= lo < hi <= k`.
+    """
+    if not items or not 0 <= lo < hi <= k:
+        return None
+    # Walk from whichever end is closer to the kept positions, so they're all placed
+    # as early as possible
+    walk = items
+    if k - lo < hi:
+        walk = items[::-1]
+        lo, hi = k - hi, k - lo
+    # later[i] is the total count of the outcomes walked after the i-th
+    later = [0] * len(walk)
+    for i in range(len(walk) - 1, 0, -1):
+        later[i - 1] = later[i] + walk[i][1]
+    binoms = [[comb(m, c) for c in range(m + 1)] for m in range(k + 1)]
+    result: dict[int, int] = {}
+    # Keyed by (dice placed so far, sum of those kept), for fewer than hi dice placed
+    states: dict[tuple[int, int], int] = {(0, 0): 1}
+    for (outcome, count), rest in zip(walk, later, strict=True):
+        powers = [1] * (k + 1)
+        for c in range(1, k + 1):
+            powers[c] = powers[c - 1] * count
+        next_states: dict[tuple[int, int], int] = {}
+        for (placed, kept_sum), weight in states.items():
+            unplaced = k - placed
+            row = binoms[unplaced]
+            for c in range(unplaced + 1):
+                # The c dice showing this outcome fill positions placed through
+                # placed + c - 1
+                end = placed + c
+                kept = min(end, hi) - max(placed, lo)
+                total = kept_sum + outcome * kept if kept > 0 else kept_sum
+                ways = weight * row[c] * powers[c]
+                if end < hi:
+                    next_states[end, total] = next_states.get((end, total), 0) + ways
+                elif end == k or rest:
+                    ways *= rest ** (k - end)
+                    result[total] = result.get(total, 0) + ways
+        states = next_states
+    return dict(sorted(result.items()))
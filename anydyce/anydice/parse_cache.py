@@ -0,0 +1,134 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+An LRU cache of parsed programs, optionally persisted to disk.
+"""
+
+import os
+
+# Only ever loads files this module itself wrote to a directory chosen by the caller
+import pickle  # ruff: ignore[suspicious-pickle-import]
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+from threading import Lock
+
+from .ast_ import Program
+
+__all__ = ("ParseCache",)
+
+_DEFAULT_MAXSIZE = 256
+
+
+class ParseCache:
+    r"""
+    A least-recently-used cache of parsed [`Program`][anydyce.anydice.Program]s, keyed by (a hash of) their source text.
+
+    Programs are immutable, so lookups return the very program that was stored.
+    At most *maxsize* programs are kept in memory (`0` disables the in-memory cache).
+    If *path* is given, every stored program is also pickled to a file in that directory, where later lookups (including those by other processes) can find it.
+    Files are never evicted, and any that can't be read or written (including programs that can't be pickled) are simply ignored.
+
+        >>> from anydyce.anydice import ParseCache, parse
+        >>> parse_cache = ParseCache(maxsize=2)
+        >>> program = parse("output 1d6", parse_cache=parse_cache)
+        >>> parse("output 1d6", parse_cache=parse_cache) is program
+        True
+        >>> parse_cache.hits, parse_cache.misses, len(parse_cache)
+        (1, 1, 1)
+    """
+
+    def __init__(
+        self, maxsize: int = _DEFAULT_MAXSIZE, *, path: str | os.PathLike | None = None
+    ) -> None:
+        if maxsize < 0:
+            raise ValueError(f"maxsize must be non-negative (got {maxsize!r})")
+        self._maxsize = maxsize
+        self._path = Path(path) if path is not None else None
+        self._entries: OrderedDict[str, Program] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def path(self) -> Path | None:
+        return self._path
+
+    def clear(self) -> None:
+        r"""Discard every program kept in memory (files are left alone) and reset the hit and miss counts."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def lookup(self, key: str) -> Program | None:
+        r"""Return the program stored under *key*, or `None` if there isn't one."""
+        with self._lock:
+            program = self._entries.get(key)
+            if program is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return program
+        if self._path is not None:
+            with suppress(OSError):
+                program = _loads((self._path / f"{key}.pickle").read_bytes())
+        with self._lock:
+            if program is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, program)
+        return program
+
+    def store(self, key: str, program: Program) -> None:
+        r"""Store *program* under *key*."""
+        with self._lock:
+            self._remember(key, program)
+        if self._path is not None:
+            # Failing to persist a program must never fail the parse that produced it
+            # (e.g., pickling a deeply nested program can exhaust the recursion limit)
+            with suppress(OSError, RecursionError, pickle.PicklingError):
+                data = pickle.dumps(program, protocol=pickle.HIGHEST_PROTOCOL)
+                self._path.mkdir(parents=True, exist_ok=True)
+                # Written under a temporary name and then moved into place, so
+                # concurrent readers never see a partial file
+                tmp_path = self._path / f"{key}.{os.getpid()}.tmp"
+                tmp_path.write_bytes(data)
+                tmp_path.replace(self._path / f"{key}.pickle")
+
+    def _remember(self, key: str, program: Program) -> None:
+        if self._maxsize == 0:
+            return
+        self._entries[key] = program
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+def _loads(data: bytes) -> Program | None:
+    r"""Unpickle a stored program, returning `None` for anything that isn't one (e.g., a corrupt file)."""
+    try:
+        program = pickle.loads(data)  # ruff: ignore[suspicious-pickle-usage]
+    except Exception:  # ruff: ignore[blind-except]
+        return None
+    return program if isinstance(program, Program) else None
@@ -0,0 +1,204 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+Per-statement and per-function profiles of AnyDice program runs.
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Literal
+
+from dyce import H
+
+__all__ = ("ProfileStats", "Profiler")
+
+ProfileKindT = Literal["statement", "function", "builtin"]
+
+
+@dataclass(slots=True)
+class ProfileStats:
+    r"""
+    What a [`Profiler`][anydyce.anydice.Profiler] recorded of one statement, user-defined function, or builtin.
+
+    Times are in seconds.
+    *cumulative_time* includes time spent in nested statements and calls (counting recursive calls only once), but *self_time* doesn't.
+    *combos* counts the combinations of values over which calls were expanded, and *max_outcomes* is the number of outcomes of the largest distribution computed (by a statement's expression, or returned by a call).
+    """
+
+    kind: ProfileKindT
+    label: str
+    count: int = 0
+    cumulative_time: float = 0.0
+    self_time: float = 0.0
+    combos: int = 0
+    max_outcomes: int = 0
+
+
+class _StackNode:
+    r"""A node in the tree of distinct stacks of frames, accumulating the self time spent with it on top."""
+
+    __slots__ = ("children", "self_time")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _StackNode] = {}
+        self.self_time = 0.0
+
+
+class _Frame:
+    __slots__ = ("child_time", "node", "outermost", "start", "stats")
+
+    def __init__(
+        self, stats: ProfileStats, node: _StackNode, *, outermost: bool, start: float
+    ) -> None:
+        self.stats = stats
+        self.node = node
+        self.outermost = outermost
+        self.start = start
+        self.child_time = 0.0
+
+
+class Profiler:
+    r"""
+    Records where runs of AnyDice programs spend their time (see [`AnyDiceInterpreter.run`][anydyce.anydice.AnyDiceInterpreter.run]).
+
+    Each statement executed, and each call to a user-defined function or builtin, is recorded in a [`ProfileStats`][anydyce.anydice.ProfileStats] keyed by its label.
+    A statement's label is its position (e.g., `2.1` for the first statement in the body of the second statement), followed by the first line of its source.
+    Statements in the branches of an `if` are numbered within each branch (e.g., `2.3.1` for the first statement in the third branch, which may be the `else` branch, of the second statement).
+    Statements in a function's body are labeled relative to the function.
+    Profiles accumulate over every run given the same profiler until it's cleared.
+
+        >>> from anydyce.anydice import Profiler, run
+        >>> profiler = Profiler()
+        >>> _ = run(
+        ...     "function: f N:n { result: N * 2 }\n"
+        ...     "loop I over {1..3} { output [f dI] }",
+        ...     profiler=profiler,
+        ... )
+        >>> for stats in profiler.stats.values():
+        ...     print(f"{stats.kind:9} {stats.count} {stats.combos} {stats.label!r}")
+        statement 1 0 '1: function: f N:n'
+        statement 1 0 '2: loop I over {1..3}'
+        statement 3 0 '2.1: output [f dI]'
+        function  3 6 'function: f N:n'
+        statement 3 0 'function: f N:n > 1: result: N * 2'
+
+    (The function's body is executed only once for each distinct value of `N`, since its results are reused.)
+
+    Profiling slows runs down, so times of very cheap statements are inflated.
+    """
+
+    def __init__(self, clock: Callable[[], float] = perf_counter) -> None:
+        self._clock = clock
+        self.clear()
+
+    @property
+    def stats(self) -> dict[str, ProfileStats]:
+        r"""What was recorded of each statement and call, keyed by label in the order first seen."""
+        return self._stats
+
+    def clear(self) -> None:
+        r"""Discard everything recorded so far."""
+        self._stats: dict[str, ProfileStats] = {}
+        self._root = _StackNode()
+        self._stack: list[_Frame] = []
+        self._active: dict[str, int] = {}
+
+    def table(self, *, limit: int | None = None) -> str:
+        r"""
+        Return a table of the recorded stats, with those with the greatest self time first.
+
+        If *limit* is given, only that many rows are included.
+        """
+        rows = sorted(self._stats.values(), key=lambda s: s.self_time, reverse=True)
+        header = "   count   cumul ms    self ms   combos outcomes  label"
+        lines = [header]
+        lines.extend(
+            f"{s.count:8d} {s.cumulative_time * 1000:10.3f} {s.self_time * 1000:10.3f} "
+            f"{s.combos:8d} {s.max_outcomes:8d}  {s.label}"
+            for s in rows[:limit]
+        )
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        r"""
+        Return the recorded stacks in the "collapsed" format read by flame graph tools (e.g., `flamegraph.pl` or [speedscope](https://www.speedscope.app/)).
+
+        Each line is a distinct stack of statements and calls (outermost first, separated by `;`), followed by the self time spent with it on top, in whole microseconds.
+        """
+        lines: list[str] = []
+        # Depth-first, without recursing (the stacks of deeply recursive programs are
+        # deep), but in the order the stacks were first seen
+        pending: list[tuple[str, _StackNode]] = [
+            # Collapsed stacks separate frames with semicolons
+            (label.replace(";", ","), child)
+            for label, child in reversed(self._root.children.items())
+        ]
+        while pending:
+            path, node = pending.pop()
+            micros = round(node.self_time * 1_000_000)
+            if micros > 0:
+                lines.append(f"{path} {micros}")
+            pending.extend(
+                (f"{path};{label.replace(';', ',')}", child)
+                for label, child in reversed(node.children.items())
+            )
+        return "\n".join(lines)
+
+    # ---- Hooks (called by the interpreter) -------------------------------------------
+
+    def enter(self, kind: ProfileKindT, label: str) -> None:
+        r"""Record the start of a statement or call."""
+        stats = self._stats.get(label)
+        if stats is None:
+            stats = self._stats[label] = ProfileStats(kind, label)
+        stats.count += 1
+        parent = self._stack[-1].node if self._stack else self._root
+        node = parent.children.get(label)
+        if node is None:
+            node = parent.children[label] = _StackNode()
+        active = self._active.get(label, 0)
+        self._active[label] = active + 1
+        self._stack.append(
+            _Frame(stats, node, outermost=active == 0, start=self._clock())
+        )
+
+    def exit(self, value: object = None) -> None:
+        r"""Record the end of the statement or call last entered, which computed *value* (if any)."""
+        frame = self._stack.pop()
+        elapsed = self._clock() - frame.start
+        stats = frame.stats
+        self._active[stats.label] -= 1
+        if frame.outermost:
+            stats.cumulative_time += elapsed
+        self_time = elapsed - frame.child_time
+        stats.self_time += self_time
+        frame.node.self_time += self_time
+        if self._stack:
+            self._stack[-1].child_time += elapsed
+        if isinstance(value, H):
+            stats.max_outcomes = max(stats.max_outcomes, len(value))
+
+    def observe(self, value: object) -> None:
+        r"""Record *value*, computed by the statement or call in progress."""
+        if isinstance(value, H) and self._stack:
+            stats = self._stack[-1].stats
+            stats.max_outcomes = max(stats.max_outcomes, len(value))
+
+    def add_combos(self, combos: int) -> None:
+        r"""Record that the call in progress is expanded over *combos* combinations of values."""
+        if self._stack:
+            self._stack[-1].stats.combos += combos
@@ -0,0 +1,142 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+r"""
+An LRU cache of selections from pools of dice.
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+
+from dyce import H, P
+
+__all__ = ("SelectionCache", "pool_key")
+
+# Roughly a few megabytes of small ints
+_DEFAULT_MAX_VALUES = 2**18
+
+
+def pool_key(pool: P) -> tuple[tuple[tuple[int, int], ...], ...]:
+    r"""
+    Return a hashable key identifying the dice in *pool*, regardless of their order.
+
+    Pools of the same dice (e.g., `P(H(4), H(6))` and `P(H(6), H(4))`) have the same key.
+    Dice with the same outcomes but different counts have different keys, even if their probabilities are the same, since selections from them have different counts too.
+    """
+    return tuple(sorted(tuple(die.items()) for die in pool))
+
+
+class SelectionCache:
+    r"""
+    A least-recently-used cache of distributions selected from pools of dice (e.g., by `@` or `[highest N of D]`), which are costly to compute but often recomputed.
+
+    Keys are chosen by the caller, and must capture everything the selection depends on (e.g., using `pool_key`).
+    Distributions are immutable, so lookups return the very distribution that was stored.
+    Selections from large pools can be very large, so the cache is bounded by the number of values it holds rather than by the number of selections.
+    Each selection holds two values per outcome (the outcome and its count), plus one for every number (or other non-tuple value) in its key.
+    The least recently used selections are evicted to keep the total at or below *max_values* (`0` disables the cache), and a selection that would exceed it on its own is never kept.
+    *hits* and *misses* count lookups since the cache was created or last cleared, which helps in choosing *max_values*.
+
+        >>> from dyce import H, P
+        >>> from anydyce.anydice import SelectionCache
+        >>> from anydyce.anydice.selection_cache import pool_key
+        >>> selection_cache = SelectionCache(max_values=1000)
+        >>> pool = 3 @ P(6)
+        >>> key = (pool_key(pool), -1)
+        >>> selection_cache.select(key, lambda: pool.h(-1)) is selection_cache.select(
+        ...     key, lambda: pool.h(-1)
+        ... )
+        True
+        >>> selection_cache.hits, selection_cache.misses, len(selection_cache)
+        (1, 1, 1)
+    """
+
+    def __init__(self, max_values: int = _DEFAULT_MAX_VALUES) -> None:
+        if max_values < 0:
+            raise ValueError(f"max_values must be non-negative (got {max_values!r})")
+        self._max_values = max_values
+        # Each entry is a selection and the number of values it holds
+        self._entries: OrderedDict[Hashable, tuple[H, int]] = OrderedDict()
+        self._values = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def max_values(self) -> int:
+        r"""The most values the selections kept may hold (see above), which evicts selections as needed when lowered."""
+        return self._max_values
+
+    @max_values.setter
+    def max_values(self, max_values: int) -> None:
+        if max_values < 0:
+            raise ValueError(f"max_values must be non-negative (got {max_values!r})")
+        with self._lock:
+            self._max_values = max_values
+            self._evict()
+
+    @property
+    def values(self) -> int:
+        r"""The number of values held by the selections kept (see above)."""
+        return self._values
+
+    def clear(self) -> None:
+        r"""Discard every selection and reset the hit and miss counts."""
+        with self._lock:
+            self._entries.clear()
+            self._values = 0
+            self.hits = 0
+            self.misses = 0
+
+    def select(self, key: Hashable, compute: Callable[[], H]) -> H:
+        r"""
+        Return the selection stored under *key*, calling *compute* to compute (and store) it if there isn't one.
+
+        *compute* is called without holding the cache's lock, so concurrent misses on the same key may each compute it.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        h = compute()
+        values = 2 * len(h) + _count_values(key)
+        if values <= self._max_values:
+            with self._lock:
+                old_entry = self._entries.pop(key, None)
+                if old_entry is not None:  # stored by a concurrent miss
+                    self._values -= old_entry[1]
+                self._entries[key] = (h, values)
+                self._values += values
+                self._evict()
+        return h
+
+    def _evict(self) -> None:
+        while self._values > self._max_values:
+            _, (_, evicted_values) = self._entries.popitem(last=False)
+            self._values -= evicted_values
+
+
+def _count_values(key: Hashable) -> int:
+    r"""Return the number of non-tuple values in *key*, including those in nested tuples."""
+    if isinstance(key, tuple):
+        return sum(_count_values(item) for item in key)
+    return 1
@@ -19,7 +19,7 @@ from dyce.h import DEFAULT_PRECISION, DEFAULT_QUANTIZATION_BIT_WIDTH
 
 __all__ = ("Settings",)
 
-# Defaults for the two anydyce-introduced settings.
+# Defaults for the two anydyce-introduced precision settings.
 #
 # Calculation precision is the bit_width passed to `dyce.quantize_hs`.
 # 256 matches the interpreter's prior `_DEFAULT_QUANTIZATION_BIT_WIDTH`
@@ -33,6 +33,13 @@ __all__ = ("Settings",)
 _DEFAULT_CALC_BIT_WIDTH: int = DEFAULT_QUANTIZATION_BIT_WIDTH
 _DEFAULT_DISPLAY_PRECISION: int = DEFAULT_PRECISION
 
+# Widest calculation precision at which "anydyce: convolution" set to "fft" takes
+# effect. Quantizing to this many bits scales counts so the biggest fits, which
+# discards at least as much as a float64 FFT's 52-bit mantissa does, so the FFT's
+# error is lost in quantization's. Wider (or exact) precision keeps more than an FFT
+# can deliver.
+_MAX_FFT_CALC_BIT_WIDTH: int = 52
+
 # Symbolic resolution tables. The user may write either an integer literal
 # or one of these strings as the value of `set "anydyce: ... precision" to
 # X`. "exact" for calculation precision means "no quantization" (signalled
@@ -60,10 +67,16 @@ _DEFAULTS: dict[str, int | str] = {
     "explode depth": 2,
     "anydyce: calculation precision": _DEFAULT_CALC_BIT_WIDTH,
     "anydyce: display precision": _DEFAULT_DISPLAY_PRECISION,
+    "anydyce: convolution": "exact",
 }
 
 _VALID_STRINGS: dict[str, set[str]] = {
     "position order": {"highest first", "lowest first"},
+    # "fft" approximates sums and differences of large dice with floating point FFTs.
+    # It only takes effect while calculation precision is at most
+    # `_MAX_FFT_CALC_BIT_WIDTH` (but not exact). See
+    # `anydyce.anydice.kernels.convolve_counts`.
+    "anydyce: convolution": {"exact", "fft"},
 }
 
 # Settings that accept only a positive integer (>= 1). Verified against AnyDice:
@@ -151,5 +164,15 @@ class Settings:
     def display_precision(self) -> int:
         return cast("int", self._data["anydyce: display precision"])
 
+    @property
+    def convolution(self) -> str:
+        return str(self._data["anydyce: convolution"])
+
     def highest_first(self) -> bool:
         return self._data["position order"] == "highest first"
+
+    def fft_convolution(self) -> bool:
+        return (
+            self.convolution == "fft"
+            and 0 < self.calc_bit_width <= _MAX_FFT_CALC_BIT_WIDTH
+        )
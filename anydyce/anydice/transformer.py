@@ -14,6 +14,9 @@
 # ======================================================================================
 
 import re
+from collections.abc import Hashable
+from dataclasses import fields, is_dataclass
+from typing import Any, TypeVar
 
 from lark import Token, Transformer
 from lark.visitors import v_args
@@ -56,9 +59,33 @@ from .ast_ import (
 
 _IVAR_RE = re.compile(r"\[([A-Z][A-Z_]*)\]")
 
+_NodeT = TypeVar("_NodeT")
+
 __all__ = ("AnyDiceTransformer",)
 
 
+def _shallow_key(value: object) -> Hashable:
+    r"""
+    Return a key for *value* that refers to any nodes it is or contains by identity.
+
+    Unlike hashing or comparing nodes, which visits whole subtrees, this only visits tuples of children.
+    """
+    if isinstance(value, tuple):
+        return tuple(_shallow_key(item) for item in value)
+    return id(value) if is_dataclass(value) else value
+
+
+def _intern_key(node: object) -> tuple[Hashable, ...]:
+    r"""Return a key identifying *node* by its type and fields, where children are (already interned and) identified by identity."""
+    return (
+        type(node),
+        *(
+            _shallow_key(getattr(node, field.name))
+            for field in fields(node)  # type: ignore[arg-type]
+        ),
+    )
+
+
 def _parse_string(token: str) -> StringExpr:
     r"""Convert a STRING token (with enclosing quotes) to a StringExpr."""
     inner = token[1:-1]  # strip leading/trailing "
@@ -73,38 +100,57 @@ def _parse_string(token: str) -> StringExpr:
         parts.append(StrLit(inner[pos:]))
     if not parts:
         parts.append(StrLit(""))
-    return StringExpr(parts)
+    return StringExpr(tuple(parts))
 
 
 @v_args(inline=True)
 class AnyDiceTransformer(Transformer):
+    def __init__(self) -> None:
+        super().__init__()
+        # Hash-consing table of every node built for the program being parsed, so
+        # identical subtrees (e.g., each `d6`) are built once and shared. Children are
+        # always interned before their parents, so nodes are keyed by `_intern_key`,
+        # which identifies children by identity. (Keying on nodes themselves would
+        # hash and compare whole subtrees, which is quadratic and overflows the stack
+        # on deeply nested expressions.) The table also keeps every node it refers to
+        # by identity alive, so identities can't be reused while it's in use.
+        self._interned: dict[tuple[Hashable, ...], Any] = {}
+
+    def _intern(self, node: _NodeT) -> _NodeT:
+        return self._interned.setdefault(_intern_key(node), node)
+
     # ---- Program -----------------------------------------------------------------------
 
     def start(self, *stmts: Stmt) -> Program:
-        return Program(list(stmts))
+        # Nothing is shared between programs, so the table doesn't grow without bound
+        self._interned.clear()
+        return Program(stmts)
 
     # ---- Statements --------------------------------------------------------------------
 
     def output_named(self, expr: Expr, name: StringExpr) -> OutputStmt:
-        return OutputStmt(expr=expr, name=name)
+        return self._intern(OutputStmt(expr=expr, name=name))
 
     def output_anon(self, expr: Expr) -> OutputStmt:
-        return OutputStmt(expr=expr, name=None)
+        return self._intern(OutputStmt(expr=expr, name=None))
 
-    def function_def(self, funcname: list[str | Param], *stmts: Stmt) -> FunctionDef:
-        return FunctionDef(pattern=funcname, body=list(stmts))
+    def function_def(
+        self, funcname: tuple[str | Param, ...], *stmts: Stmt
+    ) -> FunctionDef:
+        return self._intern(FunctionDef(pattern=funcname, body=stmts))
 
     def loop_stmt(self, var: Token, over: Expr, *stmts: Stmt) -> LoopStmt:
-        return LoopStmt(var=str(var), over=over, body=list(stmts))
+        return self._intern(LoopStmt(var=str(var), over=over, body=stmts))
 
     def set_stmt(self, key: Token, value: Expr) -> SetStmt:
-        return SetStmt(key=str(key)[1:-1], value=value)  # strip enclosing quotes
+        # strip enclosing quotes
+        return self._intern(SetStmt(key=str(key)[1:-1], value=value))
 
     def result_stmt(self, expr: Expr) -> ResultStmt:
-        return ResultStmt(expr=expr)
+        return self._intern(ResultStmt(expr=expr))
 
     def var_assign(self, name: Token, expr: Expr) -> VarAssign:
-        return VarAssign(name=str(name), expr=expr)
+        return self._intern(VarAssign(name=str(name), expr=expr))
 
     def if_stmt(self, cond: Expr, *rest: Stmt | IfBranch | ElseBranch) -> IfStmt:
         # With @v_args(inline=True) and stmt* inlined, rest is a flat mix of
@@ -120,21 +166,21 @@ class AnyDiceTransformer(Transformer):
                 else_branch = node
             else:
                 body.append(node)
-        return IfStmt(
-            branches=[IfBranch(condition=cond, body=body), *branches_extra],
-            else_branch=else_branch,
+        first_branch = self._intern(IfBranch(condition=cond, body=tuple(body)))
+        return self._intern(
+            IfStmt(branches=(first_branch, *branches_extra), else_branch=else_branch)
         )
 
     def elseif(self, cond: Expr, *stmts: Stmt) -> IfBranch:
-        return IfBranch(condition=cond, body=list(stmts))
+        return self._intern(IfBranch(condition=cond, body=stmts))
 
     def else_clause(self, *stmts: Stmt) -> ElseBranch:
-        return ElseBranch(body=list(stmts))
+        return self._intern(ElseBranch(body=stmts))
 
     # ---- Function name -----------------------------------------------------------------
 
-    def funcname(self, *parts: str | Param) -> list[str | Param]:
-        return list(parts)
+    def funcname(self, *parts: str | Param) -> tuple[str | Param, ...]:
+        return parts
 
     def fname_part(self, part: str | Param) -> str | Param:
         return part
@@ -145,10 +191,12 @@ class AnyDiceTransformer(Transformer):
     def typed_param(self, name: Token, ptype: str) -> Param:
         # `:?` is the AnyDice wildcard, equivalent to a bare parameter. Normalize to
         # type=None at the AST level so downstream code only sees one form.
-        return Param(name=str(name), type=None if ptype == "?" else str(ptype))
+        return self._intern(
+            Param(name=str(name), type=None if ptype == "?" else str(ptype))
+        )
 
     def bare_param(self, name: Token) -> Param:
-        return Param(name=str(name), type=None)
+        return self._intern(Param(name=str(name), type=None))
 
     def param_type(self, t: Token) -> str:
         return str(t)
@@ -156,59 +204,59 @@ class AnyDiceTransformer(Transformer):
     # ---- Expressions -------------------------------------------------------------------
 
     def binop(self, left: Expr, op: Token, right: Expr) -> BinOp:
-        return BinOp(op=str(op), left=left, right=right)
+        return self._intern(BinOp(op=str(op), left=left, right=right))
 
     def dice_binop(self, n: Expr, faces: Expr) -> DiceBinOp:
-        return DiceBinOp(n=n, faces=faces)
+        return self._intern(DiceBinOp(n=n, faces=faces))
 
     def dice_unary(self, faces: Expr) -> DiceUnary:
-        return DiceUnary(faces=faces)
+        return self._intern(DiceUnary(faces=faces))
 
     def hash_op(self, _tok: Token, expr: Expr) -> HashOp:
-        return HashOp(expr=expr)
+        return self._intern(HashOp(expr=expr))
 
     def not_op(self, _tok: Token, expr: Expr) -> NotOp:
-        return NotOp(expr=expr)
+        return self._intern(NotOp(expr=expr))
 
     def neg_op(self, _tok: Token, expr: Expr) -> NegOp:
-        return NegOp(expr=expr)
+        return self._intern(NegOp(expr=expr))
 
     def pos_op(self, _tok: Token, expr: Expr) -> PosOp:
-        return PosOp(expr=expr)
+        return self._intern(PosOp(expr=expr))
 
     def number(self, tok: Token) -> Number:
-        return Number(value=int(tok))
+        return self._intern(Number(value=int(tok)))
 
     def var(self, tok: Token) -> Var:
-        return Var(name=str(tok))
+        return self._intern(Var(name=str(tok)))
 
     def empty_seq(self) -> EmptySeq:
-        return EmptySeq()
+        return self._intern(EmptySeq())
 
     def seq(self, elems: SeqExpr) -> SeqExpr:
         return elems
 
     def string(self, tok: Token) -> StringExpr:
-        return _parse_string(str(tok))
+        return self._intern(_parse_string(str(tok)))
 
     # ---- Sequences ---------------------------------------------------------------------
 
     def seq_elems(self, *elems: SeqElem) -> SeqExpr:
-        return SeqExpr(elems=list(elems))
+        return self._intern(SeqExpr(elems=elems))
 
     def range(self, start: Expr, _dotdot: Token, stop: Expr) -> RangeElem:
-        return RangeElem(start=start, stop=stop)
+        return self._intern(RangeElem(start=start, stop=stop))
 
     def range_repeat(
         self, start: Expr, _dotdot: Token, stop: Expr, repeat: Expr
     ) -> RangeRepeatElem:
-        return RangeRepeatElem(start=start, stop=stop, repeat=repeat)
+        return self._intern(RangeRepeatElem(start=start, stop=stop, repeat=repeat))
 
     def value(self, expr: Expr) -> ValueElem:
-        return ValueElem(expr=expr)
+        return self._intern(ValueElem(expr=expr))
 
     def value_repeat(self, expr: Expr, repeat: Expr) -> ValueRepeatElem:
-        return ValueRepeatElem(expr=expr, repeat=repeat)
+        return self._intern(ValueRepeatElem(expr=expr, repeat=repeat))
 
     # ---- Function calls ----------------------------------------------------------------
 
@@ -216,7 +264,7 @@ class AnyDiceTransformer(Transformer):
         return call_expr
 
     def call_expr(self, *parts: str | Expr) -> Call:
-        return Call(parts=list(parts))
+        return self._intern(Call(parts=parts))
 
     def call_word(self, token: Token) -> str:
         return str(token)
@@ -126,7 +126,7 @@ def _stmt(node: Stmt, depth: int) -> str:
         raise NotImplementedError(f"unhandled stmt node: {node!r}")
 
 
-def _block(stmts: list[Stmt], depth: int) -> str:
+def _block(stmts: tuple[Stmt, ...], depth: int) -> str:
     pad = "    " * depth
     if not stmts:
         return "{}"
@@ -135,7 +135,7 @@ def _block(stmts: list[Stmt], depth: int) -> str:
 
 
 def _if_stmt(
-    branches: list[IfBranch], else_branch: ElseBranch | None, depth: int
+    branches: tuple[IfBranch, ...], else_branch: ElseBranch | None, depth: int
 ) -> str:
     pad = "    " * depth
     first = branches[0]
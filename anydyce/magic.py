@@ -28,12 +28,14 @@ from datetime import UTC, datetime
 
 from dyce.lifecycle import ExperimentalWarning
 from IPython import get_ipython  # pyright: ignore[reportPrivateImportUsage]
+from IPython.core.error import UsageError
 from IPython.core.interactiveshell import InteractiveShell
 from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
 from IPython.display import HTML, Markdown, display
 
 from .anydice import (
     DEFAULT_PRECISION,
+    CancellationToken,
     Settings,
     format_results,
     run,
@@ -101,6 +103,11 @@ _OUTPUT_FORMAT = "output_format"
     default=DEFAULT_PRECISION,
     help=f"number of decimal places used when formatting output values as text. Default: {DEFAULT_PRECISION}",
 )
+@argument(
+    "--cancel-token",
+    metavar="NAME",
+    help="name of a CancellationToken in the user namespace. Cancelling it (e.g., from another thread) stops the run.",
+)
 def anyd(line: str, cell: str) -> None:
     r"""
     Run the cell as legacy AnyDice source and display each output's distribution.
@@ -115,8 +122,18 @@ def anyd(line: str, cell: str) -> None:
 
         %%anyd --short --precision 32
         output 1d100
+
+        %%anyd --cancel-token TOKEN
+        output [highest 3 of 20d20]
     """
     args = parse_argstring(anyd, line)
+    cancel_token = None
+    if args.cancel_token is not None:
+        ipy = get_ipython()
+        assert ipy
+        cancel_token = ipy.user_ns.get(args.cancel_token)
+        if not isinstance(cancel_token, CancellationToken):
+            raise UsageError(f"{args.cancel_token!r} is not a CancellationToken")
 
     with warnings.catch_warnings():
         # Everything other than a DeprecationWarning or ExperimentalWarning (e.g.,
@@ -129,7 +146,7 @@ def anyd(line: str, cell: str) -> None:
         # settings in place). format_results then reads the final value.
         settings = Settings()
         settings.set("anydyce: display precision", args.precision)
-        results = run(cell, settings=settings)
+        results = run(cell, settings=settings, cancel_token=cancel_token)
         if args.output_format in _PLOTTER_NAMES_BY_FORMAT:
             jupyter_visualize(
                 results,
@@ -0,0 +1,213 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+from anydyce.anydice import parse
+from anydyce.anydice.analysis import (
+    assigned_names,
+    called_shapes,
+    expr_facts,
+    has_calls,
+    is_constant,
+    read_names,
+    reads_only_assigned,
+    symmetric_uses,
+)
+from anydyce.anydice.ast_ import BinOp, Expr, FunctionDef, OutputStmt
+
+__all__ = ()
+
+
+def _func(source: str) -> FunctionDef:
+    (stmt,) = parse(source).stmts
+    assert isinstance(stmt, FunctionDef)
+    return stmt
+
+
+def _expr(source: str) -> Expr:
+    (stmt,) = parse(f"output {source}").stmts
+    assert isinstance(stmt, OutputStmt)
+    return stmt.expr
+
+
+class TestAssignedNames:
+    def test_assignments_and_loop_variables(self) -> None:
+        prog = parse(
+            "X: 1\nloop I over {1..2} { if I > 1 { Y: I } else { Z: I } }\noutput X + W"
+        )
+        assert assigned_names(prog.stmts) == {"X", "I", "Y", "Z"}
+
+    def test_function_bodies_ignored(self) -> None:
+        prog = parse("function: f A:n { X: A result: X }\nY: [f 1]")
+        assert assigned_names(prog.stmts) == {"Y"}
+
+
+class TestHasCalls:
+    def test_calls(self) -> None:
+        for source in ("[f 3d6]", "1 + [highest 1 of 2d6]", "{1..[f X]}", "([f])d6"):
+            assert has_calls(_expr(source)), source
+
+    def test_no_calls(self) -> None:
+        for source in ("X", "3dX", "{1..X}", "#{}"):
+            assert not has_calls(_expr(source)), source
+
+
+class TestIsConstant:
+    def test_constant(self) -> None:
+        for source in ("3d6", "{1..20}", "d{1,2,3} + 2", "{1, 2:3}@4d(d6)", "#{}"):
+            assert is_constant(_expr(source)), source
+
+    def test_not_constant(self) -> None:
+        for source in ("X", "3dX", "{1..X}", "[f 3d6]", "1 + [highest 1 of 2d6]"):
+            assert not is_constant(_expr(source)), source
+
+
+class TestExprFacts:
+    def test_matches_read_names_and_has_calls(self) -> None:
+        for source in ("3d6", "X + Y", "3dX", "[f X] + 1", "{1..X}", "-X@{Y, 1:Z}"):
+            expr = _expr(source)
+            assert expr_facts(expr, {}) == (
+                frozenset(read_names(expr)),
+                has_calls(expr),
+            ), source
+
+    def test_sub_expressions_memoized(self) -> None:
+        expr = _expr("X + [f 1] + 2")
+        memo: dict = {}
+        assert expr_facts(expr, memo) == (frozenset({"X"}), True)
+        assert isinstance(expr, BinOp)
+        assert memo[id(expr.right)] == (expr.right, (frozenset(), False))
+        assert memo[id(expr.left)] == (expr.left, (frozenset({"X"}), True))
+        # One entry per node: the two sums, `X`, the call, and the two numbers
+        assert len(memo) == 6
+
+
+class TestReadsOnlyAssigned:
+    def test_params_only(self) -> None:
+        assert reads_only_assigned(_func("function: f A:n B { result: A + B }"))
+
+    def test_caller_variable(self) -> None:
+        assert not reads_only_assigned(_func("function: f A:n { result: A + X }"))
+
+    def test_local_assigned_before_read(self) -> None:
+        assert reads_only_assigned(_func("function: f A:n { X: A * 2 result: X }"))
+
+    def test_local_read_before_assigned(self) -> None:
+        # X persists across expansion iterations, so the first read sees the last
+        # iteration's value
+        assert not reads_only_assigned(
+            _func("function: f A:n { if A > 1 { result: X } X: A result: X }")
+        )
+        assert not reads_only_assigned(_func("function: f A:n { X: X + A result: X }"))
+
+    def test_if_without_else(self) -> None:
+        assert not reads_only_assigned(
+            _func("function: f A:n { if A > 1 { X: 1 } result: X }")
+        )
+
+    def test_if_with_else(self) -> None:
+        assert reads_only_assigned(
+            _func(
+                "function: f A:n {\n"
+                "  if A > 2 { X: 1 } else if A > 1 { X: 2 Y: 1 } else { X: 3 }\n"
+                "  result: X\n"
+                "}"
+            )
+        )
+        assert not reads_only_assigned(
+            _func(
+                "function: f A:n {\n"
+                "  if A > 2 { X: 1 } else if A > 1 { X: 2 Y: 1 } else { X: 3 }\n"
+                "  result: Y\n"
+                "}"
+            )
+        )
+
+    def test_loop(self) -> None:
+        assert reads_only_assigned(
+            _func("function: f A:s { X: 0 loop I over A { X: X + I } result: X }")
+        )
+        # The sequence may be empty
+        assert not reads_only_assigned(
+            _func("function: f A:s { loop I over A { X: I } result: X }")
+        )
+        assert not reads_only_assigned(
+            _func("function: f A:s { loop I over A { X: I } result: I }")
+        )
+
+
+class TestCalledShapes:
+    def test_nested_calls(self) -> None:
+        func = _func(
+            "function: f A:n {\n"
+            "  if [g A] { result: [highest 1 of [h A and 2]] }\n"
+            "  loop I over {1..[n]} { A: A + I }\n"
+            "  result: A\n"
+            "}"
+        )
+        assert called_shapes(func.body) == {
+            ("g", None),
+            ("highest", None, "of", None),
+            ("h", None, "and", None),
+            ("n",),
+        }
+
+
+_SEQ_POSITIONS = {("count", None, "in", None): 1, (None, "contains", None): 0}
+
+
+class TestSymmetricUses:
+    def _uses(self, source: str) -> list[tuple[str | None, ...]] | None:
+        uses = symmetric_uses(_func(source).body, "S", _SEQ_POSITIONS)
+        if uses is None:
+            return None
+        return [
+            tuple(p if isinstance(p, str) else None for p in call.parts)
+            for call in uses
+        ]
+
+    def test_symmetric_calls(self) -> None:
+        assert self._uses(
+            "function: f S:s {\n"
+            "  if [count {6} in S] >= 2 { result: #S }\n"
+            "  result: [count {5, 6} in S] + [S contains 1]\n"
+            "}"
+        ) == [
+            ("count", None, "in", None),
+            ("count", None, "in", None),
+            (None, "contains", None),
+        ]
+
+    def test_unread(self) -> None:
+        assert self._uses("function: f S:s N:n { result: N }") == []
+
+    def test_other_reads(self) -> None:
+        assert self._uses("function: f S:s { result: 1@S }") is None
+        assert self._uses("function: f S:s { result: [g S] }") is None
+        assert self._uses("function: f S:s { result: [count S in {1, 2}] }") is None
+        assert (
+            self._uses("function: f S:s { loop I over S { result: I } result: 0 }")
+            is None
+        )
+
+    def test_other_args_not_constant(self) -> None:
+        assert self._uses("function: f S:s N:n { result: [count N in S] }") is None
+        assert self._uses("function: f S:s { result: [count [g] in S] }") is None
+
+    def test_assigned(self) -> None:
+        assert self._uses("function: f S:s { S: {1} result: [count {1} in S] }") is None
+        assert (
+            self._uses("function: f S:s { loop S over {1} { result: 1 } result: 0 }")
+            is None
+        )
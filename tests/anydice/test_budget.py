@@ -0,0 +1,120 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+import pytest
+from dyce import H
+
+from anydyce.anydice import (
+    AnyDiceInterpreter,
+    Budget,
+    BudgetExceededError,
+    parse,
+    run,
+)
+
+__all__ = ()
+
+
+class TestBudget:
+    def test_negative_limit(self) -> None:
+        with pytest.raises(ValueError, match=r"max_steps must be non-negative"):
+            Budget(max_steps=-1)
+
+    def test_unlimited(self) -> None:
+        prog = "function: f N:n { result: N * 2 }\nloop I over {1..3} { output [f dI] }"
+        assert run(prog, budget=Budget()) == run(prog)
+
+    def test_within_limits(self) -> None:
+        budget = Budget(
+            max_seconds=60,
+            max_steps=100,
+            max_outcomes=16,
+            max_total_weight=36,
+            max_bytes=10_000,
+        )
+        assert run("output 2d6", budget=budget) == [("output 1", 2 @ H(6))]
+
+
+class TestBudgetExceeded:
+    def test_steps(self) -> None:
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run("loop N over {1..100} { output N }", budget=Budget(max_steps=10))
+        exc = exc_info.value
+        assert exc.limit == "max_steps"
+        assert exc.usage.steps == 11
+        assert str(exc) == "execution budget exceeded: 11 steps (max_steps=10)"
+        # The loop statement itself is the first step
+        assert exc.outputs == [(f"output {n}", H({n: 1})) for n in range(1, 10)]
+
+    def test_expansion_steps(self) -> None:
+        # Each combination a call is expanded over is a step, even though this body
+        # executes only once per distinct pair of values
+        prog = "function: f A:n and B:n { result: A + B }\noutput [f d100 and d100]"
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run(prog, budget=Budget(max_steps=1000))
+        assert exc_info.value.limit == "max_steps"
+        assert exc_info.value.outputs == []
+
+    def test_recursion_steps(self) -> None:
+        prog = (
+            'set "maximum function depth" to 1000\n'
+            "function: f N:n { if N = 0 { result: 0 } result: 1 + [f N - 1] }\n"
+            "output [f 500]"
+        )
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run(prog, budget=Budget(max_steps=100))
+        assert exc_info.value.limit == "max_steps"
+
+    def test_seconds(self) -> None:
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run("loop N over {1..100} { output N }", budget=Budget(max_seconds=0))
+        exc = exc_info.value
+        assert exc.limit == "max_seconds"
+        assert exc.usage.seconds > 0
+        assert exc.outputs == []
+
+    def test_outcomes(self) -> None:
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run("output d6\noutput 10d6", budget=Budget(max_outcomes=50))
+        exc = exc_info.value
+        assert exc.limit == "max_outcomes"
+        assert exc.usage.outcomes == 51
+        assert exc.outputs == [("output 1", H(6))]
+
+    def test_total_weight(self) -> None:
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run("output 10d6", budget=Budget(max_total_weight=6**9))
+        assert exc_info.value.limit == "max_total_weight"
+        assert exc_info.value.usage.total_weight == 6**10
+
+    def test_bytes(self) -> None:
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run("output d1000", budget=Budget(max_bytes=10_000))
+        assert exc_info.value.limit == "max_bytes"
+        assert exc_info.value.usage.bytes > 10_000
+
+    def test_call_result(self) -> None:
+        # Checked as the call returns, before the rest of the expression
+        prog = "function: f A:n { result: A }\noutput [f 1d1000] > 0"
+        with pytest.raises(BudgetExceededError) as exc_info:
+            run(prog, budget=Budget(max_outcomes=100))
+        assert exc_info.value.limit == "max_outcomes"
+
+    def test_interpreter_reusable(self) -> None:
+        interp = AnyDiceInterpreter()
+        program = parse("loop N over {1..100} { output N }")
+        with pytest.raises(BudgetExceededError):
+            interp.run(program, budget=Budget(max_steps=10))
+        assert len(interp.run(program)) == 100
@@ -0,0 +1,99 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+import threading
+
+import pytest
+from dyce import H
+
+from anydyce.anydice import (
+    Budget,
+    BudgetExceededError,
+    CancellationToken,
+    RunCancelledError,
+    run,
+)
+
+__all__ = ()
+
+
+class _CancelledAfter(CancellationToken):
+    r"""A token that reports being cancelled once it has been checked *checks* times."""
+
+    def __init__(self, checks: int) -> None:
+        super().__init__()
+        self.checks = checks
+
+    @property
+    def cancelled(self) -> bool:
+        self.checks -= 1
+        return self.checks < 0
+
+
+class TestCancellationToken:
+    def test_cancel(self) -> None:
+        cancel_token = CancellationToken()
+        assert not cancel_token.cancelled
+        cancel_token.cancel()
+        assert cancel_token.cancelled
+        cancel_token.cancel()
+        assert cancel_token.cancelled
+
+    def test_not_cancelled(self) -> None:
+        prog = "function: f N:n { result: N * 2 }\nloop I over {1..3} { output [f dI] }"
+        assert run(prog, cancel_token=CancellationToken()) == run(prog)
+
+    def test_cancelled_before_run(self) -> None:
+        cancel_token = CancellationToken()
+        cancel_token.cancel()
+        with pytest.raises(RunCancelledError) as exc_info:
+            run("output 1d6", cancel_token=cancel_token)
+        assert exc_info.value.outputs == []
+
+    def test_cancelled_between_statements(self) -> None:
+        # One check for the loop statement, and one for each output before the fourth
+        with pytest.raises(RunCancelledError) as exc_info:
+            run("loop N over {1..10} { output N }", cancel_token=_CancelledAfter(4))
+        assert exc_info.value.outputs == [
+            (f"output {n}", H({n: 1})) for n in range(1, 4)
+        ]
+
+    def test_cancelled_during_expansion(self) -> None:
+        cancel_token = _CancelledAfter(100)
+        prog = "function: f A:n and B:n { result: A + B }\noutput [f d100 and d100]"
+        with pytest.raises(RunCancelledError):
+            run(prog, cancel_token=cancel_token)
+        assert cancel_token.checks == -1
+
+    def test_cancelled_from_another_thread(self) -> None:
+        cancel_token = CancellationToken()
+        timer = threading.Timer(0.01, cancel_token.cancel)
+        timer.start()
+        try:
+            with pytest.raises(RunCancelledError):
+                run(
+                    "loop N over {1..10000} { loop M over {1..10000} { X: M } }",
+                    cancel_token=cancel_token,
+                )
+        finally:
+            timer.cancel()
+
+    def test_with_budget(self) -> None:
+        with pytest.raises(BudgetExceededError):
+            run(
+                "loop N over {1..100} { output N }",
+                budget=Budget(max_steps=10),
+                cancel_token=CancellationToken(),
+            )
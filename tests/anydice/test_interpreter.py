@@ -13,13 +13,18 @@
 # (This does not apply to code comments.) Thank you!
 # ======================================================================================
 
+import sys
+import threading
+from itertools import islice, product
+from math import comb
+
 import pytest
 from dyce import H, P
 from dyce.d import d1, d2, dempty, dzero
 from dyce.h import aggregate_weighted
 from lark.exceptions import UnexpectedInput
 
-from anydyce.anydice import parse, run
+from anydyce.anydice import Profiler, builtins_, interpreter, parse, run
 from anydyce.anydice.interpreter import AnyDiceInterpreter
 from anydyce.anydice.settings import Settings
 
@@ -194,6 +199,39 @@ class TestDieBinary:
         # Parser-variant of the bare `d{}d{}` form; same result.
         assert run("output (d{})d(d{})") == [("output 1", dempty)]
 
+    def test_many_dice_summed_exactly(self) -> None:
+        # Large sums skip the pool and convolve by repeated squaring
+        (_, h) = run("output 40d20")[0]
+        assert tuple(h.items()) == tuple((H(20) @ 40).items())
+        (_, h) = run("output -30d{1,2,3,5,6}")[0]
+        assert tuple(h.items()) == tuple((-H((1, 2, 3, 5, 6)) @ 30).items())
+        (_, h) = run("output 13d{1,10,100}")[0]
+        assert tuple(h.items()) == tuple((H((1, 10, 100)) @ 13).items())
+
+    def test_die_count_sums_built_incrementally(self) -> None:
+        # Each count's sum is built from the previous one, including across gaps,
+        # for negative counts, and from a die with a zero-count face
+        faces = H({1: 3, 3: 1, 4: 0, 6: 2})
+        rolled = H({o: c for o, c in faces.items() if c})
+        counts = {-4: 1, 0: 2, 2: 1, 3: 5, 9: 1}
+        (_, h) = run("output (d{-4, 0, 0, 2, 3:5, 9})d{1:3, 3, 4:0, 6:2}")[0]
+        expected = aggregate_weighted(
+            (
+                ((rolled @ k) if k > 0 else (-rolled @ -k) if k < 0 else dzero, w)
+                for k, w in counts.items()
+            )
+        )
+        assert tuple(h.items()) == tuple(expected.items())
+
+    def test_summed_dice_keep_pool_when_selected(self) -> None:
+        # Only sum-only contexts skip the pool; everything else can still select
+        assert run("X: 20d6\noutput 1@X\noutput 3@20d6 < 1@X") == [
+            ("output 1", (20 @ P(6)).h(-1)),
+            ("output 2", (20 @ P(6)).h(-3).lt((20 @ P(6)).h(-1))),
+        ]
+        assert run("output d{} + 20d6 * 1") == [("output 1", 20 @ H(6))]
+        assert run("output 2 * (d{} - 20d6)") == [("output 1", (20 @ H(6)) * 2)]
+
 
 # ---- Variables ---------------------------------------------------------------------------
 
@@ -214,6 +252,60 @@ class TestVariables:
     def test_variable_chain(self) -> None:
         assert run("X: d6\nY: X\noutput Y") == [("output 1", H(6))]
 
+    def test_pool_variable_sums_once(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        sums: list[tuple[int, H]] = []
+        sum_dice = interpreter._sum_dice  # ruff: ignore[private-member-access]
+
+        def _counting_sum_dice(n: int, die: H) -> H:
+            sums.append((n, die))
+            return sum_dice(n, die)
+
+        monkeypatch.setattr(interpreter, "_sum_dice", _counting_sum_dice)
+        prog = "X: 30d6\nY: X\noutput X + 1\noutput Y > 100\noutput 1@Y\noutput -X"
+        assert run(prog) == [
+            ("output 1", (30 @ H(6)) + 1),
+            ("output 2", (30 @ H(6)).gt(100)),
+            ("output 3", (30 @ P(6)).h(-1)),
+            ("output 4", -(30 @ H(6))),
+        ]
+        assert sums == [(30, H(6)), (30, -H(6))]
+
+    def test_constant_expression_evaluated_once(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        sums: list[tuple[int, H]] = []
+        sum_dice = interpreter._sum_dice  # ruff: ignore[private-member-access]
+
+        def _counting_sum_dice(n: int, die: H) -> H:
+            sums.append((n, die))
+            return sum_dice(n, die)
+
+        monkeypatch.setattr(interpreter, "_sum_dice", _counting_sum_dice)
+        prog = (
+            "function: f X:n { result: X + 3d6 }\n"
+            "loop I over {1..4} { output 3d6 + I }\n"
+            "output [f d4]"
+        )
+        assert run(prog) == [
+            *((f"output {i}", (3 @ H(6)) + i) for i in range(1, 5)),
+            ("output 5", H(4) + 3 @ H(6)),
+        ]
+        # Once for the loop, and once for the function body (which is a different
+        # context, since the dice there are bound as a pool)
+        assert sums == [(3, H(6)), (3, H(6))]
+
+    def test_constant_expression_reevaluated_after_set(self) -> None:
+        prog = (
+            "loop I over {1..2} {\n"
+            "  output 1@3d6\n"
+            '  set "position order" to "lowest first"\n'
+            "}"
+        )
+        assert run(prog) == [
+            ("output 1", (3 @ P(6)).h(-1)),
+            ("output 2", (3 @ P(6)).h(0)),
+        ]
+
 
 # ---- Sequences ---------------------------------------------------------------------------
 
@@ -2040,9 +2132,76 @@ class TestFunctionBasic:
             'set "maximum function depth" to 5\nfunction: { result: 1 + [] }\noutput []'
         ) == [("output 1", H({5: 1}))]
 
+    def test_arguments_not_evaluated_at_maximum_recursion_depth(self) -> None:
+        # A capped call evaluates none of its arguments, so neither the call to
+        # `absolute` nor the one to the undefined `[g]` is ever made at depth 1
+        profiler = Profiler()
+        assert run(
+            'set "maximum function depth" to 1\n'
+            "function: f X:n { result: [f [absolute X] + [g]] }\n"
+            "output [f 1]",
+            profiler=profiler,
+        ) == [("output 1", dempty)]
+        assert {stats.kind for stats in profiler.stats.values()} == {
+            "statement",
+            "function",
+        }
+
     def test_value_returned_after_maxium_recursion_depth_is_empty_die(self) -> None:
         assert run("function: { result: 1 / [] }\noutput []") == [("output 1", dempty)]
 
+    def test_deep_recursion_leaves_recursion_limit_alone(self) -> None:
+        limit = sys.getrecursionlimit()
+        assert run(
+            'set "maximum function depth" to 5000\n'
+            "function: f N:n { if N = 0 { result: 0 } result: 1 + [f N - 1] }\n"
+            "output [f 4000]"
+        ) == [("output 1", H({4000: 1}))]
+        assert sys.getrecursionlimit() == limit
+
+    def test_deep_recursion_in_thread_with_small_stack(self) -> None:
+        results: list[object] = []
+
+        def _target() -> None:
+            results.append(
+                run(
+                    'set "maximum function depth" to 2000\n'
+                    "function: f N:n { if N = 0 { result: 0 } result: 1 + [f N - 1] }\n"
+                    "output [f 1500]"
+                )
+            )
+
+        old_size = threading.stack_size(256 * 1024)
+        try:
+            thread = threading.Thread(target=_target)
+            thread.start()
+            thread.join()
+        finally:
+            threading.stack_size(old_size)
+        assert results == [[("output 1", H({1500: 1}))]]
+
+    def test_deeply_nested_expression(self) -> None:
+        # Compiling and evaluating expressions recurses once per level of nesting
+        limit = sys.getrecursionlimit()
+        assert run("X: 1\noutput " + " + ".join(["X"] * 2500)) == [
+            ("output 1", H({2500: 1}))
+        ]
+        assert sys.getrecursionlimit() == limit
+
+    def test_selection_from_pool_of_large_dice(self) -> None:
+        # dyce's pool selection recurses once per distinct outcome
+        assert run("output [highest 1 of d1000 and d999]", selection_cache=None) == [
+            (
+                "output 1",
+                H(
+                    {
+                        k: k * k - (k - 1) * (k - 1) if k < 1000 else 999
+                        for k in range(1, 1001)
+                    }
+                ),
+            )
+        ]
+
     def test_wildcard_param_type_equivalent_to_bare(self) -> None:
         # `:?` is AnyDice's explicit "any type" marker; identical to a bare param.
         # Both should accept a die argument and expand the body once per outcome.
@@ -2344,6 +2503,28 @@ output [boost 2d20 low 20 high 22 with d4]
         assert label == "output 1"
         assert h[21] == 80
 
+    def test_streamed_counts_match_aggregate_weighted(self) -> None:
+        # Results are merged as they arrive rather than collected first, with the
+        # same exact counts as aggregate_weighted
+        src = """
+function: f X:n and Y:n {
+ if X = Y { result: d{2, 2, 5} }
+ if X > Y { result: X d 3 }
+ result: Y
+}
+output [f d4 and d6]
+"""
+        branches = []
+        for x, y in product(range(1, 5), range(1, 7)):
+            if x == y:
+                branches.append((H({2: 2, 5: 1}), 1))
+            elif x > y:
+                branches.append((x @ H(3), 1))
+            else:
+                branches.append((H({y: 1}), 1))
+        ((_, h),) = run(src)
+        assert tuple(h.items()) == tuple(aggregate_weighted(branches).items())
+
 
 # ---- Bare-param pass-through (no coercion, no expansion) --------------------------------
 
@@ -2596,6 +2777,143 @@ class TestFunctionScoping:
         # 5 + 4 + 3 + 2 + 1 + 0 = 15
         assert run(prog) == [("output 1", H({15: 1}))]
 
+    def test_deep_recursion_sees_nearest_caller_binding(self) -> None:
+        # Deep enough that lookups cross many nested environments. The innermost call
+        # sees the global X and the D assigned 13 levels up, and nothing leaks back.
+        prog = (
+            'set "maximum function depth" to 100\n'
+            "function: f N:n {\n"
+            "  if N = 0 { result: X * 1000 + D }\n"
+            "  if N = 13 { D: 13 }\n"
+            "  X: X\n"
+            "  result: [f N - 1]\n"
+            "}\n"
+            "X: 4\n"
+            "D: 1\n"
+            "output [f 60]\n"
+            "output D"
+        )
+        assert run(prog) == [("output 1", H({4013: 1})), ("output 2", H({1: 1}))]
+
+
+# ---- Function call memoization -----------------------------------------------------------
+
+
+class TestFunctionCallMemoization:
+    # Calls to functions whose results depend only on their arguments are cached for
+    # the rest of the run. None of these should be observable, other than by speed.
+
+    def test_exponential_recursion_completes(self) -> None:
+        # Without caching, this makes ~2^60 calls
+        prog = (
+            'set "maximum function depth" to 100\n'
+            "function: fib N:n {\n"
+            "  if N < 2 { result: N }\n"
+            "  result: [fib N - 1] + [fib N - 2]\n"
+            "}\n"
+            "output [fib 60]"
+        )
+        assert run(prog) == [("output 1", H({1548008755920: 1}))]
+
+    def test_same_args_at_different_depths_respect_cap(self) -> None:
+        # [f 5] called from the top level is capped one level deeper than [f 5] called
+        # via [g 5], so the two results differ
+        prog = (
+            'set "maximum function depth" to 4\n'
+            "function: f N:n { if N = 0 { result: 0 } result: 1 + [f N-1] }\n"
+            "function: g N:n { result: [f N] }\n"
+            "output [f 5]\n"
+            "output [g 5]\n"
+            "output [f 5]"
+        )
+        assert run(prog) == [
+            ("output 1", H({4: 1})),
+            ("output 2", H({3: 1})),
+            ("output 3", H({4: 1})),
+        ]
+
+    def test_reading_caller_variable_is_not_cached(self) -> None:
+        # [get] reads X from its caller, which makes [twice] depend on X too
+        prog = (
+            "function: get { result: X }\n"
+            "function: twice { result: 2 * [get] }\n"
+            "X: 1\n"
+            "output [twice]\n"
+            "X: 2\n"
+            "output [twice]"
+        )
+        assert run(prog) == [("output 1", H({2: 1})), ("output 2", H({4: 1}))]
+
+    def test_redefinition_invalidates(self) -> None:
+        prog = (
+            "function: f N:n { result: N + 1 }\n"
+            "output [f d4]\n"
+            "function: f N:n { result: N * 2 }\n"
+            "output [f d4]"
+        )
+        assert run(prog) == [
+            ("output 1", H({2: 1, 3: 1, 4: 1, 5: 1})),
+            ("output 2", H({2: 1, 4: 1, 6: 1, 8: 1})),
+        ]
+
+    def test_set_invalidates(self) -> None:
+        prog = (
+            "function: f N:n { if N = 0 { result: 0 } result: 1 + [f N-1] }\n"
+            "output [f 12]\n"
+            'set "maximum function depth" to 5\n'
+            "output [f 12]"
+        )
+        assert run(prog) == [("output 1", H({10: 1})), ("output 2", H({5: 1}))]
+
+    def test_expansion_bodies_shared_across_calls(self) -> None:
+        # The second and third calls reuse some of the first call's body results
+        prog = (
+            "function: f X:n over T:n { if X > T { result: X } result: 0 }\n"
+            "output [f d6 over 2]\n"
+            "output [f d8 over 2]\n"
+            "output [f d6 over 3]"
+        )
+        assert run(prog) == [
+            ("output 1", H({0: 2, 3: 1, 4: 1, 5: 1, 6: 1})),
+            ("output 2", H({0: 2, 3: 1, 4: 1, 5: 1, 6: 1, 7: 1, 8: 1})),
+            ("output 3", H({0: 3, 4: 1, 5: 1, 6: 1})),
+        ]
+
+    def test_expansion_bodies_respect_cap(self) -> None:
+        prog = (
+            'set "maximum function depth" to 3\n'
+            "function: f X:n { if X <= 1 { result: 1 } result: X + [f X - 1] }\n"
+            "function: g X:n { result: [f X] }\n"
+            "output [f d4]\n"
+            "output [g d4]\n"
+            "output [f d4]"
+        )
+        assert run(prog) == [
+            ("output 1", H({1: 1, 3: 1, 6: 1, 9: 1})),
+            ("output 2", H({1: 1, 3: 1, 5: 1, 7: 1})),
+            ("output 3", H({1: 1, 3: 1, 6: 1, 9: 1})),
+        ]
+
+    def test_expansion_merges_identical_results(self) -> None:
+        # Only the first occurrence of a duplicated param is bound, so the second
+        # expansion contributes six identical results per outcome of the first
+        prog = "function: f X:n and X:n { result: X * 10 }\noutput [f d4 and d6]"
+        ((_, h),) = run(prog)
+        assert dict(h.items()) == {10: 6, 20: 6, 30: 6, 40: 6}
+
+    def test_die_args_keyed_on_exact_counts(self) -> None:
+        # d{1,2} and d{1,1,2,2} compare equal as H objects (same proportions), but must
+        # not share a cache entry
+        prog = (
+            "function: f D:d { result: D + 0 }\n"
+            "output [f d{1,2}]\n"
+            "output [f d{1,1,2,2}]"
+        )
+        assert [dict(h.items()) for _, h in run(prog)] == [
+            {1: 1, 2: 1},
+            {1: 2, 2: 2},
+        ]
+
 
 # ---- Function signature: duplicate parameter names ---------------------------------------
 
@@ -2867,6 +3185,94 @@ class TestLoopStmt:
         with pytest.raises(TypeError, match=r"loop over must be a sequence"):
             run("loop X over 2d6 { output X }")
 
+    def test_invariant_expression_evaluated_once_per_loop(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        sums: list[tuple[int, H]] = []
+        sum_dice = interpreter._sum_dice  # ruff: ignore[private-member-access]
+
+        def _counting_sum_dice(n: int, die: H) -> H:
+            sums.append((n, die))
+            return sum_dice(n, die)
+
+        monkeypatch.setattr(interpreter, "_sum_dice", _counting_sum_dice)
+        prog = (
+            "A: 3\n"
+            "loop J over {1..2} {\n"
+            "  loop I over {1..3} { output (A)d6 + (J)d4 + I }\n"
+            "}"
+        )
+        assert run(prog) == [
+            (f"output {3 * (j - 1) + i}", (3 @ H(6)) + (j @ H(4)) + i)
+            for j in range(1, 3)
+            for i in range(1, 4)
+        ]
+        # `(A)d6` once for the whole run, and `(J)d4` once per run of the inner loop
+        assert sums == [(3, H(6)), (1, H(4)), (2, H(4))]
+
+    def test_invariant_builtin_call_made_once_per_loop(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        calls: list[int] = []
+        highest_n_of = builtins_._highest_n_of  # ruff: ignore[private-member-access]
+
+        def _counting_highest_n_of(n: int, pool: P) -> H:
+            calls.append(n)
+            return highest_n_of(n, pool)
+
+        monkeypatch.setattr(builtins_, "_highest_n_of", _counting_highest_n_of)
+        prog = "loop N over {1..4} { output [highest N of 4d6] + [highest 3 of 4d6] }"
+        expected = [
+            (
+                f"output {n}",
+                (4 @ P(6)).h(slice(-n, None)) + (4 @ P(6)).h(slice(-3, None)),
+            )
+            for n in range(1, 5)
+        ]
+        # Without a selection cache, which would also spare repeated calls
+        assert run(prog, selection_cache=None) == expected
+        # `[highest 3 of 4d6]` only on the first iteration
+        assert calls == [1, 3, 2, 3, 4]
+
+    def test_variable_assigned_in_body_not_hoisted(self) -> None:
+        prog = "A: 1\nloop I over {1..3} { output (A)d6\nA: A + 1 }"
+        assert run(prog) == [(f"output {i}", i @ H(6)) for i in range(1, 4)]
+
+    def test_function_reading_loop_variable_not_cached(self) -> None:
+        # `g` reads the loop variable through dynamic scoping
+        prog = "function: g { result: I * 2 }\nloop I over {1..3} { output [g] }"
+        assert run(prog) == [(f"output {i}", H({2 * i: 1})) for i in range(1, 4)]
+
+    def test_invariant_expression_in_recursive_function(self) -> None:
+        # Each call's execution of the loop sees its own `N`, even though the
+        # recursive call is made while the caller's is in progress
+        prog = (
+            "function: f N:n {\n"
+            "  if N = 0 { result: 0 }\n"
+            "  T: 0\n"
+            "  loop I over {1..2} { T: T + [f N - 1] + (N)d2 }\n"
+            "  result: T\n"
+            "}\n"
+            "output [f 3]"
+        )
+        expected = H({0: 1})
+        for n in range(1, 4):
+            expected = (expected + n @ H(2)) + (expected + n @ H(2))
+        assert run(prog) == [("output 1", expected)]
+
+    def test_invariant_expression_reevaluated_after_set(self) -> None:
+        prog = (
+            "D: 3d6\n"
+            "loop I over {1..2} {\n"
+            "  output 1@D\n"
+            '  set "position order" to "lowest first"\n'
+            "}"
+        )
+        assert run(prog) == [
+            ("output 1", (3 @ P(6)).h(-1)),
+            ("output 2", (3 @ P(6)).h(0)),
+        ]
+
 
 # ---- Statement context restrictions ------------------------------------------------------
 
@@ -3051,6 +3457,19 @@ class TestLoopStmtInFunctionBody:
         )
         assert run(prog) == [("output 1", d1)]
 
+    def test_result_nested_in_if_in_loop_stops_at_first_firing(self) -> None:
+        prog = (
+            "function: f X:n {\n"
+            "  loop Y over {1..5} {\n"
+            "    if Y = X { result: Y * 10 } else { T: Y }\n"
+            "  }\n"
+            "  result: T\n"
+            "}\n"
+            "output [f d6]"
+        )
+        # X in 1..5 fires inside the loop; X = 6 falls through with T = 5
+        assert run(prog) == [("output 1", H({10: 1, 20: 1, 30: 1, 40: 1, 50: 1, 5: 1}))]
+
     def test_loop_inside_if_inside_function(self) -> None:
         prog = (
             "function: f X:n {\n"
@@ -3668,6 +4087,26 @@ class TestAnydyceSettings:
         assert h_exact.total > 10**20
         assert h_quant.total < 10**6
 
+    def test_calc_precision_change_requantizes_pool_variable(self) -> None:
+        # A pool's sum is cached on the pool, so the second output of R must
+        # not reuse the exact sum computed for the first one.
+        from anydyce.anydice import run as module_run
+        from anydyce.anydice.settings import Settings
+
+        s = Settings()
+        [(_, h_before), (_, h_after), (_, h_fresh)] = module_run(
+            'set "anydyce: calculation precision" to "exact"\n'
+            "R: 30d6\n"
+            "output R\n"
+            'set "anydyce: calculation precision" to 8\n'
+            "output R\n"
+            "output 30d6\n",
+            settings=s,
+        )
+        assert h_before.total == 6**30
+        assert h_after.total == h_fresh.total
+        assert list(h_after.items()) == list(h_fresh.items())
+
     def test_interpreter_settings_dont_span_runs(self) -> None:
         interp = AnyDiceInterpreter()
         settings = Settings()
@@ -3680,6 +4119,25 @@ class TestAnydyceSettings:
         assert exact_name == default_name
         assert exact_output != default_output
 
+    def test_fft_convolution_ignored_when_exact(self) -> None:
+        prog = 'set "anydyce: convolution" to "fft"\noutput d100 + d100 - d50'
+        settings = Settings()
+        settings.set("anydyce: calculation precision", "exact")
+        assert run(prog, settings=settings) == run("output d100 + d100 - d50")
+
+    def test_fft_convolution_approximates(self) -> None:
+        prog = "output 2d100 + 3d60 - d80"
+        [(_, h_exact)] = run(prog)
+        [(_, h_fft)] = run(
+            'set "anydyce: calculation precision" to 52\n'
+            'set "anydyce: convolution" to "fft"\n' + prog
+        )
+        p_exact = dict(h_exact.probability_items())
+        p_fft = dict(h_fft.probability_items())
+        assert p_fft.keys() == p_exact.keys()
+        for outcome, p in p_exact.items():
+            assert p_fft[outcome] == pytest.approx(p, rel=1e-6, abs=1e-12)
+
     def test_run_does_not_mutate_caller_settings_unexpectedly(self) -> None:
         # If the program does not contain a `set` directive for a key, that
         # key on the caller-provided Settings stays exactly as the caller
@@ -3873,6 +4331,26 @@ class TestBuiltinExplode:
             == "output 1"
         )
 
+    def test_explode_deep(self) -> None:
+        # Stopping after k < 100 explosions (on a 1) has a chance of 1 / 2**(k + 1).
+        # After 100 explosions, both faces stop, each with a chance of 1 / 2**101.
+        depth = 100
+        expected = {2 * k + 1: 2 ** (depth - k) for k in range(depth)}
+        expected[2 * depth + 1] = expected[2 * depth + 2] = 1
+        assert run(f'set "explode depth" to {depth}\noutput [explode d2]') == [
+            ("output 1", H(expected))
+        ]
+
+    def test_explode_on_faces(self) -> None:
+        explode = builtins_._explode  # ruff: ignore[private-member-access]
+        # Rolling a 5 or a 6 explodes (once)
+        expected: dict[int, int] = dict.fromkeys(range(1, 5), 6)
+        for first, second in product((5, 6), range(1, 7)):
+            expected[first + second] = expected.get(first + second, 0) + 1
+        assert explode(H(6), 1, faces={5, 6}) == H(expected)
+        assert explode(H(6), 2) == explode(H(6), 2, faces={6})
+        assert explode(H(6), 2, faces={7}) == H(6)
+
 
 # ---- Builtin: [lowest of A and B] -------------------------------------------------------
 
@@ -4675,6 +5153,128 @@ class TestSParamPoolExpansionIterationOrder:
         assert run(prog) == [("output 1", H({-10: 1, -3: 1}))]
 
 
+class TestSParamPoolRollsGenerated:
+    # `:s` expansion over a pool of identical dice generates its rolls in order as
+    # they're needed, rather than storing them all up front
+
+    _POOL_ROLLS = interpreter._PoolRolls  # ruff: ignore[private-member-access]
+
+    @pytest.mark.parametrize(
+        "die", [H(6), H({-3: 2, 0: 1, 5: 7}), H({1: 1, 2: 0, 4: 3})]
+    )
+    @pytest.mark.parametrize("n", [2, 3, 5])
+    def test_matches_sorted_rolls(self, die: H, n: int) -> None:
+        rolls = list((n @ P(die)).rolls_with_counts())
+        highest_first = sorted(rolls, key=lambda rc: rc[0][::-1], reverse=True)
+        assert list(self._POOL_ROLLS(die, n, descending=True)) == [
+            (r[::-1], c) for r, c in highest_first
+        ]
+        assert list(self._POOL_ROLLS(die, n, descending=False)) == sorted(rolls)
+        assert len(self._POOL_ROLLS(die, n, descending=True)) == len(rolls)
+
+    def test_not_stored(self) -> None:
+        # Far too many rolls to store (over 200 billion)
+        rolls = self._POOL_ROLLS(H(20), 40, descending=True)
+        assert len(rolls) > 200_000_000_000
+        first, second = islice(rolls, 2)
+        assert first == ((20,) * 40, 1)
+        assert second == ((20,) * 39 + (19,), 40)
+
+    def test_combined_with_other_params(self) -> None:
+        # The first param still varies fastest
+        prog = (
+            "function: f A:s and B:n and C:s {\n"
+            "  I: I + 1\n"
+            "  result: I * 1000 + 1@A * 100 + B * 10 + 1@C\n"
+            "}\n"
+            "I: 0\n"
+            "output [f 2d2 and d2 and 2d3]"
+        )
+        expected: dict[int, int] = {}
+        i = 0
+        for c, cw in (((3,), 1), ((3,), 2), ((3,), 2), ((2,), 1), ((2,), 2), ((1,), 1)):
+            for b in (1, 2):
+                for a, aw in (((2,), 1), ((2,), 2), ((1,), 1)):
+                    i += 1
+                    expected[i * 1000 + a[0] * 100 + b * 10 + c[0]] = aw * cw
+        assert run(prog) == [("output 1", H(expected))]
+
+
+class TestSParamSymmetricExpansion:
+    # A `:s` param over a pool of identical dice, read only by builtins that depend
+    # only on how many of its elements fall in each class of outcomes (e.g., `[count
+    # VALUES in SEQ]`), is expanded over those counts rather than over every roll
+
+    @staticmethod
+    def _successes(n: int, hits: int, faces: int) -> H:
+        return H(
+            {k: comb(n, k) * hits**k * (faces - hits) ** (n - k) for k in range(n + 1)}
+        )
+
+    def _combos(self, prog: str, label: str) -> int:
+        profiler = Profiler()
+        run(prog, profiler=profiler)
+        return profiler.stats[label].combos
+
+    def test_builtin(self) -> None:
+        prog = "output [count {5, 6} in 12d6]"
+        assert run(prog) == [("output 1", self._successes(12, 2, 6))]
+        # 13 rather than the 6,188 distinct rolls of 12d6
+        assert self._combos(prog, "[count _ in _]") == 13
+
+    def test_function(self) -> None:
+        prog = (
+            "function: hits S:s {\n"
+            "  if [count {6} in S] >= 2 { result: #S }\n"
+            "  result: [count {5, 6} in S] - [S contains 1]\n"
+            "}\n"
+            "output [hits 6d6]"
+        )
+        expected: dict[int, int] = {}
+        for roll in product(range(1, 7), repeat=6):
+            if roll.count(6) >= 2:
+                outcome = 6
+            else:
+                outcome = roll.count(5) + roll.count(6) - (1 in roll)
+            expected[outcome] = expected.get(outcome, 0) + 1
+        assert run(prog) == [("output 1", H(expected))]
+        # One class each for 1, for 5, for 6, and for everything else
+        assert self._combos(prog, "function: hits S:s") == comb(4 + 6 - 1, 6)
+
+    def test_weighted_die_and_other_params(self) -> None:
+        prog = (
+            "function: f S:s and N:n { result: [count {1, 1, 2} in S] * N }\n"
+            "output [f 4d{1, 1, 2, 3} and d2]"
+        )
+        expected: dict[int, int] = {}
+        for roll in product((1, 1, 2, 3), repeat=4):
+            for n in (1, 2):
+                outcome = sum((1, 1, 2).count(v) for v in roll) * n
+                expected[outcome] = expected.get(outcome, 0) + 1
+        assert run(prog) == [("output 1", H(expected))]
+        # One class each for 1 (counted twice), 2, and 3, times two values of N
+        assert self._combos(prog, "function: f S:s and N:n") == comb(3 + 4 - 1, 4) * 2
+
+    def test_shadowed_builtin_not_reduced(self) -> None:
+        prog = (
+            "function: count V:s in S:s { result: #S }\n"
+            "function: f S:s { result: [count {6} in S] }\n"
+            "output [f 6d6]"
+        )
+        assert run(prog) == [("output 1", H({6: 1}))]
+        assert self._combos(prog, "function: f S:s") == comb(6 + 6 - 1, 6)
+
+    def test_impure_not_reduced(self) -> None:
+        # The body can observe the order of expansion
+        prog = (
+            "function: f S:s { I: I + 1\nresult: [count {6} in S] + I * 0 }\n"
+            "I: 0\n"
+            "output [f 3d6]"
+        )
+        assert run(prog) == [("output 1", self._successes(3, 1, 6))]
+        assert self._combos(prog, "function: f S:s") == comb(6 + 3 - 1, 3)
+
+
 # ---- Regression: H({}) + H({}) propagates under recursion-cap (corpus 0x42f0) ------------
 
 
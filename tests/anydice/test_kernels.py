@@ -0,0 +1,229 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+from importlib.util import find_spec
+from itertools import product
+from math import comb
+
+import pytest
+from dyce import H, P
+
+from anydyce.anydice.interpreter import _OP_FUNCS_H_ITER, _POW_NEG_INF_SENTINEL
+from anydyce.anydice.kernels import (
+    convolve_counts,
+    h_binop_counts,
+    kept_sum_counts,
+    nfold_sum_counts,
+)
+
+__all__ = ()
+
+_requires_numpy = pytest.mark.skipif(
+    find_spec("numpy") is None, reason="requires numpy"
+)
+
+
+def _reference_counts(
+    op: str, left: list[tuple[int, int]], right: list[tuple[int, int]]
+) -> dict[int, int]:
+    result: dict[int, int] = {}
+    for (lo, lw), (ro, rw) in product(left, right):
+        outcome = _OP_FUNCS_H_ITER[op](lo, ro)
+        result[outcome] = result.get(outcome, 0) + lw * rw
+    return result
+
+
+_LEFT = [(o, (o * 7) % 5) for o in range(-20, 21)]
+_RIGHT = [(o, (o * 3) % 4 + 1) for o in range(-12, 13)]
+
+
+@_requires_numpy
+class TestHBinopCounts:
+    @pytest.mark.parametrize("op", sorted(_OP_FUNCS_H_ITER))
+    def test_matches_reference(self, op: str) -> None:
+        counts = h_binop_counts(op, _LEFT, _RIGHT, pow_sentinel=_POW_NEG_INF_SENTINEL)
+        assert counts == _reference_counts(op, _LEFT, _RIGHT)
+
+    def test_pow_sentinel(self) -> None:
+        left = [(o, 1) for o in range(-2, 30)]
+        right = [(o, 1) for o in range(-10, 0)]
+        counts = h_binop_counts("^", left, right, pow_sentinel=_POW_NEG_INF_SENTINEL)
+        assert counts == _reference_counts("^", left, right)
+        assert counts is not None
+        assert counts[_POW_NEG_INF_SENTINEL] == 10
+
+    def test_zero_counts_retained(self) -> None:
+        left = [*((o, 1) for o in range(1, 21)), (23, 0)]
+        right = [(o, 1) for o in range(1, 21)]
+        counts = h_binop_counts("*", left, right, pow_sentinel=_POW_NEG_INF_SENTINEL)
+        assert counts == _reference_counts("*", left, right)
+        assert counts is not None
+        assert counts[23] == 0
+
+    def test_declines_small_grids(self) -> None:
+        assert h_binop_counts("+", [(1, 1)], [(2, 1)], pow_sentinel=0) is None
+
+    @pytest.mark.parametrize(
+        ("op", "left", "right"),
+        [
+            # Counts whose products would overflow int64
+            ("+", [(o, 2**40) for o in range(20)], [(o, 2**40) for o in range(20)]),
+            # Outcomes whose products would overflow int64
+            (
+                "*",
+                [(o * 2**40, 1) for o in range(20)],
+                [(o * 2**40, 1) for o in range(20)],
+            ),
+            # Powers that would overflow int64
+            ("^", [(o, 1) for o in range(20)], [(o, 1) for o in range(20)]),
+            # Dividends too large to truncate exactly as floats
+            ("/", [(2**60 + o, 1) for o in range(20)], [(o, 1) for o in range(20)]),
+        ],
+    )
+    def test_declines_overflow(
+        self, op: str, left: list[tuple[int, int]], right: list[tuple[int, int]]
+    ) -> None:
+        assert h_binop_counts(op, left, right, pow_sentinel=0) is None
+
+
+class TestConvolveCounts:
+    @pytest.mark.parametrize("op", ["+", "-"])
+    def test_matches_reference(self, op: str) -> None:
+        counts = convolve_counts(_LEFT, _RIGHT, subtract=op == "-")
+        assert counts == _reference_counts(op, _LEFT, _RIGHT)
+
+    @pytest.mark.parametrize("op", ["+", "-"])
+    def test_gaps_and_zero_counts(self, op: str) -> None:
+        # Outcomes missing from a die must not appear in the result unless reachable
+        # some other way. Zero-count outcomes must.
+        left = [(o, o % 3) for o in range(40) if o % 5 != 2]
+        right = [(o, 1) for o in range(-30, 0, 2)]
+        counts = convolve_counts(left, right, subtract=op == "-")
+        assert counts == _reference_counts(op, left, right)
+        assert counts is not None
+        assert 0 in counts.values()
+
+    def test_huge_counts(self) -> None:
+        left = [(o, 7**o) for o in range(1, 61)]
+        right = [(o, 3 ** (60 - o)) for o in range(-60, 0)]
+        counts = convolve_counts(left, right, subtract=False)
+        assert counts == _reference_counts("+", left, right)
+
+    def test_without_numpy(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr("anydyce.anydice.kernels._HAS_NUMPY", False)
+        counts = convolve_counts(_LEFT, _RIGHT, subtract=False, fft=True)
+        assert counts == _reference_counts("+", _LEFT, _RIGHT)
+
+    def test_declines_sparse(self) -> None:
+        left = [(o * 10, 1) for o in range(30)]
+        right = [(o, 1) for o in range(30)]
+        assert convolve_counts(left, right, subtract=False) is None
+
+    def test_declines_small(self) -> None:
+        assert convolve_counts([(1, 1), (2, 1)], [(1, 1)], subtract=False) is None
+
+    @_requires_numpy
+    def test_fft_approximates(self) -> None:
+        left = [(o, 1 if o % 7 else 0) for o in range(1, 101)]
+        right = [(o, o) for o in range(1, 51)]
+        exact = _reference_counts("+", left, right)
+        approx = convolve_counts(left, right, subtract=False, fft=True)
+        assert approx is not None
+        assert approx.keys() == exact.keys()
+        exact_total = sum(exact.values())
+        approx_total = sum(approx.values())
+        for outcome, count in exact.items():
+            assert approx[outcome] / approx_total == pytest.approx(
+                count / exact_total, rel=1e-9, abs=1e-15
+            )
+
+    @_requires_numpy
+    @pytest.mark.parametrize(
+        ("left_h", "right_h"),
+        [
+            (30 @ H(20), 20 @ H(30)),
+            (4 @ H(6), 3 @ H(100)),
+            (H(200), 2 @ H(60)),
+        ],
+    )
+    def test_fft_tails_accurate(self, left_h: H, right_h: H) -> None:
+        # Every count (including the tiny ones in the tails) must be right
+        # relative to itself, not just relative to the biggest count
+        left = sorted(left_h.items())
+        right = sorted(right_h.items())
+        exact = _reference_counts("+", left, right)
+        approx = convolve_counts(left, right, subtract=False, fft=True)
+        assert approx is not None
+        assert approx.keys() == exact.keys()
+        mode = max(exact, key=exact.__getitem__)
+        scale = approx[mode] / exact[mode]
+        for outcome, count in exact.items():
+            assert approx[outcome] / scale == pytest.approx(count, rel=1e-6)
+            assert (approx[outcome] == 0) == (count == 0)
+
+
+class TestNfoldSumCounts:
+    @pytest.mark.parametrize("n", [4, 7, 16, 25])
+    def test_matches_repeated_addition(self, n: int) -> None:
+        items = [(-2, 1), (0, 3), (1, 2), (3, 5)]
+        counts = nfold_sum_counts(items, n)
+        assert counts is not None
+        assert tuple(H(counts).items()) == tuple((H(dict(items)) @ n).items())
+
+    def test_huge_counts(self) -> None:
+        items = [(o, 2**70 + o) for o in range(1, 21)]
+        counts = nfold_sum_counts(items, 5)
+        assert counts is not None
+        assert tuple(H(counts).items()) == tuple((H(dict(items)) @ 5).items())
+
+    def test_without_numpy(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr("anydyce.anydice.kernels._HAS_NUMPY", False)
+        counts = nfold_sum_counts([(o, 1) for o in range(1, 11)], 12)
+        assert counts is not None
+        assert tuple(H(counts).items()) == tuple((H(10) @ 12).items())
+
+    def test_declines(self) -> None:
+        assert nfold_sum_counts([(o, 1) for o in range(1, 7)], 1) is None
+        assert nfold_sum_counts([(1, 1), (2, 1)], 3) is None
+        assert nfold_sum_counts([(1, 1), (50, 1), (100, 1)], 20) is None
+
+
+class TestKeptSumCounts:
+    @pytest.mark.parametrize("k", [1, 2, 5, 7])
+    def test_matches_selection(self, k: int) -> None:
+        items = [(-2, 1), (0, 3), (1, 2), (3, 5)]
+        pool = k @ P(H(dict(items)))
+        for lo in range(k):
+            for hi in range(lo + 1, k + 1):
+                counts = kept_sum_counts(items, k, lo, hi)
+                assert counts is not None
+                expected = pool.h(*(slice(i, i + 1) for i in range(lo, hi)))
+                assert tuple(H(counts).items()) == tuple(expected.items())
+
+    def test_large_pool(self) -> None:
+        # The highest 3 of 20d20
+        counts = kept_sum_counts([(o, 1) for o in range(1, 21)], 20, 17, 20)
+        assert counts is not None
+        assert sum(counts.values()) == 20**20
+        assert counts[3] == 1
+        # At least three 20s
+        assert counts[60] == 20**20 - sum(
+            comb(20, j) * 19 ** (20 - j) for j in range(3)
+        )
+
+    def test_declines(self) -> None:
+        assert kept_sum_counts([], 3, 0, 1) is None
+        assert kept_sum_counts([(1, 1), (2, 1)], 3, 1, 1) is None
+        assert kept_sum_counts([(1, 1), (2, 1)], 3, 2, 4) is None
@@ -13,9 +13,15 @@
 # (This does not apply to code comments.) Thank you!
 # ======================================================================================
 
+import os
+from collections.abc import Iterator
+from dataclasses import FrozenInstanceError
+from pathlib import Path
+
 import pytest
 from lark import UnexpectedInput
 
+from anydyce import anydice
 from anydyce.anydice import parse
 from anydyce.anydice.ast_ import (
     BinOp,
@@ -58,36 +64,36 @@ class TestUnaryPrecedence:
     def test_hash_of_dice_unary(self) -> None:
         # #d6 -> #(d6)
         # AnyDice: produces 1  (count of outcomes in one die)
-        assert parse("output #d6").stmts == [
-            OutputStmt(expr=HashOp(DiceUnary(Number(6))))
-        ]
+        assert parse("output #d6").stmts == (
+            OutputStmt(expr=HashOp(DiceUnary(Number(6)))),
+        )
 
     def test_hash_of_not(self) -> None:
         # #!1 -> #(!1)
         # AnyDice: produces 1  (!1 = 0 scalar, #0 = 1)
-        assert parse("output #!1").stmts == [OutputStmt(expr=HashOp(NotOp(Number(1))))]
+        assert parse("output #!1").stmts == (OutputStmt(expr=HashOp(NotOp(Number(1)))),)
 
     def test_not_of_hash(self) -> None:
         # !#1 -> !(#1)
         # AnyDice: produces 0  (#1 = 1, !1 = 0)
-        assert parse("output !#1").stmts == [OutputStmt(expr=NotOp(HashOp(Number(1))))]
+        assert parse("output !#1").stmts == (OutputStmt(expr=NotOp(HashOp(Number(1)))),)
 
     def test_hash_number_then_binary_d(self) -> None:
         # #3d6 -> (#3)d6
         # AnyDice: identical to "output 1d6"  (#3 = 1, so 1d6)
-        assert parse("output #3d6").stmts == [
-            OutputStmt(expr=DiceBinOp(n=HashOp(Number(3)), faces=Number(6)))
-        ]
+        assert parse("output #3d6").stmts == (
+            OutputStmt(expr=DiceBinOp(n=HashOp(Number(3)), faces=Number(6))),
+        )
 
     def test_neg_of_dice_unary(self) -> None:
         # -d6 -> -(d6)
-        assert parse("output -d6").stmts == [
-            OutputStmt(expr=NegOp(DiceUnary(Number(6))))
-        ]
+        assert parse("output -d6").stmts == (
+            OutputStmt(expr=NegOp(DiceUnary(Number(6)))),
+        )
 
     def test_neg_of_hash(self) -> None:
         # -#1 -> -(#1)
-        assert parse("output -#1").stmts == [OutputStmt(expr=NegOp(HashOp(Number(1))))]
+        assert parse("output -#1").stmts == (OutputStmt(expr=NegOp(HashOp(Number(1)))),)
 
 
 # ---- Operator precedence - logical & and | -------------------------------------------
@@ -100,16 +106,16 @@ class TestLogicalPrecedence:
         # `1 | 1 & 0` must parse as `(1 | 1) & 0`, which evaluates to 0.
         # (Verified against AnyDice's calculator.)
         # NOT C-style `1 | (1 & 0) = 1`.
-        assert parse("output 1 | 1 & 0").stmts == [
-            OutputStmt(expr=BinOp("&", BinOp("|", Number(1), Number(1)), Number(0)))
-        ]
+        assert parse("output 1 | 1 & 0").stmts == (
+            OutputStmt(expr=BinOp("&", BinOp("|", Number(1), Number(1)), Number(0))),
+        )
 
     def test_or_after_and_same_precedence_left_associative(self) -> None:
         # `1 & 0 | 1` parses as `(1 & 0) | 1` (same answer under either model
         # because of left-assoc, but the AST shape differs).
-        assert parse("output 1 & 0 | 1").stmts == [
-            OutputStmt(expr=BinOp("|", BinOp("&", Number(1), Number(0)), Number(1)))
-        ]
+        assert parse("output 1 & 0 | 1").stmts == (
+            OutputStmt(expr=BinOp("|", BinOp("&", Number(1), Number(0)), Number(1))),
+        )
 
 
 # ---- Lexer: case-change token boundaries ---------------------------------------------
@@ -132,33 +138,33 @@ class TestCaseChangeTokenBarrier:
     def test_function_param_underscore_between_lowercase_words(self) -> None:
         # `test_name` -> ["test", UPPERNAME("_"), "name"], so the function
         # signature is [word("test"), param(name="_"), word("name")].
-        assert parse("function: test_name { result: _ }").stmts == [
+        assert parse("function: test_name { result: _ }").stmts == (
             FunctionDef(
-                pattern=["test", Param(name="_", type=None), "name"],
-                body=[ResultStmt(expr=Var("_"))],
-            )
-        ]
+                pattern=("test", Param(name="_", type=None), "name"),
+                body=(ResultStmt(expr=Var("_")),),
+            ),
+        )
 
     def test_function_param_mixed_case_between_lowercase_words(self) -> None:
         # `testVARname` -> ["test", UPPERNAME("VAR"), "name"].
-        assert parse("function: testVARname { result: VAR }").stmts == [
+        assert parse("function: testVARname { result: VAR }").stmts == (
             FunctionDef(
-                pattern=["test", Param(name="VAR", type=None), "name"],
-                body=[ResultStmt(expr=Var("VAR"))],
-            )
-        ]
+                pattern=("test", Param(name="VAR", type=None), "name"),
+                body=(ResultStmt(expr=Var("VAR")),),
+            ),
+        )
 
     def test_uppername_greedy_through_trailing_underscore(self) -> None:
         # `_NAME_` is a single UPPERNAME (no case change inside since `_` is
         # in the uppercase class). `_NAME_name` would split as
         # UPPERNAME("_NAME_") + LOWERNAME("name") because of the case
         # transition between `_` and `n`.
-        assert parse("function: TEST_NAME_name { result: TEST_NAME_ }").stmts == [
+        assert parse("function: TEST_NAME_name { result: TEST_NAME_ }").stmts == (
             FunctionDef(
-                pattern=[Param(name="TEST_NAME_", type=None), "name"],
-                body=[ResultStmt(expr=Var("TEST_NAME_"))],
-            )
-        ]
+                pattern=(Param(name="TEST_NAME_", type=None), "name"),
+                body=(ResultStmt(expr=Var("TEST_NAME_")),),
+            ),
+        )
 
 
 # ---- Operator precedence - power -----------------------------------------------------
@@ -172,9 +178,9 @@ class TestPowerAssociativity:
         # from common convention. Our grammar's `pow_expr` is left-recursive,
         # matching AnyDice. Lock that in with a parse-shape test so we don't
         # accidentally flip it later.
-        assert parse("output 2^3^2").stmts == [
-            OutputStmt(expr=BinOp("^", BinOp("^", Number(2), Number(3)), Number(2)))
-        ]
+        assert parse("output 2^3^2").stmts == (
+            OutputStmt(expr=BinOp("^", BinOp("^", Number(2), Number(3)), Number(2))),
+        )
 
 
 # ---- STRING is not a value type ------------------------------------------------------
@@ -219,26 +225,26 @@ class TestStringNotAValue:
 
     def test_output_named_string_still_parses(self) -> None:
         # Smoke test: the legitimate `output X named "..."` form still works.
-        assert parse('output 1 named "label"').stmts == [
-            OutputStmt(expr=Number(1), name=StringExpr(parts=[StrLit("label")]))
-        ]
+        assert parse('output 1 named "label"').stmts == (
+            OutputStmt(expr=Number(1), name=StringExpr(parts=(StrLit("label"),))),
+        )
 
     def test_set_to_string_still_parses(self) -> None:
         # Smoke test: `set "x" to "y"` is the canonical AnyDice form for
         # string-valued settings.
-        assert parse('set "position order" to "highest first"').stmts == [
+        assert parse('set "position order" to "highest first"').stmts == (
             SetStmt(
                 key="position order",
-                value=StringExpr(parts=[StrLit("highest first")]),
-            )
-        ]
+                value=StringExpr(parts=(StrLit("highest first"),)),
+            ),
+        )
 
     def test_set_to_expr_still_parses(self) -> None:
         # Smoke test: `set "x" to <number>` and arbitrary expressions remain
         # valid (per user's empirical probe with `set "max ..." to (2@{1..3})`).
-        assert parse('set "maximum function depth" to 5').stmts == [
-            SetStmt(key="maximum function depth", value=Number(5))
-        ]
+        assert parse('set "maximum function depth" to 5').stmts == (
+            SetStmt(key="maximum function depth", value=Number(5)),
+        )
 
 
 # ---- Dice operator -------------------------------------------------------------------
@@ -246,36 +252,38 @@ class TestStringNotAValue:
 
 class TestDiceOperator:
     def test_binary_d(self) -> None:
-        assert parse("output 2d6").stmts == [
-            OutputStmt(expr=DiceBinOp(n=Number(2), faces=Number(6)))
-        ]
+        assert parse("output 2d6").stmts == (
+            OutputStmt(expr=DiceBinOp(n=Number(2), faces=Number(6))),
+        )
 
     def test_unary_d(self) -> None:
-        assert parse("output d6").stmts == [OutputStmt(expr=DiceUnary(faces=Number(6)))]
+        assert parse("output d6").stmts == (
+            OutputStmt(expr=DiceUnary(faces=Number(6))),
+        )
 
     def test_binary_d_parenthesized_n(self) -> None:
         # (1+1) binds as a unit before d; sister of test_unparse.py::test_dice_binop_lower_prec_n_needs_parens
-        assert parse("output (1+1)d6").stmts == [
+        assert parse("output (1+1)d6").stmts == (
             OutputStmt(
                 expr=DiceBinOp(n=BinOp("+", Number(1), Number(1)), faces=Number(6))
-            )
-        ]
+            ),
+        )
 
     def test_binary_d_right_operand_is_seq(self) -> None:
-        assert parse("output 1d{1,2,3}").stmts == [
+        assert parse("output 1d{1,2,3}").stmts == (
             OutputStmt(
                 expr=DiceBinOp(
                     n=Number(1),
                     faces=SeqExpr(
-                        elems=[
+                        elems=(
                             ValueElem(Number(1)),
                             ValueElem(Number(2)),
                             ValueElem(Number(3)),
-                        ]
+                        )
                     ),
                 )
-            )
-        ]
+            ),
+        )
 
 
 # ---- Sequences -----------------------------------------------------------------------
@@ -283,99 +291,99 @@ class TestDiceOperator:
 
 class TestSequences:
     def test_empty_seq(self) -> None:
-        assert parse("output {}").stmts == [OutputStmt(expr=EmptySeq())]
+        assert parse("output {}").stmts == (OutputStmt(expr=EmptySeq()),)
 
     def test_value_list(self) -> None:
-        assert parse("output {1,2,3}").stmts == [
+        assert parse("output {1,2,3}").stmts == (
             OutputStmt(
                 expr=SeqExpr(
-                    elems=[
+                    elems=(
                         ValueElem(Number(1)),
                         ValueElem(Number(2)),
                         ValueElem(Number(3)),
-                    ]
+                    )
                 )
-            )
-        ]
+            ),
+        )
 
     def test_range(self) -> None:
-        assert parse("output {1..3}").stmts == [
-            OutputStmt(expr=SeqExpr(elems=[RangeElem(Number(1), Number(3))]))
-        ]
+        assert parse("output {1..3}").stmts == (
+            OutputStmt(expr=SeqExpr(elems=(RangeElem(Number(1), Number(3)),))),
+        )
 
     def test_range_repeat(self) -> None:
-        assert parse("output {1..3:2}").stmts == [
+        assert parse("output {1..3:2}").stmts == (
             OutputStmt(
-                expr=SeqExpr(elems=[RangeRepeatElem(Number(1), Number(3), Number(2))])
-            )
-        ]
+                expr=SeqExpr(elems=(RangeRepeatElem(Number(1), Number(3), Number(2)),))
+            ),
+        )
 
     def test_range_with_whitespace_between_dots(self) -> None:
         # AnyDice's "smart tokenizer" allows whitespace between the two dots
         # of the `..` range operator. Verified empirically against AnyDice.
-        expected_range = [
-            OutputStmt(expr=SeqExpr(elems=[RangeElem(Number(2), Number(3))]))
-        ]
+        expected_range = (
+            OutputStmt(expr=SeqExpr(elems=(RangeElem(Number(2), Number(3)),))),
+        )
         assert parse("output {2..3}").stmts == expected_range
         assert parse("output {2. .3}").stmts == expected_range
         assert parse("output {2 . . 3}").stmts == expected_range
         assert parse("output {2.  .3}").stmts == expected_range
 
-        expected_range_repeat = [
+        expected_range_repeat = (
             OutputStmt(
-                expr=SeqExpr(elems=[RangeRepeatElem(Number(2), Number(3), Number(4))])
-            )
-        ]
+                expr=SeqExpr(elems=(RangeRepeatElem(Number(2), Number(3), Number(4)),))
+            ),
+        )
         assert parse("output {2..3:4}").stmts == expected_range_repeat
         assert parse("output {2 . . 3 : 4}").stmts == expected_range_repeat
 
     def test_value_repeat(self) -> None:
-        assert parse("output {1:4}").stmts == [
-            OutputStmt(expr=SeqExpr(elems=[ValueRepeatElem(Number(1), Number(4))]))
-        ]
+        assert parse("output {1:4}").stmts == (
+            OutputStmt(expr=SeqExpr(elems=(ValueRepeatElem(Number(1), Number(4)),))),
+        )
 
     def test_mixed_seq_elems(self) -> None:
-        assert parse("output {1..3, 5:2, 7}").stmts == [
+        assert parse("output {1..3, 5:2, 7}").stmts == (
             OutputStmt(
                 expr=SeqExpr(
-                    elems=[
+                    elems=(
                         RangeElem(Number(1), Number(3)),
                         ValueRepeatElem(Number(5), Number(2)),
                         ValueElem(Number(7)),
-                    ]
+                    )
                 )
-            )
-        ]
+            ),
+        )
 
     def test_nested_seq(self) -> None:
         # Three levels of nesting, all element types present at each level
-        assert parse("output {1..3, {4, 5:2, 6..8, {9:3, 10..12}}, 13}").stmts == [
+        assert parse("output {1..3, {4, 5:2, 6..8, {9:3, 10..12}}, 13}").stmts == (
             OutputStmt(
                 expr=SeqExpr(
-                    elems=[
+                    elems=(
                         RangeElem(Number(1), Number(3)),
                         ValueElem(
                             SeqExpr(
-                                elems=[
+                                elems=(
                                     ValueElem(Number(4)),
                                     ValueRepeatElem(Number(5), Number(2)),
                                     RangeElem(Number(6), Number(8)),
                                     ValueElem(
                                         SeqExpr(
-                                            elems=[
+                                            elems=(
                                                 ValueRepeatElem(Number(9), Number(3)),
                                                 RangeElem(Number(10), Number(12)),
-                                            ]
+                                            )
                                         )
                                     ),
-                                ]
+                                )
                             )
                         ),
                         ValueElem(Number(13)),
-                    ]
+                    )
                 )
-            )
-        ]
+            ),
+        )
 
 
 # ---- Statements ----------------------------------------------------------------------
@@ -383,25 +391,25 @@ class TestSequences:
 
 class TestStatements:
     def test_output_anon(self) -> None:
-        assert parse("output 1").stmts == [OutputStmt(expr=Number(1), name=None)]
+        assert parse("output 1").stmts == (OutputStmt(expr=Number(1), name=None),)
 
     def test_output_named(self) -> None:
-        assert parse('output 1 named "one"').stmts == [
-            OutputStmt(expr=Number(1), name=StringExpr([StrLit("one")]))
-        ]
+        assert parse('output 1 named "one"').stmts == (
+            OutputStmt(expr=Number(1), name=StringExpr((StrLit("one"),))),
+        )
 
     def test_var_assign(self) -> None:
-        assert parse("X: 3").stmts == [VarAssign(name="X", expr=Number(3))]
+        assert parse("X: 3").stmts == (VarAssign(name="X", expr=Number(3)),)
 
     def test_set_stmt(self) -> None:
-        assert parse('set "order" to "lowest first"').stmts == [
-            SetStmt(key="order", value=StringExpr([StrLit("lowest first")]))
-        ]
+        assert parse('set "order" to "lowest first"').stmts == (
+            SetStmt(key="order", value=StringExpr((StrLit("lowest first"),))),
+        )
 
     def test_set_stmt_numeric_value(self) -> None:
-        assert parse('set "maximum function depth" to 10').stmts == [
-            SetStmt(key="maximum function depth", value=Number(10))
-        ]
+        assert parse('set "maximum function depth" to 10').stmts == (
+            SetStmt(key="maximum function depth", value=Number(10)),
+        )
 
     def test_result_stmt_only_in_function_body(self) -> None:
         # "result: X" at top level should be a parse error
@@ -439,63 +447,63 @@ class TestStatements:
 
 class TestFunctionDef:
     def test_simple_function(self) -> None:
-        assert parse("function: double X { result: X + X }").stmts == [
+        assert parse("function: double X { result: X + X }").stmts == (
             FunctionDef(
-                pattern=["double", Param("X", None)],
-                body=[ResultStmt(BinOp("+", Var("X"), Var("X")))],
-            )
-        ]
+                pattern=("double", Param("X", None)),
+                body=(ResultStmt(BinOp("+", Var("X"), Var("X"))),),
+            ),
+        )
 
     def test_typed_param(self) -> None:
-        assert parse("function: roll X:d { result: X }").stmts == [
+        assert parse("function: roll X:d { result: X }").stmts == (
             FunctionDef(
-                pattern=["roll", Param("X", "d")],
-                body=[ResultStmt(Var("X"))],
-            )
-        ]
+                pattern=("roll", Param("X", "d")),
+                body=(ResultStmt(Var("X")),),
+            ),
+        )
 
     def test_zero_word_function(self) -> None:
         # AnyDice allows functions that are pure params with no keyword words
-        assert parse("function: X:n Y:n { result: X + Y }").stmts == [
+        assert parse("function: X:n Y:n { result: X + Y }").stmts == (
             FunctionDef(
-                pattern=[Param("X", "n"), Param("Y", "n")],
-                body=[ResultStmt(BinOp("+", Var("X"), Var("Y")))],
-            )
-        ]
+                pattern=(Param("X", "n"), Param("Y", "n")),
+                body=(ResultStmt(BinOp("+", Var("X"), Var("Y"))),),
+            ),
+        )
 
     def test_zero_word_bare_param_function(self) -> None:
-        assert parse("function: X Y { result: X + Y }").stmts == [
+        assert parse("function: X Y { result: X + Y }").stmts == (
             FunctionDef(
-                pattern=[Param("X", None), Param("Y", None)],
-                body=[ResultStmt(BinOp("+", Var("X"), Var("Y")))],
-            )
-        ]
+                pattern=(Param("X", None), Param("Y", None)),
+                body=(ResultStmt(BinOp("+", Var("X"), Var("Y"))),),
+            ),
+        )
 
     def test_single_word_no_param_function(self) -> None:
-        assert parse("function: attack { result: 1 }").stmts == [
+        assert parse("function: attack { result: 1 }").stmts == (
             FunctionDef(
-                pattern=["attack"],
-                body=[ResultStmt(Number(1))],
-            )
-        ]
+                pattern=("attack",),
+                body=(ResultStmt(Number(1)),),
+            ),
+        )
 
     def test_d_as_function_word(self) -> None:
         # "d" is a valid word in a function name pattern
-        assert parse("function: A d B { result: BdA }").stmts == [
+        assert parse("function: A d B { result: BdA }").stmts == (
             FunctionDef(
-                pattern=[Param("A", None), "d", Param("B", None)],
-                body=[ResultStmt(DiceBinOp(Var("B"), Var("A")))],
-            )
-        ]
+                pattern=(Param("A", None), "d", Param("B", None)),
+                body=(ResultStmt(DiceBinOp(Var("B"), Var("A"))),),
+            ),
+        )
 
     def test_d_in_call_is_binary_dice(self) -> None:
         # In a call expression, "d" is always the binary dice operator, never a word. [4
         # d 6] parses as [4d6]. A single-argument call with DiceBinOp(4, 6). This means
         # a function defined as "function: A d B" cannot be called as [4 d 6]. The call
         # must be written as [4d6] instead, and the interpreter matches on arity.
-        assert parse("output [4 d 6]").stmts == [
-            OutputStmt(expr=Call(parts=[DiceBinOp(Number(4), Number(6))]))
-        ]
+        assert parse("output [4 d 6]").stmts == (
+            OutputStmt(expr=Call(parts=(DiceBinOp(Number(4), Number(6)),))),
+        )
 
 
 # ---- Control flow --------------------------------------------------------------------
@@ -503,40 +511,40 @@ class TestFunctionDef:
 
 class TestControlFlow:
     def test_loop_stmt(self) -> None:
-        assert parse("loop X over {1..3} { output X }").stmts == [
+        assert parse("loop X over {1..3} { output X }").stmts == (
             LoopStmt(
                 var="X",
-                over=SeqExpr([RangeElem(Number(1), Number(3))]),
-                body=[OutputStmt(Var("X"))],
-            )
-        ]
+                over=SeqExpr((RangeElem(Number(1), Number(3)),)),
+                body=(OutputStmt(Var("X")),),
+            ),
+        )
 
     def test_if_stmt(self) -> None:
-        assert parse("if 1 { output 2 }").stmts == [
+        assert parse("if 1 { output 2 }").stmts == (
             IfStmt(
-                branches=[IfBranch(Number(1), [OutputStmt(Number(2))])],
+                branches=(IfBranch(Number(1), (OutputStmt(Number(2)),)),),
                 else_branch=None,
-            )
-        ]
+            ),
+        )
 
     def test_if_else(self) -> None:
-        assert parse("if 1 { output 2 } else { output 3 }").stmts == [
+        assert parse("if 1 { output 2 } else { output 3 }").stmts == (
             IfStmt(
-                branches=[IfBranch(Number(1), [OutputStmt(Number(2))])],
-                else_branch=ElseBranch([OutputStmt(Number(3))]),
-            )
-        ]
+                branches=(IfBranch(Number(1), (OutputStmt(Number(2)),)),),
+                else_branch=ElseBranch((OutputStmt(Number(3)),)),
+            ),
+        )
 
     def test_if_elseif(self) -> None:
-        assert parse("if 1 { output 2 } else if 3 { output 4 }").stmts == [
+        assert parse("if 1 { output 2 } else if 3 { output 4 }").stmts == (
             IfStmt(
-                branches=[
-                    IfBranch(Number(1), [OutputStmt(Number(2))]),
-                    IfBranch(Number(3), [OutputStmt(Number(4))]),
-                ],
+                branches=(
+                    IfBranch(Number(1), (OutputStmt(Number(2)),)),
+                    IfBranch(Number(3), (OutputStmt(Number(4)),)),
+                ),
                 else_branch=None,
-            )
-        ]
+            ),
+        )
 
 
 # ---- String interpolation ------------------------------------------------------------
@@ -544,19 +552,19 @@ class TestControlFlow:
 
 class TestStringInterpolation:
     def test_plain_string(self) -> None:
-        assert parse('output 1 named "hello"').stmts == [
-            OutputStmt(Number(1), name=StringExpr([StrLit("hello")]))
-        ]
+        assert parse('output 1 named "hello"').stmts == (
+            OutputStmt(Number(1), name=StringExpr((StrLit("hello"),))),
+        )
 
     def test_interpolated_string(self) -> None:
-        assert parse('output 1 named "roll [X]"').stmts == [
-            OutputStmt(Number(1), name=StringExpr([StrLit("roll "), StrVar("X")]))
-        ]
+        assert parse('output 1 named "roll [X]"').stmts == (
+            OutputStmt(Number(1), name=StringExpr((StrLit("roll "), StrVar("X")))),
+        )
 
     def test_string_only_var(self) -> None:
-        assert parse('output 1 named "[X]"').stmts == [
-            OutputStmt(Number(1), name=StringExpr([StrVar("X")]))
-        ]
+        assert parse('output 1 named "[X]"').stmts == (
+            OutputStmt(Number(1), name=StringExpr((StrVar("X"),))),
+        )
 
 
 # ---- Binary operators ----------------------------------------------------------------
@@ -564,40 +572,146 @@ class TestStringInterpolation:
 
 class TestBinaryOps:
     def test_add(self) -> None:
-        assert parse("output 1 + 2").stmts == [
-            OutputStmt(BinOp("+", Number(1), Number(2)))
-        ]
+        assert parse("output 1 + 2").stmts == (
+            OutputStmt(BinOp("+", Number(1), Number(2))),
+        )
 
     def test_left_assoc_grouping(self) -> None:
         # 1 - 2 - 3 -> (1-2) - 3; sister of test_unparse.py::test_left_assoc_same_op_no_extra_parens
-        assert parse("output 1 - 2 - 3").stmts == [
-            OutputStmt(BinOp("-", BinOp("-", Number(1), Number(2)), Number(3)))
-        ]
+        assert parse("output 1 - 2 - 3").stmts == (
+            OutputStmt(BinOp("-", BinOp("-", Number(1), Number(2)), Number(3))),
+        )
 
     def test_right_assoc_explicit_parens(self) -> None:
         # 1 - (2-3) is a distinct grouping from (1-2)-3; sister of test_unparse.py::test_right_same_op_needs_parens
-        assert parse("output 1 - (2 - 3)").stmts == [
-            OutputStmt(BinOp("-", Number(1), BinOp("-", Number(2), Number(3))))
-        ]
+        assert parse("output 1 - (2 - 3)").stmts == (
+            OutputStmt(BinOp("-", Number(1), BinOp("-", Number(2), Number(3)))),
+        )
 
     def test_lower_prec_in_mul_needs_explicit_parens(self) -> None:
         # (1+2)*3 groups the add first; sister of test_unparse.py::test_lower_prec_left_child_needs_parens
-        assert parse("output (1 + 2) * 3").stmts == [
-            OutputStmt(BinOp("*", BinOp("+", Number(1), Number(2)), Number(3)))
-        ]
+        assert parse("output (1 + 2) * 3").stmts == (
+            OutputStmt(BinOp("*", BinOp("+", Number(1), Number(2)), Number(3))),
+        )
 
     def test_precedence_mul_over_add(self) -> None:
         # 1 + 2 * 3 -> 1 + (2 * 3)
-        assert parse("output 1 + 2 * 3").stmts == [
-            OutputStmt(BinOp("+", Number(1), BinOp("*", Number(2), Number(3))))
-        ]
+        assert parse("output 1 + 2 * 3").stmts == (
+            OutputStmt(BinOp("+", Number(1), BinOp("*", Number(2), Number(3)))),
+        )
 
     def test_at_operator(self) -> None:
-        assert parse("output 2@d6").stmts == [
-            OutputStmt(BinOp("@", Number(2), DiceUnary(Number(6))))
-        ]
+        assert parse("output 2@d6").stmts == (
+            OutputStmt(BinOp("@", Number(2), DiceUnary(Number(6)))),
+        )
 
     def test_comparison(self) -> None:
-        assert parse("output 1 = 1").stmts == [
-            OutputStmt(BinOp("=", Number(1), Number(1)))
-        ]
+        assert parse("output 1 = 1").stmts == (
+            OutputStmt(BinOp("=", Number(1), Number(1))),
+        )
+
+
+# ---- AST nodes ---------------------------------------------------------------------------
+
+
+class TestNodes:
+    def test_nodes_are_immutable(self) -> None:
+        (stmt,) = parse("output 1").stmts
+        with pytest.raises(FrozenInstanceError):
+            stmt.expr = Number(2)  # type: ignore[misc]
+        assert not hasattr(stmt, "__dict__")
+
+    def test_nodes_are_hashable(self) -> None:
+        first = parse("output 1d6 + {1..3}", parse_cache=None)
+        second = parse("output 1d6 + {1..3}", parse_cache=None)
+        assert first is not second
+        assert {first: "x"}[second] == "x"
+
+    def test_identical_subtrees_are_shared(self) -> None:
+        (stmt,) = parse("output 2d6 + 2d6", parse_cache=None).stmts
+        assert isinstance(stmt.expr, BinOp)
+        assert stmt.expr.left is stmt.expr.right
+        (first, second) = parse(
+            "function: f X:n { result: X }\nfunction: g X:n { result: X }",
+            parse_cache=None,
+        ).stmts
+        assert isinstance(first, FunctionDef)
+        assert isinstance(second, FunctionDef)
+        assert first.body[0] is second.body[0]
+
+    def test_deeply_nested_expression(self) -> None:
+        # Interning must not hash (or compare) whole subtrees
+        (stmt,) = parse("output " + " + ".join(["d6"] * 3000), parse_cache=None).stmts
+        assert isinstance(stmt, OutputStmt)
+        expr = stmt.expr
+        depth = 0
+        while isinstance(expr, BinOp):
+            assert expr.right is stmt.expr.right
+            expr = expr.left
+            depth += 1
+        assert depth == 2999
+        assert expr is stmt.expr.right
+
+
+# ---- Parser construction -----------------------------------------------------------------
+
+_parser = anydice._parser  # ruff: ignore[private-member-access]
+
+
+class TestParserCache:
+    @pytest.fixture
+    def cache_dir(
+        self, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> Iterator[Path]:
+        cache_dir = tmp_path / "cache" / "anydyce"
+        monkeypatch.setattr(anydice, "_cache_dir", lambda: cache_dir)
+        _parser.cache_clear()
+        yield cache_dir
+        _parser.cache_clear()
+
+    @pytest.mark.usefixtures("cache_dir")
+    def test_parser_constructed_once(self) -> None:
+        assert _parser.cache_info().currsize == 0
+        parse("output 1", parse_cache=None)
+        parse("output 2", parse_cache=None)
+        assert _parser.cache_info().currsize == 1
+        assert _parser() is _parser()
+
+    def test_tables_cached_on_disk(self, cache_dir: Path) -> None:
+        assert parse("output 1d6", parse_cache=None).stmts == (
+            OutputStmt(DiceBinOp(Number(1), Number(6))),
+        )
+        (cache_file,) = cache_dir.iterdir()
+        # A later process loads the cached tables rather than regenerating them
+        _parser.cache_clear()
+        mtime = cache_file.stat().st_mtime_ns
+        assert parse("output 2d6", parse_cache=None).stmts == (
+            OutputStmt(DiceBinOp(Number(2), Number(6))),
+        )
+        assert list(cache_dir.iterdir()) == [cache_file]
+        assert cache_file.stat().st_mtime_ns == mtime
+
+    def test_corrupt_cache_regenerated(self, cache_dir: Path) -> None:
+        parse("output 1", parse_cache=None)
+        (cache_file,) = cache_dir.iterdir()
+        cache_file.write_bytes(b"garbage")
+        _parser.cache_clear()
+        assert parse("output 3", parse_cache=None).stmts == (OutputStmt(Number(3)),)
+
+    @pytest.mark.skipif(
+        os.name == "nt" or os.geteuid() == 0,
+        reason="directory permissions are not enforced",
+    )
+    def test_unwritable_cache_dir_skips_cache(self, cache_dir: Path) -> None:
+        cache_dir.mkdir(parents=True)
+        cache_dir.chmod(0o500)
+        try:
+            assert parse("output 4", parse_cache=None).stmts == (OutputStmt(Number(4)),)
+            assert list(cache_dir.iterdir()) == []
+        finally:
+            cache_dir.chmod(0o700)
+
+    def test_uncreatable_cache_dir_skips_cache(self, cache_dir: Path) -> None:
+        # A file where the cache directory's parent should be
+        cache_dir.parent.write_text("")
+        assert parse("output 5", parse_cache=None).stmts == (OutputStmt(Number(5)),)
@@ -0,0 +1,144 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+from pathlib import Path
+
+import pytest
+from dyce import H
+
+from anydyce import anydice
+from anydyce.anydice import ParseCache, parse, run
+from anydyce.anydice.ast_ import Number, OutputStmt
+
+__all__ = ()
+
+
+class TestParseCache:
+    def test_hit_returns_stored_program(self) -> None:
+        parse_cache = ParseCache()
+        first = parse("output 1", parse_cache=parse_cache)
+        assert parse("output 1", parse_cache=parse_cache) is first
+        assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+
+    def test_least_recently_used_evicted(self) -> None:
+        parse_cache = ParseCache(maxsize=2)
+        parse("output 1", parse_cache=parse_cache)
+        parse("output 2", parse_cache=parse_cache)
+        parse("output 1", parse_cache=parse_cache)
+        parse("output 3", parse_cache=parse_cache)  # evicts "output 2"
+        assert len(parse_cache) == 2
+        parse("output 1", parse_cache=parse_cache)
+        assert parse_cache.hits == 2
+        parse("output 2", parse_cache=parse_cache)
+        assert (parse_cache.hits, parse_cache.misses) == (2, 4)
+
+    def test_zero_maxsize_keeps_nothing(self) -> None:
+        parse_cache = ParseCache(maxsize=0)
+        parse("output 1", parse_cache=parse_cache)
+        assert parse("output 1", parse_cache=parse_cache).stmts == (
+            OutputStmt(Number(1)),
+        )
+        assert len(parse_cache) == 0
+        assert (parse_cache.hits, parse_cache.misses) == (0, 2)
+
+    def test_negative_maxsize(self) -> None:
+        with pytest.raises(ValueError, match=r"non-negative"):
+            ParseCache(maxsize=-1)
+
+    def test_clear(self) -> None:
+        parse_cache = ParseCache()
+        parse("output 1", parse_cache=parse_cache)
+        parse("output 1", parse_cache=parse_cache)
+        parse_cache.clear()
+        assert len(parse_cache) == 0
+        assert (parse_cache.hits, parse_cache.misses) == (0, 0)
+
+    def test_unreadable_grammar_skips_cache(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        # E.g., where the package was installed without its resources
+        def _missing_grammar() -> str:
+            raise FileNotFoundError("grammar.lark")
+
+        anydice._parser()  # ruff: ignore[private-member-access]
+        parse_version = anydice._parse_version  # ruff: ignore[private-member-access]
+        parse_version.cache_clear()
+        monkeypatch.setattr(anydice, "_grammar", _missing_grammar)
+        try:
+            parse_cache = ParseCache()
+            assert parse("output 1", parse_cache=parse_cache).stmts == (
+                OutputStmt(Number(1)),
+            )
+            assert len(parse_cache) == 0
+            assert (parse_cache.hits, parse_cache.misses) == (0, 0)
+        finally:
+            parse_version.cache_clear()
+
+    def test_run_uses_parse_cache(self) -> None:
+        parse_cache = ParseCache()
+        assert run("output 1d2", parse_cache=parse_cache) == [
+            ("output 1", H({1: 1, 2: 1}))
+        ]
+        assert run("output 1d2", parse_cache=parse_cache) == [
+            ("output 1", H({1: 1, 2: 1}))
+        ]
+        assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+
+
+class TestParseCacheOnDisk:
+    def test_shared_between_caches(self, tmp_path: Path) -> None:
+        parse("output 1", parse_cache=ParseCache(path=tmp_path))
+        (cache_file,) = tmp_path.iterdir()
+        assert cache_file.suffix == ".pickle"
+        parse_cache = ParseCache(maxsize=0, path=tmp_path)
+        assert parse("output 1", parse_cache=parse_cache).stmts == (
+            OutputStmt(Number(1)),
+        )
+        assert (parse_cache.hits, parse_cache.misses) == (1, 0)
+
+    def test_corrupt_file_reparsed(self, tmp_path: Path) -> None:
+        parse("output 1", parse_cache=ParseCache(path=tmp_path))
+        (cache_file,) = tmp_path.iterdir()
+        cache_file.write_bytes(b"garbage")
+        parse_cache = ParseCache(path=tmp_path)
+        assert parse("output 1", parse_cache=parse_cache).stmts == (
+            OutputStmt(Number(1)),
+        )
+        assert (parse_cache.hits, parse_cache.misses) == (0, 1)
+        # The corrupt file is replaced
+        assert ParseCache(path=tmp_path).lookup(cache_file.stem) is not None
+
+    def test_unusable_path_ignored(self, tmp_path: Path) -> None:
+        # A file where the cache directory should be
+        path = tmp_path / "cache"
+        path.write_text("")
+        parse_cache = ParseCache(path=path)
+        assert parse("output 1", parse_cache=parse_cache).stmts == (
+            OutputStmt(Number(1)),
+        )
+        assert parse("output 1", parse_cache=parse_cache).stmts == (
+            OutputStmt(Number(1)),
+        )
+        assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+        assert path.is_file()
+
+    def test_unpicklable_program_not_persisted(self, tmp_path: Path) -> None:
+        # Pickling a program this deeply nested exhausts the recursion limit
+        source = "output " + " + ".join(["d6"] * 3000)
+        parse_cache = ParseCache(path=tmp_path)
+        program = parse(source, parse_cache=parse_cache)
+        assert parse(source, parse_cache=parse_cache) is program
+        assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+        assert list(tmp_path.iterdir()) == []
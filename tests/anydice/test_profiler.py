@@ -0,0 +1,156 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+from itertools import count
+
+import pytest
+
+from anydyce.anydice import Profiler, run
+
+__all__ = ()
+
+
+def _ticking_profiler() -> Profiler:
+    r"""Return a profiler whose clock advances by one microsecond each time it's read."""
+    ticks = count()
+    return Profiler(clock=lambda: next(ticks) / 1_000_000)
+
+
+class TestProfiler:
+    def test_results_unchanged(self) -> None:
+        prog = (
+            "function: f N:n { result: N * 2 }\n"
+            "loop I over {1..3} { output [f dI] + [highest 1 of 2d6] }"
+        )
+        assert run(prog, profiler=Profiler()) == run(prog)
+
+    def test_statement_labels(self) -> None:
+        profiler = Profiler()
+        run(
+            "X: 0\n"
+            "loop I over {1..2} {\n"
+            '  if I = 2 { X: X + 1 } else { output 1d6 named "[I]" }\n'
+            "}\n"
+            "output X",
+            profiler=profiler,
+        )
+        assert {label: stats.count for label, stats in profiler.stats.items()} == {
+            "1: X: 0": 1,
+            "2: loop I over {1..2}": 1,
+            "2.1: if I = 2": 2,
+            '2.1.2.1: output 1d6 named "[I]"': 1,
+            "2.1.1.1: X: X + 1": 1,
+            "3: output X": 1,
+        }
+        assert {stats.kind for stats in profiler.stats.values()} == {"statement"}
+
+    def test_calls(self) -> None:
+        profiler = Profiler()
+        run(
+            "function: f A:n and B:n { result: A + B }\n"
+            "output [f d6 and d4]\n"
+            "output [highest 2 of 3d6]",
+            profiler=profiler,
+        )
+        f_stats = profiler.stats["function: f A:n and B:n"]
+        assert (f_stats.kind, f_stats.count, f_stats.combos) == ("function", 1, 24)
+        assert f_stats.max_outcomes == 9
+        body_stats = profiler.stats["function: f A:n and B:n > 1: result: A + B"]
+        assert body_stats.count == 24
+        highest_stats = profiler.stats["[highest _ of _]"]
+        assert (highest_stats.kind, highest_stats.count) == ("builtin", 1)
+        assert highest_stats.max_outcomes == 11
+        assert profiler.stats["2: output [f d6 and d4]"].max_outcomes == 9
+
+    def test_times(self) -> None:
+        profiler = _ticking_profiler()
+        run("function: f N:n { result: N }\noutput [f 1]", profiler=profiler)
+        # Clock reads: 0 and 1 around the definition, then 2 entering the output,
+        # 3 entering the call, 4 and 5 around the body, 6 leaving the call, and 7
+        # leaving the output
+        stats = profiler.stats
+        assert stats["1: function: f N:n"].cumulative_time == pytest.approx(1e-6)
+        assert stats["2: output [f 1]"].cumulative_time == pytest.approx(5e-6)
+        assert stats["2: output [f 1]"].self_time == pytest.approx(2e-6)
+        assert stats["function: f N:n"].cumulative_time == pytest.approx(3e-6)
+        assert stats["function: f N:n"].self_time == pytest.approx(2e-6)
+        assert profiler.collapsed() == (
+            "1: function: f N:n 1\n"
+            "2: output [f 1] 2\n"
+            "2: output [f 1];function: f N:n 2\n"
+            "2: output [f 1];function: f N:n;function: f N:n > 1: result: N 1"
+        )
+
+    def test_recursion_counted_once(self) -> None:
+        profiler = _ticking_profiler()
+        run(
+            'set "maximum function depth" to 100\n'
+            "function: f N:n { if N = 0 { result: 0 } result: [f N - 1] }\n"
+            "output [f 20]",
+            profiler=profiler,
+        )
+        stats = profiler.stats
+        assert stats["function: f N:n"].count == 21
+        assert (
+            stats["function: f N:n"].cumulative_time
+            < stats["3: output [f 20]"].cumulative_time
+        )
+        total_self_time = sum(s.self_time for s in stats.values())
+        total_time = sum(
+            s.cumulative_time for label, s in stats.items() if label[0].isdigit()
+        )
+        assert total_self_time == pytest.approx(total_time)
+
+    def test_deep_recursion_collapsed(self) -> None:
+        profiler = Profiler()
+        run(
+            'set "maximum function depth" to 3000\n'
+            "function: f N:n { if N = 0 { result: 0 } result: [f N - 1] }\n"
+            "output [f 2000]",
+            profiler=profiler,
+        )
+        assert profiler.stats["function: f N:n"].count == 2001
+        assert len(profiler.collapsed().splitlines()) > 2000
+
+    def test_collapsed_separators(self) -> None:
+        profiler = _ticking_profiler()
+        run('output 1 named "a;b"', profiler=profiler)
+        assert profiler.collapsed() == '1: output 1 named "a,b" 1'
+
+    def test_accumulates_until_cleared(self) -> None:
+        profiler = Profiler()
+        run("output 1", profiler=profiler)
+        run("output 1", profiler=profiler)
+        assert profiler.stats["1: output 1"].count == 2
+        profiler.clear()
+        assert profiler.stats == {}
+        assert profiler.collapsed() == ""
+
+    def test_error_unwinds(self) -> None:
+        profiler = _ticking_profiler()
+        with pytest.raises(NameError):
+            run("function: f N:n { result: X }\noutput [f 1]", profiler=profiler)
+        profiler.clear()
+        run("output 2", profiler=profiler)
+        assert profiler.collapsed() == "1: output 2 1"
+
+    def test_table(self) -> None:
+        profiler = _ticking_profiler()
+        run("function: f N:n { result: N }\noutput [f 1]", profiler=profiler)
+        assert profiler.table(limit=2).splitlines() == [
+            "   count   cumul ms    self ms   combos outcomes  label",
+            "       1      0.005      0.002        0        0  2: output [f 1]",
+            "       1      0.003      0.002        0        0  function: f N:n",
+        ]
@@ -0,0 +1,157 @@
+# ======================================================================================
+# Copyright and other protections apply. Please see the accompanying LICENSE file for
+# rights and restrictions governing use of this software. All rights not expressly
+# waived or licensed are reserved. If that file is missing or appears to be modified
+# from its original, then please contact the author before viewing or using this
+# software in any capacity.
+#
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!! IMPORTANT: READ THIS BEFORE EDITING! !!!!!!!!!!!!!!!
+# !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+# Please keep each docstring sentence on its own unwrapped line. It looks like crap in a
+# text editor, but it has no effect on rendering, and it allows much more useful diffs.
+# (This does not apply to code comments.) Thank you!
+# ======================================================================================
+
+import pytest
+from dyce import H, P
+
+from anydyce.anydice import SelectionCache, run
+from anydyce.anydice.selection_cache import pool_key
+
+__all__ = ()
+
+
+class TestPoolKey:
+    def test_order_insensitive(self) -> None:
+        assert pool_key(P(H(4), H(6))) == pool_key(P(H(6), H(4)))
+
+    def test_counts_distinguished(self) -> None:
+        assert pool_key(P(H({1: 1, 2: 1}))) != pool_key(P(H({1: 2, 2: 2})))
+        assert pool_key(2 @ P(6)) != pool_key(3 @ P(6))
+
+
+class TestSelectionCache:
+    def test_hit_returns_stored_selection(self) -> None:
+        selection_cache = SelectionCache()
+        first = selection_cache.select("a", lambda: H(6))
+        assert selection_cache.select("a", lambda: H(4)) is first
+        assert (selection_cache.hits, selection_cache.misses) == (1, 1)
+
+    def test_least_recently_used_evicted(self) -> None:
+        # Each selection holds 3 values (its key, and one outcome and its count)
+        selection_cache = SelectionCache(max_values=6)
+        selection_cache.select("a", lambda: H({1: 1}))
+        selection_cache.select("b", lambda: H({2: 1}))
+        selection_cache.select("a", lambda: H({1: 1}))
+        selection_cache.select("c", lambda: H({3: 1}))  # evicts "b"
+        assert len(selection_cache) == 2
+        assert selection_cache.values == 6
+        assert selection_cache.select("b", lambda: H({4: 1})) == H({4: 1})
+        assert (selection_cache.hits, selection_cache.misses) == (1, 4)
+
+    def test_bounded_by_values(self) -> None:
+        selection_cache = SelectionCache(max_values=30)
+        selection_cache.select(("a", 1), lambda: H(6))  # 2 + 12 values
+        selection_cache.select(("b", (1, 2)), lambda: H(4))  # 3 + 8 values
+        assert (len(selection_cache), selection_cache.values) == (2, 25)
+        selection_cache.select("c", lambda: H(3))  # 1 + 6 values, evicts "a"
+        assert (len(selection_cache), selection_cache.values) == (2, 18)
+        assert selection_cache.select(("b", (1, 2)), lambda: H(2)) == H(4)
+
+    def test_oversized_selection_not_kept(self) -> None:
+        selection_cache = SelectionCache(max_values=30)
+        selection_cache.select("a", lambda: H(4))
+        assert selection_cache.select("b", lambda: H(20)) == H(20)
+        assert (len(selection_cache), selection_cache.values) == (1, 9)
+        assert selection_cache.select("b", lambda: H(2)) == H(2)
+        assert (selection_cache.hits, selection_cache.misses) == (0, 3)
+
+    def test_lowering_max_values_evicts(self) -> None:
+        selection_cache = SelectionCache()
+        selection_cache.select("a", lambda: H(4))
+        selection_cache.select("b", lambda: H(6))
+        selection_cache.max_values = 20
+        assert (len(selection_cache), selection_cache.values) == (1, 13)
+        assert selection_cache.select("b", lambda: H(2)) == H(6)
+        selection_cache.max_values = 0
+        assert (len(selection_cache), selection_cache.values) == (0, 0)
+        with pytest.raises(ValueError, match=r"non-negative"):
+            selection_cache.max_values = -1
+
+    def test_zero_max_values_keeps_nothing(self) -> None:
+        selection_cache = SelectionCache(max_values=0)
+        selection_cache.select("a", lambda: H(1))
+        assert selection_cache.select("a", lambda: H(2)) == H(2)
+        assert len(selection_cache) == 0
+        assert (selection_cache.hits, selection_cache.misses) == (0, 2)
+
+    def test_negative_max_values(self) -> None:
+        with pytest.raises(ValueError, match=r"non-negative"):
+            SelectionCache(max_values=-1)
+
+    def test_clear(self) -> None:
+        selection_cache = SelectionCache()
+        selection_cache.select("a", lambda: H(1))
+        selection_cache.select("a", lambda: H(1))
+        selection_cache.clear()
+        assert (len(selection_cache), selection_cache.values) == (0, 0)
+        assert (selection_cache.hits, selection_cache.misses) == (0, 0)
+
+
+class TestRunSelectionCache:
+    def test_positions_of_same_pool(self) -> None:
+        selection_cache = SelectionCache()
+        prog = "output 1@3d6\noutput 2@3d6\noutput 1@3d6"
+        expected = [
+            ("output 1", (3 @ P(6)).h(-1)),
+            ("output 2", (3 @ P(6)).h(-2)),
+            ("output 3", (3 @ P(6)).h(-1)),
+        ]
+        assert run(prog, selection_cache=selection_cache) == expected
+        assert (selection_cache.hits, selection_cache.misses) == (1, 2)
+        assert run(prog, selection_cache=selection_cache) == expected
+        assert (selection_cache.hits, selection_cache.misses) == (4, 2)
+
+    def test_position_order_distinguished(self) -> None:
+        selection_cache = SelectionCache()
+        prog = 'output 1@3d6\nset "position order" to "lowest first"\noutput 1@3d6'
+        assert run(prog, selection_cache=selection_cache) == [
+            ("output 1", (3 @ P(6)).h(-1)),
+            ("output 2", (3 @ P(6)).h(0)),
+        ]
+        assert (selection_cache.hits, selection_cache.misses) == (0, 2)
+
+    def test_selection_builtins(self) -> None:
+        selection_cache = SelectionCache()
+        prog = (
+            "output [highest 2 of 4d6]\n"
+            "output [highest 2 of 4d6]\n"
+            "output [lowest 2 of 4d6]\n"
+            "output [highest 1 of d4 and d6]\n"
+            "output [highest 1 of d4 and d6]"
+        )
+        assert run(prog, selection_cache=selection_cache) == [
+            ("output 1", (4 @ P(6)).h(slice(-2, None))),
+            ("output 2", (4 @ P(6)).h(slice(-2, None))),
+            ("output 3", (4 @ P(6)).h(slice(2))),
+            ("output 4", P(4, 6).h(-1)),
+            ("output 5", P(4, 6).h(-1)),
+        ]
+        assert (selection_cache.hits, selection_cache.misses) == (2, 3)
+
+    def test_calculation_precision_distinguished(self) -> None:
+        selection_cache = SelectionCache()
+        prog = "output [highest 3 of 8d20]"
+        exact = run(prog, selection_cache=selection_cache)
+        quantized = run(
+            'set "anydyce: calculation precision" to 8\n' + prog,
+            selection_cache=selection_cache,
+        )
+        assert (selection_cache.hits, selection_cache.misses) == (0, 2)
+        assert quantized[0][1].total < exact[0][1].total
+
+    def test_disabled(self) -> None:
+        assert run("output 1@3d6", selection_cache=None) == [
+            ("output 1", (3 @ P(6)).h(-1))
+        ]
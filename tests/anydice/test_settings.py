@@ -106,3 +106,32 @@ class TestSymbolicValues:
         s = Settings()
         with pytest.raises(ValueError, match=r"(?i)\binvalid\b"):
             s.set("anydyce: display precision", "nonsense")
+
+
+class TestConvolution:
+    def test_default(self) -> None:
+        s = Settings()
+        assert s.convolution == "exact"
+        assert not s.fft_convolution()
+
+    def test_fft_requires_finite_calc_precision(self) -> None:
+        s = Settings()
+        s.set("anydyce: convolution", "fft")
+        s.set("anydyce: calculation precision", 52)
+        assert s.fft_convolution()
+        s.set("anydyce: calculation precision", "exact")
+        assert s.convolution == "fft"
+        assert not s.fft_convolution()
+
+    @pytest.mark.parametrize("bit_width", [53, "low", "medium", "high", "default"])
+    def test_fft_requires_narrow_calc_precision(self, bit_width: int | str) -> None:
+        s = Settings()
+        s.set("anydyce: convolution", "fft")
+        s.set("anydyce: calculation precision", bit_width)
+        assert s.convolution == "fft"
+        assert not s.fft_convolution()
+
+    def test_rejects_unknown_value(self) -> None:
+        s = Settings()
+        with pytest.raises(ValueError, match=r"(?i)\binvalid\b"):
+            s.set("anydyce: convolution", "fast")
@@ -30,7 +30,12 @@ except ImportError:
 
 
 from anydyce import magic as anydyce_magic
-from anydyce.anydice import AnyDiceResultsT, Settings
+from anydyce.anydice import (
+    AnyDiceResultsT,
+    CancellationToken,
+    RunCancelledError,
+    Settings,
+)
 from anydyce.anydice.fetch import NetworkError, NoSuchProgramError
 from anydyce.magic import anyd, anyd_load, load_ipython_extension
 
@@ -184,6 +189,35 @@ class TestAnydMagicErrorsPropagate:
             anyd("--text", "output [undefined function 1 2 3]")
 
 
+class TestAnydMagicCancellation:
+    def test_cancel_token(
+        self,
+        ipython_shell: InteractiveShell,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        monkeypatch.setattr(anydyce_magic, "get_ipython", lambda: ipython_shell)
+        cancel_token = CancellationToken()
+        monkeypatch.setitem(ipython_shell.user_ns, "TOKEN", cancel_token)
+        anyd("--text --cancel-token TOKEN", "output 1d6")
+        assert "output 1" in capsys.readouterr().out
+        cancel_token.cancel()
+        with pytest.raises(RunCancelledError):
+            anyd("--text --cancel-token TOKEN", "output 1d6")
+
+    def test_not_a_cancel_token(
+        self, ipython_shell: InteractiveShell, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        from IPython.core.error import UsageError
+
+        monkeypatch.setattr(anydyce_magic, "get_ipython", lambda: ipython_shell)
+        monkeypatch.setitem(ipython_shell.user_ns, "TOKEN", 1)
+        with pytest.raises(UsageError, match=r"'TOKEN' is not a CancellationToken"):
+            anyd("--text --cancel-token TOKEN", "output 1d6")
+        with pytest.raises(UsageError, match=r"'MISSING' is not a CancellationToken"):
+            anyd("--text --cancel-token MISSING", "output 1d6")
+
+
 class TestAnydMagicWarnings:
     def test_warning_suppressed(
         self,
@@ -193,16 +227,22 @@ class TestAnydMagicWarnings:
         original_run = anydyce_magic.run
 
         def _emit_deprecation(
-            source: str, *, settings: Settings | None = None
+            source: str,
+            *,
+            settings: Settings | None = None,
+            cancel_token: CancellationToken | None = None,
         ) -> AnyDiceResultsT:
             warnings.warn("test deprecation", DeprecationWarning, stacklevel=2)
-            return original_run(source, settings=settings)
+            return original_run(source, settings=settings, cancel_token=cancel_token)
 
         def _emit_experimental(
-            source: str, *, settings: Settings | None = None
+            source: str,
+            *,
+            settings: Settings | None = None,
+            cancel_token: CancellationToken | None = None,
         ) -> AnyDiceResultsT:
             warnings.warn("test experimental", ExperimentalWarning, stacklevel=2)
-            return original_run(source, settings=settings)
+            return original_run(source, settings=settings, cancel_token=cancel_token)
 
         monkeypatch.setattr(anydyce_magic, "run", _emit_deprecation)
         anyd("--text", "output 1d6")
@@ -224,10 +264,13 @@ class TestAnydMagicWarnings:
         original_run = anydyce_magic.run
 
         def _emit_truncation(
-            source: str, *, settings: Settings | None = None
+            source: str,
+            *,
+            settings: Settings | None = None,
+            cancel_token: CancellationToken | None = None,
         ) -> AnyDiceResultsT:
             warnings.warn("test truncation", TruncationWarning, stacklevel=2)
-            return original_run(source, settings=settings)
+            return original_run(source, settings=settings, cancel_token=cancel_token)
 
         monkeypatch.setattr(anydyce_magic, "run", _emit_truncation)
         anyd("--text", "output 1d6")